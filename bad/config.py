@@ -30,8 +30,50 @@ TEMP_PATH: Path = config(
     cast=Path,
 )
 
+# output of processes
+LOG_PATH: Path = config("BAD_LOG_PATH", default=str(TEMP_PATH / "logs"), cast=Path)
+# size of a process log file before it is rotated and number of kept rotated files
+LOG_MAX_BYTES: int = config("BAD_LOG_MAX_BYTES", default=10 * 2 ** 20, cast=int)
+LOG_BACKUP_COUNT: int = config("BAD_LOG_BACKUP_COUNT", default=3, cast=int)
+
 MATLAB_PATH: Path = Path(config("BAD_MATLAB_PATH", default="", cast=str).rstrip("/"))
 CAT12_PATH: Path = Path(config("BAD_CAT12_PATH", default="", cast=str).rstrip("/"))
+# run CAT12 scripts in a long-running worker per process instead of starting the runtime each time
+#   (not yet verified with a real CAT12 installation)
+CAT12_WORKER: bool = config("BAD_CAT12_WORKER", default="false", cast=_to_bool)
+
+# -- process scheduler --
+
+# number of CPU slots shared by all concurrently running processes
+SCHEDULER_CPUS: int = config("BAD_SCHEDULER_CPUS", default=os.cpu_count() or 1, cast=int)
+# gigabytes of memory shared by all concurrently running processes, 0 for no limit
+SCHEDULER_MEMORY: float = config("BAD_SCHEDULER_MEMORY", default=0., cast=float)
+# gigabytes of memory per worker process of a preprocessing pipeline, reserved in SCHEDULER_MEMORY
+PREPROCESS_MEMORY_PER_PROCESS: float = config("BAD_PREPROCESS_MEMORY_PER_PROCESS", default=2., cast=float)
+# the same for pipelines with CAT12 modules, which run a matlab runtime per worker process
+CAT12_MEMORY_PER_PROCESS: float = config("BAD_CAT12_MEMORY_PER_PROCESS", default=6., cast=float)
+# how processes are started, "forkserver" (forked from a python runtime with preloaded modules)
+# or "subprocess" (a new python interpreter for each process)
+PROCESS_RUNTIME: str = config("BAD_PROCESS_RUNTIME", default="forkserver", cast=str)
+# local UDP port on which the scheduler is notified about requested processes, 0 to only poll
+#   (e.g. if processes are requested from another host)
+SCHEDULER_NOTIFY_PORT: int = config("BAD_SCHEDULER_NOTIFY_PORT", default=9010, cast=int)
+
+# -- work queue (distributed preprocessing) --
+
+# number of worker processes started by `main.py worker` on each node
+WORKER_PROCESSES: int = config("BAD_WORKER_PROCESSES", default=os.cpu_count() or 1, cast=int)
+# seconds after which an item of a worker that stopped sending heartbeats is claimed by another worker
+WORK_QUEUE_LEASE_SECONDS: float = config("BAD_WORK_QUEUE_LEASE_SECONDS", default=60., cast=float)
+# maximum number of work items a distributed process is split into
+WORK_QUEUE_MAX_ITEMS: int = config("BAD_WORK_QUEUE_MAX_ITEMS", default=1000, cast=int)
+
+# -- memory watchdog of process worker pools --
+
+# seconds between memory samples, 0 to disable
+WATCHDOG_INTERVAL: float = config("BAD_WATCHDOG_INTERVAL", default=5., cast=float)
+# gigabytes of host memory that should stay available, below that fewer workers are active
+WATCHDOG_MIN_AVAILABLE_MEMORY: float = config("BAD_WATCHDOG_MIN_AVAILABLE_MEMORY", default=2., cast=float)
 
 # -- API server --
 
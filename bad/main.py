@@ -1,9 +1,9 @@
 import argparse
 import multiprocessing
 
-from bad import logger
+from bad import config, logger
 from bad.server import Server
-from bad.process import ProcessScheduler
+from bad.process import ProcessDb, ProcessScheduler, WorkQueueWorker
 
 # add plugins here
 import bad.plugins.essential
@@ -14,8 +14,13 @@ import bad.plugins.analysis
 def add_arguments(parser: argparse.ArgumentParser):
     parser.add_argument(
         "service", type=str, nargs="?", default="both",
-        choices=["server", "scheduler", "both"],
-        help="Choose to run the web-server, the process scheduler or both",
+        choices=["server", "scheduler", "both", "worker"],
+        help="Choose to run the web-server, the process scheduler, both"
+             " or the work queue workers for distributed processes",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help=f"Number of work queue worker processes, defaults to {config.WORKER_PROCESSES}",
     )
 
 
@@ -37,6 +42,35 @@ def run_scheduler(args):
         logger.log.info("scheduler stopped")
 
 
+def _run_work_queue_worker():
+    worker = WorkQueueWorker(ProcessDb().work_queue())
+    try:
+        worker.run()
+    except KeyboardInterrupt:
+        pass
+
+
+def run_workers(args):
+    num_workers = args.workers or config.WORKER_PROCESSES
+    processes = [
+        multiprocessing.Process(target=_run_work_queue_worker, name=f"work-queue-worker-{i}")
+        for i in range(num_workers)
+    ]
+    for proc in processes:
+        proc.start()
+    logger.log.info(f"started {num_workers} work queue workers")
+
+    try:
+        for proc in processes:
+            proc.join()
+    except KeyboardInterrupt:
+        logger.log.info("workers stopped")
+    finally:
+        for proc in processes:
+            if proc.is_alive():
+                proc.terminate()
+
+
 def run_both(args):
     proc = multiprocessing.Process(target=run_scheduler, args=(args, ))
     proc.start()
@@ -61,6 +95,8 @@ def main(args):
         run_server(args)
     elif args.service == "scheduler":
         run_scheduler(args)
+    elif args.service == "worker":
+        run_workers(args)
     else:
         run_both(args)
 
@@ -1,8 +1,9 @@
 import inspect
 import os
-from typing import List, Dict, Type, Any, Optional, Generator, Iterable, Union
+from typing import List, Dict, Type, Any, Optional, Generator, Iterable, Union, Tuple
 
 from bad.logger import Logger
+from bad.util.region import Region
 from bad.util.text import strip_help_text
 from .params import *
 from .form import Form
@@ -251,5 +252,33 @@ class ProcessModuleBase(Module):
     ) -> Generator[ModuleObject, None, None]:
         raise NotImplementedError
 
+    def get_input_region(
+            self,
+            input_shape: Tuple[int, ...],
+            output_region: Optional[Region] = None,
+    ) -> Optional[Region]:
+        """
+        Return the voxel region of an input image with `input_shape`
+        that is needed to produce `output_region` of the output.
+
+        `None` means the whole image. The `ModuleGraph` uses this
+        to only read the needed voxels from the source files.
+
+        Overriding modules must make sure that their output (within `output_region`)
+        does not depend on any voxel outside the returned region.
+        By default, the whole input is needed.
+        """
+        return None
+
+    def get_output_shape(self, input_shape: Tuple[int, ...]) -> Optional[Tuple[int, ...]]:
+        """
+        Return the shape of the output image for an input image of `input_shape`.
+
+        `None` means the shape is not known in advance. The `ModuleGraph` needs
+        it to pass the correct input shape to the `get_input_region` of the
+        following module. By default, it is unknown.
+        """
+        return None
+
 
 ModuleLike = Union[Module, SourceModuleBase, FilterModuleBase, ProcessModuleBase]
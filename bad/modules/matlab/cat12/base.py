@@ -1,20 +1,25 @@
 import glob
+import hashlib
 import re
 import os
 import secrets
 import shutil
 import subprocess
+import time
 from pathlib import Path
-from typing import List, Union, Iterable, Generator
+from typing import List, Union, Iterable, Generator, Sequence, Dict, Tuple
 
 import nibabel
 
 from bad import config
 from bad.util.filenames import strip_compression_extension
+from bad.util.files import copy_file
+from bad.util.image import unmodified_image_filename
 from bad.modules.base import Module, ModuleGroup
 from bad.modules.object import ModuleObjectType, ImageObject, FileObject
 from bad.modules.process.image import ImageProcessModuleBase
 from bad.modules.params import *
+from .worker import get_cat12_worker, Cat12WorkerJob
 
 
 class Cat12ModuleBase(ImageProcessModuleBase):
@@ -26,6 +31,17 @@ class Cat12ModuleBase(ImageProcessModuleBase):
     # set this to True in derived class if the cat12 module supports nii.gz files
     handles_nii_gz = False
 
+    # maximum number of images passed to one CAT12 call,
+    #   each call has to start the matlab runtime
+    batch_size = 8
+
+    # seconds between checks for finished outputs, see `iter_finished_cat12()`
+    poll_interval = 1.
+
+    # set this to True in derived class if the cat12 script does not write
+    #   to its input files, so unmodified source files can be linked
+    link_inputs = False
+
     def process_nii_files(
             self,
             input_images: Iterable[ImageObject],
@@ -73,55 +89,224 @@ class Cat12ModuleBase(ImageProcessModuleBase):
             images: Iterable[ImageObject],
             stub: bool = False
     ) -> Generator[ImageObject, None, None]:
+        batch = []
+        for image in images:
+            batch.append(image)
+            if len(batch) >= self.batch_size:
+                yield from self.process_image_batch(batch, stub=stub)
+                batch = []
+
+        if batch:
+            yield from self.process_image_batch(batch, stub=stub)
 
+    def process_image_batch(
+            self,
+            images: List[ImageObject],
+            stub: bool = False
+    ) -> Generator[ImageObject, None, None]:
+        """
+        Store the images as `.nii` files and process them with one CAT12 call
+        """
         temp_path = config.TEMP_PATH / f"module-cat12-{secrets.token_hex(20)}"
         if not stub:
             os.makedirs(temp_path)
 
         try:
-            for image in images:
+            image_filenames = []
+            for idx, image in enumerate(images):
                 # TODO: need to convert to .nii (or nii.gz) if image.filename is not .nii
-                temp_image_name = temp_path / strip_compression_extension(image.filename)
+                # each image gets its own directory because images
+                #   from different sub-paths can have the same filename
+                temp_image_name = temp_path / str(idx) / strip_compression_extension(image.filename)
                 if not stub:
-                    image.src.to_filename(temp_image_name)
+                    os.makedirs(temp_image_name.parent)
+                    self._stage_image(image, temp_image_name)
+
+                image_filenames.append(temp_image_name)
 
-                # TODO: it's possible to bundle a few images to
-                #   speed up the processing
-                yield from self.process_nii_files([image], [temp_image_name], stub=stub)
+            yield from self.process_nii_files(images, image_filenames, stub=stub)
 
         finally:
             if not stub:
                 shutil.rmtree(temp_path, ignore_errors=True)
 
+    def _stage_image(self, image: ImageObject, filename: Path):
+        """
+        Store the image as `.nii` file for CAT12.
+
+        Unmodified `.nii` files are linked (if `link_inputs`) or
+        copied instead of being encoded again by nibabel.
+        """
+        source_filename = unmodified_image_filename(image.src)
+        if source_filename is None or source_filename.suffix.lower() != ".nii":
+            image.src.to_filename(filename)
+            return
+
+        if self.link_inputs:
+            for link in (os.link, os.symlink):
+                try:
+                    link(source_filename.resolve(), filename)
+                    return
+                except OSError:
+                    pass
+
+        copy_file(source_filename, filename)
+
     def call_cat12(
             self,
             script_name: str,
             *args: str,
             parameters: Optional[dict] = None,
     ):
-        temp_path = config.TEMP_PATH / f"module-cat12-{secrets.token_hex(20)}"
+        """
+        Run a CAT12 script and wait until it's finished
+        """
+        process = self.start_cat12(script_name, *args, parameters=parameters)
+        if process.wait():
+            raise subprocess.CalledProcessError(process.returncode, process.args)
 
-        try:
-            script_filename = config.CAT12_PATH / "standalone" / f"{script_name}.m"
+    def start_cat12(
+            self,
+            script_name: str,
+            *args: str,
+            parameters: Optional[dict] = None,
+    ) -> Union[subprocess.Popen, Cat12WorkerJob]:
+        """
+        Start a CAT12 script and return without waiting.
 
-            if parameters:
-                os.makedirs(temp_path)
-                script = script_filename.read_text()
-                patched_script = self._patch_script(script, parameters)
-                script_filename = config.TEMP_PATH / f"patched_{script_name}.m"
-                script_filename.write_text(patched_script)
+        The script runs in a new subprocess or, if `config.CAT12_WORKER`
+        is enabled, as a job of the CAT12 worker of this process.
+        """
+        script_filename = config.CAT12_PATH / "standalone" / f"{script_name}.m"
 
-            full_args = [
-                config.CAT12_PATH / "standalone" / "cat_standalone.sh",
-                "-m", config.MATLAB_PATH,
-                "-b", script_filename,
-                *args,
-            ]
+        if parameters:
+            script = script_filename.read_text()
+            script_filename = self._write_patched_script(
+                script_name, self._patch_script(script, parameters)
+            )
 
-            subprocess.check_call(full_args)
+        if config.CAT12_WORKER:
+            return get_cat12_worker().submit("-b", script_filename, *args)
+
+        full_args = [
+            config.CAT12_PATH / "standalone" / "cat_standalone.sh",
+            "-m", config.MATLAB_PATH,
+            "-b", script_filename,
+            *args,
+        ]
+
+        return subprocess.Popen(full_args)
+
+    def _write_patched_script(self, script_name: str, script: str) -> Path:
+        """
+        Store the script in `TEMP_PATH`, named by the hash of its content,
+        so parallel processes with different parameters do not overwrite each other
+        """
+        script_hash = hashlib.sha1(script.encode()).hexdigest()[:16]
+        script_filename = config.TEMP_PATH / f"patched_{script_name}_{script_hash}.m"
+        if not script_filename.exists():
+            os.makedirs(config.TEMP_PATH, exist_ok=True)
+            temp_filename = config.TEMP_PATH / f"{script_filename.name}.{secrets.token_hex(8)}"
+            temp_filename.write_text(script)
+            os.replace(temp_filename, script_filename)
+
+        return script_filename
+
+    def iter_finished_cat12(
+            self,
+            script_name: str,
+            image_filenames: Sequence[Path],
+            *args: str,
+            parameters: Optional[dict] = None,
+    ) -> Generator[int, None, None]:
+        """
+        Run a CAT12 script on `image_filenames` and yield the index
+        of each image, in order, as soon as its outputs are finished.
+
+        While the script is running, `get_output_sizes()` is
+        polled every `poll_interval` seconds, afterwards all
+        remaining indices are yielded.
+
+        If the script fails, the indices of the images whose outputs
+        are finished are still yielded and the other images are run
+        one at a time. The first error is raised afterwards.
+        """
+        process = self.start_cat12(script_name, *args, *image_filenames, parameters=parameters)
+        try:
+            next_index = 0
+            output_sizes: Dict[int, Tuple[int, ...]] = {}
+            while next_index < len(image_filenames):
+                if process.poll() is not None:
+                    if process.returncode:
+                        error = subprocess.CalledProcessError(process.returncode, process.args)
+                        if len(image_filenames) == 1:
+                            raise error
+                        yield from self._iter_finished_cat12_single(
+                            error, script_name, image_filenames, next_index, *args, parameters=parameters,
+                        )
+                        break
+                    yield from range(next_index, len(image_filenames))
+                    break
+
+                while next_index < len(image_filenames):
+                    # outputs must exist and not grow since the last poll
+                    sizes = self.get_output_sizes(image_filenames[next_index])
+                    if sizes is None or output_sizes.get(next_index) != sizes:
+                        if sizes is not None:
+                            output_sizes[next_index] = sizes
+                        break
+                    yield next_index
+                    next_index += 1
+
+                time.sleep(self.poll_interval)
 
         finally:
-            shutil.rmtree(temp_path, ignore_errors=True)
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+
+    def _iter_finished_cat12_single(
+            self,
+            error: subprocess.CalledProcessError,
+            script_name: str,
+            image_filenames: Sequence[Path],
+            next_index: int,
+            *args: str,
+            parameters: Optional[dict] = None,
+    ) -> Generator[int, None, None]:
+        """
+        Yield the finished indices after the CAT12 call of all `image_filenames` failed,
+        starting with `next_index`, and run the unfinished images one at a time
+        """
+        self.log.warning(
+            f"CAT12 failed for a batch of {len(image_filenames)} images"
+            f", retrying the unfinished ones one at a time: {error}"
+        )
+        first_error = None
+        for index in range(next_index, len(image_filenames)):
+            if self.get_output_sizes(image_filenames[index]) is not None:
+                yield index
+                continue
+            try:
+                for _ in self.iter_finished_cat12(
+                        script_name, image_filenames[index:index + 1], *args, parameters=parameters,
+                ):
+                    yield index
+            except subprocess.CalledProcessError as e:
+                first_error = first_error or e
+
+        if first_error is not None:
+            raise first_error
+
+    def get_output_sizes(self, image_filename: Path) -> Optional[Tuple[int, ...]]:
+        """
+        Override to return the sizes of all output files of the `.nii` file
+        once the CAT12 script has finished them or None before.
+
+        The default is None which means that outputs are only
+        passed on after the whole CAT12 call.
+        """
+        return None
 
     def _patch_script(self, script: str, parameters: dict) -> str:
         script_lines = script.splitlines()
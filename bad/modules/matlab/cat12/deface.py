@@ -3,6 +3,8 @@ from .base import *
 
 class Cat12Deface(Cat12ModuleBase):
     name = "cat12_deface"
+    # writes prefixed copies of the inputs
+    link_inputs = True
 
     def process_nii_files(
             self,
@@ -10,17 +12,20 @@ class Cat12Deface(Cat12ModuleBase):
             image_filenames: Iterable[Path],
             stub: bool = False,
     ) -> Generator[Union[ImageObject, FileObject], None, None]:
-        if not stub:
-            self.call_cat12(
+        input_images, image_filenames = list(input_images), list(image_filenames)
+        if stub:
+            for image in input_images:
+                yield self.image_replace(image)
+            return
+
+        # a failing image does not fail the others of the batch, see `iter_finished_cat12`
+        for idx in self.iter_finished_cat12(
                 "cat_standalone_deface",
-                *image_filenames,
+                image_filenames,
+        ):
+            new_filename = image_filenames[idx]
+            yield self.image_replace(
+                input_images[idx],
+                src=new_filename.parent / f"anon_{new_filename.name}",
             )
-        for image, new_filename in zip(input_images, image_filenames):
-            if stub:
-                yield self.image_replace(image)
-            else:
-                yield self.image_replace(
-                    image,
-                    src=new_filename.parent / f"anon_{new_filename.name}",
-                )
 
@@ -129,12 +129,19 @@ class Cat12Preprocess(Cat12ModuleBase):
         *Cat12ModuleBase.parameters,
     ]
 
+    image_prefixes = [
+        "mwp1", "mwp2", "p0", "wm", "y_",
+    ]
+
     def process_nii_files(
             self,
             input_images: Iterable[ImageObject],
             image_filenames: Iterable[Path],
             stub: bool = False,
     ) -> Generator[Union[ImageObject, FileObject], None, None]:
+        input_images = list(input_images)
+        image_filenames = list(image_filenames)
+
         if not stub:
             parameter_map = {
                 "spm.tools.cat.estwrite.output.surface": "output_surface",
@@ -167,23 +174,17 @@ class Cat12Preprocess(Cat12ModuleBase):
                     value = float("-Inf")
                 parameters[setting_name] = value
 
-            self.call_cat12(
+            finished_indices = self.iter_finished_cat12(
                 "cat_standalone_segment",
-                *image_filenames,
+                image_filenames,
                 parameters=parameters,
             )
+        else:
+            finished_indices = range(len(image_filenames))
 
-        # TODO: Lots actually!
-        #   One thing: we could actually check for finished files parallel to the cat12 call
-        #   and pass them on already.
-
-        image_prefixes = [
-            "mwp1", "mwp2", "p0", "wm", "y_",
-        ]
-
-        for image, fn in zip(input_images, image_filenames):
-            for prefix in image_prefixes:
-                output_filename = fn.parent / "mri" / f"{prefix}{strip_compression_extension(fn.name)}"
+        for idx in finished_indices:
+            image, fn = input_images[idx], image_filenames[idx]
+            for prefix, output_filename in zip(self.image_prefixes, self.output_filenames(fn)):
                 if output_filename.exists() or stub:
                     yield self.image_replace(
                         image,
@@ -192,3 +193,22 @@ class Cat12Preprocess(Cat12ModuleBase):
                         filename_prefix=f"{prefix.rstrip('_')}_",
                         sub_path=image.sub_path / "mri",
                     )
+
+    def output_filenames(self, image_filename: Path) -> List[Path]:
+        return [
+            image_filename.parent / "mri" / f"{prefix}{strip_compression_extension(image_filename.name)}"
+            for prefix in self.image_prefixes
+        ]
+
+    def get_output_sizes(self, image_filename: Path) -> Optional[Tuple[int, ...]]:
+        # CAT12 processes one image after the other and writes
+        #   the report xml after the segmentation volumes
+        name = Path(strip_compression_extension(image_filename.name)).stem
+        report_filename = image_filename.parent / "report" / f"cat_{name}.xml"
+        if not report_filename.exists():
+            return None
+
+        return tuple(
+            fn.stat().st_size if fn.exists() else -1
+            for fn in (report_filename, *self.output_filenames(image_filename))
+        )
@@ -3,6 +3,8 @@ from .base import *
 
 class Cat12Smooth(Cat12ModuleBase):
     name = "cat12_smooth"
+    # writes prefixed copies of the inputs
+    link_inputs = True
 
     parameters = [
         ParameterFloat(
@@ -23,21 +25,24 @@ class Cat12Smooth(Cat12ModuleBase):
             image_filenames: Iterable[Path],
             stub: bool = False,
     ) -> Generator[Union[ImageObject, FileObject], None, None]:
-        if not stub:
-            self.call_cat12(
+        input_images, image_filenames = list(input_images), list(image_filenames)
+        if stub:
+            for image in input_images:
+                yield self.image_replace(image)
+            return
+
+        # a failing image does not fail the others of the batch, see `iter_finished_cat12`
+        for idx in self.iter_finished_cat12(
                 "cat_standalone_smooth",
+                image_filenames,
                 "-a1", repr(self.smooth_vector()),
                 "-a2", " 'smooth_' ",
-                *image_filenames,
+        ):
+            new_filename = image_filenames[idx]
+            yield self.image_replace(
+                input_images[idx],
+                src=new_filename.parent / f"smooth_{new_filename.name}",
             )
-        for image, new_filename in zip(input_images, image_filenames):
-            if stub:
-                yield self.image_replace(image)
-            else:
-                yield self.image_replace(
-                    image,
-                    src=new_filename.parent / f"smooth_{new_filename.name}",
-                )
 
     def smooth_vector(self) -> List[float]:
         return [
@@ -0,0 +1,280 @@
+import os
+import secrets
+import shutil
+import subprocess
+import time
+from multiprocessing.util import Finalize
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple, Union
+
+from bad import config
+from bad.logger import Logger
+
+
+WORKER_SCRIPT = """% brainage-designer CAT12 worker
+% runs the batch file of each job of the queue directory
+% the field for the input files that cat_standalone.sh fills in, the worker has none
+% worker_files = '<UNDEFINED>';
+queue_path = '{queue_path}';
+job_path = fullfile(queue_path, 'jobs');
+while ~exist(fullfile(queue_path, 'stop'), 'file')
+    jobs = dir(fullfile(job_path, '*.job'));
+    if isempty(jobs)
+        pause({poll_interval});
+        continue;
+    end
+    job_name = jobs(1).name(1:end-4);
+    batch_file = strtrim(fileread(fullfile(job_path, jobs(1).name)));
+    movefile(fullfile(job_path, jobs(1).name), fullfile(job_path, [job_name '.run']));
+    status = '0';
+    try
+        spm_jobman('run', {{batch_file}});
+    catch err
+        fprintf(2, 'job %s failed: %s\\n', job_name, err.message);
+        status = '1';
+    end
+    fid = fopen(fullfile(job_path, [job_name '.tmp']), 'w');
+    fprintf(fid, '%s', status);
+    fclose(fid);
+    movefile(fullfile(job_path, [job_name '.tmp']), fullfile(job_path, [job_name '.done']));
+end
+matlabbatch = {{}};
+"""
+
+
+def cat12_batch(
+        script: str,
+        files: Sequence[Union[str, Path]],
+        arg1: Optional[str] = None,
+        arg2: Optional[str] = None,
+        additional_lines: Sequence[str] = (),
+) -> str:
+    """
+    Fill the input files and arguments into a CAT12 standalone batch,
+    the same way as `cat_standalone.sh` does before running it.
+
+    The first `<UNDEFINED>` field receives the `files`, the second
+    and third receive `arg1` and `arg2` (`-a1`, `-a2`), the
+    `additional_lines` (`-a`) are appended.
+    """
+    undefined = [
+        line.split("=")[0].replace("%", "").replace(" ", "")
+        for line in script.splitlines()
+        if "<UNDEFINED>" in line
+    ]
+    if not undefined:
+        raise ValueError("CAT12 batch has no <UNDEFINED> field for the input files")
+
+    lines = [line for line in script.splitlines() if "<UNDEFINED>" not in line]
+    lines.append(f"{undefined[0]} = {{")
+    lines.extend(f"'{file}'" for file in files)
+    lines.append("};")
+    for param, arg in zip(undefined[1:], (arg1, arg2)):
+        if arg is not None:
+            lines.append(f"{param} = {arg};")
+    lines.extend(additional_lines)
+    return "\n".join(lines) + "\n"
+
+
+def parse_cat12_args(args: Sequence[Union[str, Path]]) -> Tuple[Path, List[str], dict]:
+    """
+    Split the arguments of `cat_standalone.sh` (without `-m`)
+    into batch filename, input files and keyword arguments of `cat12_batch`
+    """
+    batch_filename, files = None, []
+    kwargs = {"additional_lines": []}
+    args = [str(arg) for arg in args]
+    while args:
+        arg = args.pop(0)
+        if arg == "-b":
+            batch_filename = Path(args.pop(0))
+        elif arg in ("-a1", "-a2"):
+            kwargs[f"arg{arg[2]}"] = args.pop(0)
+        elif arg == "-a":
+            kwargs["additional_lines"].append(args.pop(0))
+        elif arg.startswith("-"):
+            raise ValueError(f"Unsupported cat_standalone argument '{arg}'")
+        else:
+            files.append(arg)
+
+    if batch_filename is None:
+        raise ValueError("No batch file given with -b")
+    return batch_filename, files, kwargs
+
+
+class Cat12Worker:
+    """
+    A long-running CAT12 runtime that processes jobs from a queue directory.
+
+    Starting the matlab runtime for every CAT12 call takes a while.
+    The worker is started once with a script that waits for job files
+    in `<queue_path>/jobs/`, runs each job's batch with `spm_jobman` and
+    writes the exit status to a `.done` file. The input files are filled
+    into the batch with `cat12_batch`, like `cat_standalone.sh` does.
+
+    The worker has only been tested with a stand-in of the CAT12 runtime,
+    not with a real CAT12 installation, which is why `config.CAT12_WORKER`
+    is disabled by default.
+
+    Use `get_cat12_worker()` to get the worker of the current process.
+    """
+
+    # seconds between checks of the queue directory
+    poll_interval = .2
+
+    def __init__(self, queue_path: Union[str, Path]):
+        self.queue_path = Path(queue_path)
+        self.log = Logger(f"{self.__class__.__name__}/{os.getpid()}")
+        self._process: Optional[subprocess.Popen] = None
+        self._job_count = 0
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.queue_path})"
+
+    @property
+    def is_alive(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self._process.returncode if self._process is not None else None
+
+    def start(self):
+        if self.is_alive:
+            return
+
+        os.makedirs(self.queue_path / "jobs", exist_ok=True)
+        script_filename = self.queue_path / "bad_cat12_worker.m"
+        script_filename.write_text(WORKER_SCRIPT.format(
+            queue_path=self.queue_path,
+            poll_interval=self.poll_interval,
+        ))
+        self.log.debug("starting", self.queue_path)
+        self._process = subprocess.Popen([
+            config.CAT12_PATH / "standalone" / "cat_standalone.sh",
+            "-m", config.MATLAB_PATH,
+            "-b", script_filename,
+        ])
+
+    def stop(self, kill: bool = False, timeout: float = 30.):
+        """
+        Stop the worker after the current job, or immediately if `kill` is True
+        """
+        if self._process is not None:
+            if self._process.poll() is None:
+                if kill:
+                    self._process.kill()
+                else:
+                    (self.queue_path / "stop").touch()
+                try:
+                    self._process.wait(timeout)
+                except subprocess.TimeoutExpired:
+                    self._process.kill()
+                    self._process.wait()
+            self._process = None
+
+        shutil.rmtree(self.queue_path, ignore_errors=True)
+
+    def submit(self, *args: Union[str, Path]) -> "Cat12WorkerJob":
+        """
+        Queue a job with the arguments of `cat_standalone.sh` (without `-m`)
+        """
+        self.start()
+
+        self._job_count += 1
+        job_name = f"{self._job_count:08d}-{secrets.token_hex(4)}"
+
+        try:
+            batch_filename, files, kwargs = parse_cat12_args(args)
+            batch = cat12_batch(batch_filename.read_text(), files, **kwargs)
+        except (OSError, ValueError) as e:
+            # fails like cat_standalone.sh would
+            self.log.error(f"job {job_name} failed: {type(e).__name__}: {e}")
+            job = Cat12WorkerJob(self, job_name, [str(arg) for arg in args])
+            job.returncode = 1
+            return job
+
+        # keep the name of the batch file for the logs of the runtime
+        job_batch_filename = self.queue_path / "jobs" / job_name / batch_filename.name
+        os.makedirs(job_batch_filename.parent)
+        job_batch_filename.write_text(batch)
+
+        job_filename = self.queue_path / "jobs" / f"{job_name}.job"
+        temp_filename = job_filename.with_suffix(".new")
+        temp_filename.write_text(str(job_batch_filename))
+        os.replace(temp_filename, job_filename)
+
+        return Cat12WorkerJob(self, job_name, [str(arg) for arg in args])
+
+
+class Cat12WorkerJob:
+    """
+    A queued job of a `Cat12Worker`.
+
+    Supports the `poll`, `wait` and `kill` methods of `subprocess.Popen`.
+    """
+
+    def __init__(self, worker: Cat12Worker, name: str, args: list):
+        self.worker = worker
+        self.name = name
+        self.args = args
+        self.returncode: Optional[int] = None
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.name}, {self.args})"
+
+    def poll(self) -> Optional[int]:
+        if self.returncode is None:
+            done_filename = self.worker.queue_path / "jobs" / f"{self.name}.done"
+            if done_filename.exists():
+                self.returncode = int(done_filename.read_text().strip() or 1)
+                shutil.rmtree(done_filename.parent / self.name, ignore_errors=True)
+
+            elif not self.worker.is_alive:
+                self.worker.log.error(f"worker exited before finishing job {self.name}")
+                self.returncode = self.worker.returncode or 1
+
+        return self.returncode
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        start_time = time.time()
+        while self.poll() is None:
+            if timeout is not None and time.time() - start_time > timeout:
+                raise subprocess.TimeoutExpired(self.args, timeout)
+            time.sleep(self.worker.poll_interval)
+        return self.returncode
+
+    def kill(self):
+        """
+        Kill the worker, a new one is started for the next job
+        """
+        self.worker.stop(kill=True)
+
+
+_workers: Dict[Tuple[int, str, str], Cat12Worker] = {}
+
+
+def get_cat12_worker() -> Cat12Worker:
+    """
+    Return the CAT12 worker of this process (and CAT12/matlab installation).
+
+    The worker is stopped when the process exits, also for `multiprocessing`
+    child processes, which exit without running `atexit` handlers.
+    """
+    key = (os.getpid(), str(config.CAT12_PATH), str(config.MATLAB_PATH))
+    if key not in _workers:
+        worker = _workers[key] = Cat12Worker(
+            config.TEMP_PATH / f"cat12-worker-{os.getpid()}-{secrets.token_hex(4)}"
+        )
+        Finalize(worker, worker.stop, exitpriority=10)
+    return _workers[key]
+
+
+def stop_cat12_workers():
+    """
+    Stop all CAT12 workers that have been started by this process
+    """
+    for key, worker in list(_workers.items()):
+        if key[0] == os.getpid():
+            worker.stop()
+            _workers.pop(key)
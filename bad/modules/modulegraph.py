@@ -1,20 +1,54 @@
+import collections
 import json
 import os
 import glob
 import dataclasses
 import hashlib
+import operator
 import warnings
 from pathlib import Path
-from typing import Iterable, Generator, List, Dict, Optional, Union, Any, Tuple, Callable
+from typing import Iterable, Generator, List, Dict, Optional, Union, Any, Tuple, Callable, Container
 
 import nibabel
 
 from bad import config, logger
 from bad.util.filenames import *
+from bad.util.files import atomic_filename, copy_file
+from bad.util.image import unmodified_image_filename
+from bad.util.region import Region, restrict_to_region
 from .base import Module, SourceModuleBase, ProcessModuleBase
+from .process.image.base import VoxelData
 from .object import *
 
 
+class _LengthHintIterator:
+    """
+    Iterator that supports `operator.length_hint`.
+
+    The hint is the estimated number of objects before iterating,
+    `length_hint` is only called when the hint is requested.
+    """
+    def __init__(self, iterable: Iterable, length_hint: Callable[[], int]):
+        self._iterator = iter(iterable)
+        self._length_hint = length_hint
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._iterator)
+
+    def __length_hint__(self) -> int:
+        return self._length_hint()
+
+
+def _keep_length_hint(objects: Iterable, source_objects: Iterable) -> _LengthHintIterator:
+    """
+    Pass the length hint of `source_objects` on to `objects`
+    """
+    return _LengthHintIterator(objects, lambda: operator.length_hint(source_objects))
+
+
 class ModuleGraph:
     class SkipPolicy:
         NEVER = "never"
@@ -38,6 +72,8 @@ class ModuleGraph:
             target_path: Optional[Union[str, Path]] = None,
             skip_policy: str = SkipPolicy.NEVER,
             log_skipping: bool = False,
+            fuse_modules: bool = True,
+            link_files: bool = False,
     ):
         """
         Execution of a preprocessing module pipeline.
@@ -55,6 +91,15 @@ class ModuleGraph:
         :param skip_policy: str,
             One of the `ModuleGraph.SkipPolicy` constants
 
+        :param fuse_modules: bool,
+            If True, consecutive fusable image modules process
+            each image at once, see `iter_module_runs()`.
+
+        :param link_files: bool,
+            If True, unmodified source files are stored as hardlinks
+            where possible. Saves time and space but stored files
+            must never be changed in-place.
+
         """
         assert skip_policy in (self.SkipPolicy.NEVER, self.SkipPolicy.EXISTS, self.SkipPolicy.UNCHANGED)
 
@@ -63,6 +108,8 @@ class ModuleGraph:
         if target_path is not None:
             self.target_path = Path(target_path)
         self.skip_policy = skip_policy
+        self.fuse_modules = fuse_modules
+        self.link_files = link_files
         self.log_skipping = logger.Logger("SKIP") if log_skipping else False
 
         self.report: Dict[str, Any] = {}
@@ -115,6 +162,8 @@ class ModuleGraph:
             "source_objects": 0,
             "target_objects": 0,
             "skipped_objects": 0,
+            "stored_objects": 0,
+            "stored_bytes": 0,
         }
 
     def prepare_modules(self):
@@ -145,6 +194,8 @@ class ModuleGraph:
             interval: int = 1,
             offset: int = 0,
             existing_target_callback: Optional[Callable[[dict], None]] = None,
+            is_cancelled: Optional[Callable[[], bool]] = None,
+            wait_until_active: Optional[Callable[[], None]] = None,
     ) -> Generator[ModuleObject, None, None]:
         """
         Process the whole graph from "source" -> "filter" -> "process"
@@ -161,6 +212,16 @@ class ModuleGraph:
             If defined it will be called for each existing
             target object for which processing has been skipped.
 
+        :param is_cancelled: callable,
+            If defined, it is called before each source object
+            and no further source objects are processed once it returns True.
+            Objects that are already in the pipeline are completed.
+
+        :param wait_until_active: callable,
+            If defined, it is called before each source object enters the
+            processing modules and may block to pause the processing.
+            It is not called while looking for existing targets.
+
         :return: generates the (stored) target `ModuleObject` instances
         """
         self.clear_report()
@@ -170,6 +231,8 @@ class ModuleGraph:
                 source_types=source_types,
                 interval=interval,
                 offset=offset,
+                is_cancelled=is_cancelled,
+                wait_until_active=wait_until_active,
             )
 
         else:
@@ -181,6 +244,8 @@ class ModuleGraph:
                     source_types=source_types,
                     interval=interval,
                     offset=offset,
+                    is_cancelled=is_cancelled,
+                    wait_until_active=wait_until_active,
                 )
                 return
 
@@ -191,6 +256,7 @@ class ModuleGraph:
                     interval=interval,
                     offset=offset,
                     stub=True,
+                    is_cancelled=is_cancelled,
                 )
             )
             self.clear_report()
@@ -199,6 +265,8 @@ class ModuleGraph:
                 source_types=source_types,
                 interval=interval,
                 offset=offset,
+                is_cancelled=is_cancelled,
+                wait_until_active=wait_until_active,
                 # filter the source objects for which all target objects exist
                 source_filter=lambda objects: self.filter_existing_objects(
                     objects=objects,
@@ -215,23 +283,42 @@ class ModuleGraph:
             offset: int = 0,
             stub: bool = False,
             source_filter: Optional[Callable] = None,
+            is_cancelled: Optional[Callable[[], bool]] = None,
+            wait_until_active: Optional[Callable[[], None]] = None,
     ) -> Generator[ModuleObject, None, None]:
         """
         Process the whole graph, either in "stub" or normal mode.
         """
-        source_objects = self.iter_source_objects(
-            output_types=source_types,
-            interval=interval,
-            offset=offset,
-            stub=stub,
+        # the objects of each stage estimate their number (see `operator.length_hint`)
+        #   so modules like `image_slice_combine` can allocate their result in advance
+        source_objects = _LengthHintIterator(
+            self.iter_source_objects(
+                output_types=source_types,
+                interval=interval,
+                offset=offset,
+                stub=stub,
+                is_cancelled=is_cancelled,
+                wait_until_active=wait_until_active,
+            ),
+            lambda: self.get_source_length_hint(
+                output_types=source_types,
+                interval=interval,
+                offset=offset,
+            ),
         )
 
         if source_filter:
-            source_objects = source_filter(source_objects)
+            source_objects = _keep_length_hint(source_filter(source_objects), source_objects)
 
-        filtered_objects = self.filter_objects(
-            objects=source_objects,
-            stub=stub,
+        if not stub:
+            source_objects = _keep_length_hint(self.restrict_source_objects(source_objects), source_objects)
+
+        filtered_objects = _keep_length_hint(
+            self.filter_objects(
+                objects=source_objects,
+                stub=stub,
+            ),
+            source_objects,
         )
 
         yield from self.process_objects(
@@ -245,15 +332,107 @@ class ModuleGraph:
             interval: int = 1,
             offset: int = 0,
             stub: bool = False,
+            is_cancelled: Optional[Callable[[], bool]] = None,
+            wait_until_active: Optional[Callable[[], None]] = None,
     ) -> Generator[ModuleObject, None, None]:
         output_types = set(output_types) if output_types else None
         for m in self.source_modules:
             if not output_types or set(m.output_types) & output_types:
                 for obj in m.iter_objects(interval=interval, offset=offset, stub=stub):
+                    if wait_until_active is not None and not stub:
+                        wait_until_active()
+                    if is_cancelled is not None and is_cancelled():
+                        return
                     if not output_types or obj.data_type in output_types:
                         self.report["source_objects"] += 1
                         yield obj
 
+    def get_source_length_hint(
+            self,
+            output_types: Optional[Iterable[str]] = None,
+            interval: int = 1,
+            offset: int = 0,
+    ) -> int:
+        """
+        Returns the estimated number of objects of `iter_source_objects`
+        or 0 if it is not known
+        """
+        output_types = set(output_types) if output_types else None
+        num_objects = 0
+        for m in self.source_modules:
+            if not output_types or set(m.output_types) & output_types:
+                try:
+                    count = m.get_object_count()
+                except NotImplementedError:
+                    return 0
+                # the source modules yield the objects whose index + offset is a multiple of interval
+                num_objects += len(range(-offset % interval, count, interval))
+        return num_objects
+
+    def restrict_source_objects(
+            self,
+            objects: Iterable[ModuleObject],
+    ) -> Generator[ModuleObject, None, None]:
+        """
+        Make the source images only read the voxels
+        that are needed by the processing modules
+        """
+        complete_modules = set(self.storage_paths) if self.target_path else set()
+
+        for obj in objects:
+            if isinstance(obj, ImageObject) and obj.src is not None:
+                region = self.get_required_region(
+                    modules=self.processing_modules,
+                    input_shape=obj.shape,
+                    complete_modules=complete_modules,
+                )
+                obj.src = restrict_to_region(obj.src, region)
+
+            yield obj
+
+    @classmethod
+    def get_required_region(
+            cls,
+            modules: Iterable[ProcessModuleBase],
+            input_shape: Tuple[int, ...],
+            complete_modules: Container[Module] = (),
+    ) -> Optional[Region]:
+        """
+        Walk the processing modules backwards and return the voxel region
+        of an input image that is needed by the whole chain
+        (or None if the whole image is needed).
+
+        Each module gets the shape of its own input. If the output shape
+        of a module is not known in advance, the following modules
+        need their whole input.
+
+        :param modules: the processing modules
+        :param input_shape: shape of the image fed into the first module
+        :param complete_modules: modules whose complete output is needed,
+            e.g. because it is stored
+        """
+        modules = list(modules)
+
+        # the input shape of each module, None if unknown
+        input_shapes = []
+        shape = tuple(input_shape)
+        for module in modules:
+            input_shapes.append(shape)
+            if shape is not None and ModuleObjectType.IMAGE in module.input_types:
+                shape = module.get_output_shape(shape)
+
+        # None means the whole output of the last module
+        region = None
+        for module, shape in zip(reversed(modules), reversed(input_shapes)):
+            if module in complete_modules:
+                region = None
+            if ModuleObjectType.IMAGE in module.input_types:
+                if shape is None:
+                    region = None
+                else:
+                    region = module.get_input_region(shape, region)
+        return region
+
     def filter_objects(
             self,
             objects: Iterable[ModuleObject],
@@ -285,19 +464,90 @@ class ModuleGraph:
         """
         processed_objects = objects
 
-        for idx, module in enumerate(self.processing_modules):
-            is_final_object = idx + 1 == len(self.processing_modules)
-            processed_objects = self._process_and_store_objects(
-                module=module,
-                objects=processed_objects,
-                store_bypassed_objects=is_final_object,
-                stub=stub,
-            )
+        for modules in self.iter_module_runs(fuse=self.fuse_modules and not stub):
+            is_final_object = modules[-1] is self.processing_modules[-1]
+            input_objects = processed_objects
+            if len(modules) > 1:
+                processed_objects = self._process_and_store_fused_objects(
+                    modules=modules,
+                    objects=input_objects,
+                    store_bypassed_objects=is_final_object,
+                )
+            else:
+                processed_objects = self._process_and_store_objects(
+                    module=modules[0],
+                    objects=input_objects,
+                    store_bypassed_objects=is_final_object,
+                    stub=stub,
+                )
+            # fused runs only contain modules with one output per input
+            if len(modules) > 1 or getattr(modules[0], "one_output_per_input", False):
+                processed_objects = _keep_length_hint(processed_objects, input_objects)
 
         for obj in processed_objects:
             self.report["target_objects"] += 1
             yield obj
 
+    def iter_module_runs(self, fuse: bool = True) -> Generator[List[ProcessModuleBase], None, None]:
+        """
+        Split the processing modules into runs that are executed together.
+
+        A run is either a single module or (if `fuse` is True) a sequence
+        of fusable image modules. Each image is passed through all modules
+        of a run via `ImageProcessModuleBase.process_voxels` and
+        only the result of the last module is wrapped into a nibabel image.
+        Runs end at modules that store their results.
+        """
+        run = []
+        for module in self.processing_modules:
+            if not (fuse and getattr(module, "fusable", False)):
+                if run:
+                    yield run
+                    run = []
+                yield [module]
+                continue
+
+            run.append(module)
+            if self.target_path and module in self.storage_paths:
+                yield run
+                run = []
+
+        if run:
+            yield run
+
+    def _process_and_store_fused_objects(
+            self,
+            modules: List[ProcessModuleBase],
+            objects: Iterable[ModuleObject],
+            store_bypassed_objects: bool,
+    ) -> Generator[ModuleObject, None, None]:
+        """
+        Process each image through all `modules` one at a time.
+        The actions of all modules are recorded like in unfused processing.
+        """
+        last_module = modules[-1]
+
+        for object in objects:
+            if object.data_type not in last_module.input_types:
+                do_store = store_bypassed_objects
+            else:
+                voxels = VoxelData.from_image(object.src)
+                for module in modules:
+                    voxels = module.process_voxels(voxels)
+                    if module is not last_module:
+                        object = module.image_replace(object)
+                object = last_module.image_replace(object, src=voxels.to_image())
+                do_store = True
+
+            if do_store and self.target_path and self.storage_paths.get(last_module):
+                object = self._store_result_object(
+                    last_module,
+                    object=object,
+                    target_path=self.target_path / self.storage_paths[last_module],
+                )
+
+            yield object
+
     def _process_or_bypass_objects(
             self,
             module: Module,
@@ -308,21 +558,32 @@ class ModuleGraph:
         Process or bypass the objects
 
         Yields (<bypassed_object>, False) or (<processed_object>, True)
+
+        The module pulls its input objects when it needs them (e.g. one
+        at a time or a batch), so source objects are only read, and
+        admitted by `wait_until_active`, right before they are processed.
         """
-        input_objects = []
+        bypassed_objects = collections.deque()
 
-        for object in objects:
-            # bypass if data_type doesn't match
-            if object.data_type not in module.input_types:
-                yield object, False
-            else:
-                # TODO: might specify a limit of objects that are collected here
-                #   and process the batch once the limit is reached
-                input_objects.append(object)
+        def _iter_input_objects():
+            for object in objects:
+                # bypass if data_type doesn't match
+                if object.data_type not in module.input_types:
+                    bypassed_objects.append(object)
+                else:
+                    yield object
+
+        # the hint includes the bypassed objects, it's an upper bound
+        input_objects = _keep_length_hint(_iter_input_objects(), objects)
 
         for object in module.process_objects(input_objects, stub=stub):
+            while bypassed_objects:
+                yield bypassed_objects.popleft(), False
             yield object, True
 
+        while bypassed_objects:
+            yield bypassed_objects.popleft(), False
+
     def _process_and_store_objects(
             self,
             module: ProcessModuleBase,
@@ -365,15 +626,31 @@ class ModuleGraph:
         file_mod_time = None
         if not stub:
             os.makedirs(global_dest_filename.parent, exist_ok=True)
+            # write to a new file and move it in place,
+            #   so an interrupted run never leaves a partial target
+            #   and never writes through links to other files
+            with atomic_filename(global_dest_filename) as temp_filename:
+                if isinstance(object, FileObject):
+                    object.write_to(temp_filename, link=self.link_files)
+
+                elif isinstance(object, ImageObject):
+                    # global_dest_filename = strip_compression_extension(global_dest_filename)
+                    source_filename = unmodified_image_filename(object.src)
+                    if (source_filename is not None
+                            and self._is_compressed(source_filename) == self._is_compressed(global_dest_filename)):
+                        # unchanged image, copy the file instead of encoding it again
+                        copy_file(source_filename, temp_filename, link=self.link_files)
+                    else:
+                        object.src.to_filename(temp_filename)
 
-            if isinstance(object, FileObject):
-                global_dest_filename.write_bytes(object.read_bytes())
-
-            elif isinstance(object, ImageObject):
-                # global_dest_filename = strip_compression_extension(global_dest_filename)
-                object.src.to_filename(global_dest_filename)
+            if isinstance(object, ImageObject) and object.src.get_filename() == str(temp_filename):
+                # nibabel remembers the filename it wrote to
+                object.src.set_filename(str(global_dest_filename))
 
-            file_mod_time = global_dest_filename.stat().st_mtime_ns
+            stat = global_dest_filename.stat()
+            file_mod_time = stat.st_mtime_ns
+            self.report["stored_objects"] += 1
+            self.report["stored_bytes"] += stat.st_size
 
         stored_object = object.replace(
             action=module.action_dict(
@@ -385,7 +662,9 @@ class ModuleGraph:
 
         if not stub:
             gobal_data_filename = add_file_extension(global_dest_filename, "bad", "json")
-            gobal_data_filename.write_text(self._to_json(stored_object.to_dict()))
+            # the .bad.json file is written last, a target without it is not complete
+            with atomic_filename(gobal_data_filename) as temp_filename:
+                temp_filename.write_text(self._to_json(stored_object.to_dict()))
 
         return stored_object
 
@@ -420,6 +699,10 @@ class ModuleGraph:
                                 mtime=mtime,
                             )
 
+    @classmethod
+    def _is_compressed(cls, filename: Union[str, Path]) -> bool:
+        return str(strip_compression_extension(filename)) != str(filename)
+
     def _get_checksum(self, content: Union[bytes, Dict[str, Any]]) -> str:
         if not isinstance(content, bytes):
             content = self._to_json(content).encode()
@@ -1,14 +1,16 @@
 from pathlib import Path
+import shutil
 import tarfile
 import gzip
 import bz2
 from io import StringIO, BytesIO
-from typing import Optional, Generator, IO, Union, List
+from typing import Optional, Generator, IO, Union, List, Type
 
 from nibabel import FileHolder, all_image_classes
-from nibabel.filebasedimages import ImageFileError
+from nibabel.filebasedimages import ImageFileError, SerializableImage
 
 from bad import config
+from bad.util.files import copy_file
 from bad.util.filenames import add_to_filename, strip_extension, strip_compression_extension
 from .base import ModuleObject, ModuleObjectType
 from .imageobject import ImageObject
@@ -82,6 +84,18 @@ class FileObject(ModuleObject):
             kwargs["errors"] = errors
         return self.read_bytes().decode(**kwargs)
 
+    def write_to(self, filename: Union[str, Path], link: bool = False):
+        """
+        Write the (uncompressed) content of the file to `filename`,
+        like `filename.write_bytes(self.read_bytes())` but without
+        reading the whole content into memory.
+
+        :param link: bool, allows to create a hardlink if the content
+            is a file on disk
+        """
+        with self.open("rb") as fsrc, open(filename, "wb") as fdst:
+            shutil.copyfileobj(fsrc, fdst)
+
     def read_nibabel(self, stub: bool = False) -> Optional[ImageObject]:
         """
         Try to load the file as image.
@@ -108,7 +122,7 @@ class FileObject(ModuleObject):
                 if stub:
                     img = ImageObject.STUB_IMAGE
                 else:
-                    img = image_klass.from_bytes(self.read_bytes(uncompressed=True))
+                    img = self.load_image(image_klass)
 
                 return ImageObject(
                     img,
@@ -118,6 +132,12 @@ class FileObject(ModuleObject):
                     actions=self.actions,
                 )
 
+    def load_image(self, image_klass: Type[SerializableImage]) -> SerializableImage:
+        """
+        Load the file with the given nibabel image class
+        """
+        return image_klass.from_bytes(self.read_bytes(uncompressed=True))
+
     def replace(
             self,
             action: dict,
@@ -178,6 +198,21 @@ class FileObjectDisk(FileObject):
             return self.read_bytes().decode(encoding=encoding, errors=errors)
         return self.true_filename.read_text(encoding=encoding, errors=errors)
 
+    def write_to(self, filename: Union[str, Path], link: bool = False):
+        if self.compression_suffix:
+            super().write_to(filename)
+        else:
+            copy_file(self.true_filename, filename, link=link)
+
+    def load_image(self, image_klass: Type[SerializableImage]) -> SerializableImage:
+        """
+        Load the image lazily from disk.
+
+        The voxel data is only read when accessed, and only the
+        accessed part if the image is sliced before.
+        """
+        return image_klass.from_filename(self.true_filename, mmap=False)
+
 
 class FileObjectTar(FileObject):
 
@@ -356,3 +391,6 @@ class FileObjectMemory(FileObject):
         if isinstance(self.content, str):
             return self.content
         return self.content.decode(encoding=encoding, errors=errors)
+
+    def write_to(self, filename: Union[str, Path], link: bool = False):
+        Path(filename).write_bytes(self.read_bytes())
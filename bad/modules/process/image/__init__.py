@@ -1,6 +1,8 @@
-from .base import ImageProcessModuleBase
+from .base import ImageProcessModuleBase, VoxelData
+from .autocrop import ImageAutoCropModule
 from .mask_atlas import ImageMaskAtlasModule
 from .noop import ImageNoopModule
 from .resample import ImageResampleModule
 from .slice import ImageSlice
 from .slice_combine import ImageSliceCombine
+from .smooth import ImageSmoothModule
@@ -0,0 +1,147 @@
+import dataclasses
+from typing import Generator, Optional, Tuple
+
+import nibabel
+import numpy as np
+
+from bad import config
+from bad.util.image import crop_affine, foreground_box
+from bad.util.region import Region, normalize_region
+from ...params import *
+from .base import ImageProcessModuleBase, ImageObject, VoxelData
+
+
+class ImageAutoCropModule(ImageProcessModuleBase):
+
+    name = "image_autocrop"
+    fusable = True
+    one_output_per_input = True
+    help = """
+    Crop the image to the bounding box of the foreground, plus a margin.
+
+    In **threshold** mode, the box is calculated for each image and contains all voxels
+    above the threshold. The resulting images will usually have different shapes.
+
+    In **mask** mode, the box of the non-zero voxels of the mask file is used for
+    all images, so the resulting images all have the same shape.
+    The images must have the same shape as the mask (e.g. be in the same template space).
+    """
+
+    parameters = [
+        ParameterSelect(
+            name="mode", default_value="threshold",
+            options=[
+                ParameterSelect.Option("threshold", "threshold"),
+                ParameterSelect.Option("mask", "mask file"),
+            ],
+            description="How to find the foreground",
+        ),
+        ParameterFloat(
+            name="threshold", default_value=.05, min_value=0., max_value=1.,
+            description="Voxels above this fraction of the maximum image value are foreground",
+            visible_js="mode === 'threshold'",
+        ),
+        ParameterFilename(
+            name="mask_file", default_value="", required=False,
+            description="Image whose non-zero voxels are the foreground",
+            visible_js="mode === 'mask'",
+        ),
+        ParameterInt(
+            name="margin", default_value=2, min_value=0,
+            description="Number of voxels to keep around the foreground",
+        ),
+        *ImageProcessModuleBase.parameters
+    ]
+
+    def prepare(self):
+        self.mask_shape: Optional[Tuple[int, ...]] = None
+        self.mask_box: Optional[Tuple[slice, ...]] = None
+
+        if self.get_parameter_value("mode") == "mask":
+            mask_filename = config.join_data_path(self.get_parameter_value("mask_file"))
+            mask_array = np.asanyarray(nibabel.load(mask_filename).dataobj)
+            if mask_array.ndim > 3:
+                mask_array = np.any(mask_array, axis=tuple(range(3, mask_array.ndim)))
+
+            self.mask_shape = mask_array.shape
+            self.mask_box = foreground_box(mask_array != 0, margin=self.get_parameter_value("margin"))
+            if self.mask_box is None:
+                raise ValueError(f"Mask file '{mask_filename}' has no non-zero voxels")
+
+    def process_objects(
+            self,
+            images: Iterable[ImageObject],
+            stub: bool = False
+    ) -> Generator[ImageObject, None, None]:
+        for image in images:
+            if stub:
+                yield self.image_replace(image)
+            else:
+                yield self.image_replace(
+                    image,
+                    src=self.process_voxels(VoxelData.from_image(image.src)).to_image(),
+                )
+
+    def process_voxels(self, voxels: VoxelData) -> VoxelData:
+        data = voxels.data
+        if self.get_parameter_value("mode") == "mask":
+            slices = self.get_mask_box(voxels.shape)
+        else:
+            data = np.asanyarray(data)
+            slices = self.get_threshold_box(data)
+
+        if slices is None:
+            return voxels
+
+        return dataclasses.replace(
+            voxels,
+            # a copy, like nibabel's slicer
+            data=np.array(data[slices]),
+            affine=crop_affine(voxels.affine, slices),
+        )
+
+    def get_threshold_box(self, data: np.ndarray) -> Optional[Tuple[slice, ...]]:
+        """
+        Return the box of all voxels above the threshold or None
+        if the image has no positive values
+        """
+        max_value = np.nanmax(data) if data.size else 0
+        if not max_value > 0:
+            return None
+
+        mask = data > self.get_parameter_value("threshold") * max_value
+        if mask.ndim > 3:
+            mask = np.any(mask, axis=tuple(range(3, mask.ndim)))
+
+        return foreground_box(mask, margin=self.get_parameter_value("margin"))
+
+    def get_mask_box(self, shape: Tuple[int, ...]) -> Tuple[slice, ...]:
+        if tuple(shape[:3]) != self.mask_shape:
+            raise ValueError(
+                f"Image shape {tuple(shape[:3])} does not match mask shape {self.mask_shape}"
+            )
+        return self.mask_box
+
+    def get_output_shape(self, input_shape: Tuple[int, ...]) -> Optional[Tuple[int, ...]]:
+        # the threshold box depends on the voxel values
+        if getattr(self, "mask_box", None) is None or tuple(input_shape[:3]) != self.mask_shape:
+            return None
+        return tuple(s.stop - s.start for s in self.mask_box) + tuple(input_shape[3:])
+
+    def get_input_region(
+            self,
+            input_shape: Tuple[int, ...],
+            output_region: Optional[Region] = None,
+    ) -> Optional[Region]:
+        # the threshold box depends on all voxels
+        if getattr(self, "mask_box", None) is None or tuple(input_shape[:3]) != self.mask_shape:
+            return None
+
+        box = self.mask_box
+        output_shape = tuple(s.stop - s.start for s in box) + tuple(input_shape[3:])
+        output_region = normalize_region(output_region, output_shape)
+        # the output region within the box
+        return tuple(
+            slice(box_slice.start + s.start, box_slice.start + s.stop)
+            for box_slice, s in zip(box, output_region)
+        ) + tuple(output_region[3:])
@@ -1,6 +1,10 @@
+import dataclasses
 from pathlib import Path
-from typing import Generator, Iterable, Optional, Union
+from typing import Generator, Iterable, Optional, Union, Type, Any, Tuple
 
+import nibabel
+import nibabel.affines
+import numpy as np
 from nibabel.filebasedimages import SerializableImage
 
 from ...base import ProcessModuleBase, ModuleGroup, ModuleTag
@@ -8,12 +12,57 @@ from ...object.base import ModuleObjectType
 from ...object.imageobject import ImageObject
 
 
+@dataclasses.dataclass
+class VoxelData:
+    """
+    The voxel data and geometry of an image.
+
+    Fused modules pass this from one to the next
+    without creating a nibabel image for each step.
+    """
+    # numpy array or (lazy) nibabel array proxy
+    data: Any
+    affine: np.ndarray
+    # class and header of the nibabel image that is finally created
+    image_class: Type[SerializableImage] = nibabel.Nifti1Image
+    header: Optional[Any] = None
+
+    @classmethod
+    def from_image(cls, img: SerializableImage) -> "VoxelData":
+        return cls(
+            data=img.dataobj,
+            affine=img.affine,
+            image_class=img.__class__,
+            header=img.header,
+        )
+
+    def to_image(self) -> SerializableImage:
+        return self.image_class(self.data, self.affine, header=self.header)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return tuple(self.data.shape)
+
+    @property
+    def voxel_size(self) -> Tuple[float, ...]:
+        if self.header is not None:
+            return tuple(float(i) for i in self.header.get_zooms())
+        return tuple(float(i) for i in nibabel.affines.voxel_sizes(self.affine))
+
+
 class ImageProcessModuleBase(ProcessModuleBase):
     tags = [ModuleTag.IMAGE_PROCESS]
     group = [*ProcessModuleBase.group, ModuleGroup.IMAGE]
     input_types = [ModuleObjectType.IMAGE]
     output_types = [ModuleObjectType.IMAGE]
 
+    # modules that implement `process_voxels` can be fused by the `ModuleGraph`
+    fusable: bool = False
+
+    # modules that yield exactly one image per input image (in the same order)
+    #   can process a batch of images with one `process_objects` call
+    one_output_per_input: bool = False
+
     def process_objects(
             self,
             images: Iterable[ImageObject],
@@ -21,6 +70,16 @@ class ImageProcessModuleBase(ProcessModuleBase):
     ) -> Generator[ImageObject, None, None]:
         raise NotImplementedError
 
+    def process_voxels(self, voxels: VoxelData) -> VoxelData:
+        """
+        Process the voxel data of a single image.
+
+        The `ModuleGraph` uses this to pass the voxel data of each image through
+        a run of fusable modules at once. The result must be the same as with
+        `process_objects` and the module must not change filenames or paths.
+        """
+        raise NotImplementedError
+
     def image_replace(
             self,
             image: ImageObject,
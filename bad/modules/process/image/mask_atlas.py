@@ -1,16 +1,22 @@
+import hashlib
+import json
 import math
-from typing import List, Generator
+import os
+import secrets
+import zipfile
+from pathlib import Path
+from typing import List, Generator, Dict, Tuple, Any, Optional
 
 import nibabel
-import nilearn.image
-import numpy
 import numpy as np
 
 from bad import config
 from ...base import ModuleGroup, ModuleTag
 from ...params import *
 from .base import ImageProcessModuleBase, ImageObject
-from bad.util.image import to_output_dtype
+from bad.util.image import to_output_dtype, crop_affine, compact_indices, find_label_regions
+from bad.util.region import Region, union_region
+from bad.util.resample import resample_image
 
 
 class ImageMaskAtlasModule(ImageProcessModuleBase):
@@ -81,34 +87,117 @@ class ImageMaskAtlasModule(ImageProcessModuleBase):
     ]
 
     def prepare(self):
-        self.atlas = nibabel.load(
-            config.join_data_path(self.get_parameter_value("atlas_file"))
-        )
+        atlas_filename = config.join_data_path(self.get_parameter_value("atlas_file"))
+        self.atlas = nibabel.load(atlas_filename)
         self.atlas_array = self.atlas.dataobj.get_unscaled()
-        atlas_mask_values = sorted(np.unique(self.atlas_array))
-        self.atlas_mask_values = []
 
+        # for each region, the slices of the (cropped) region box
+        #   and the voxel coordinates of the region within that box
+        self.atlas_mask_values = []
+        self.region_slices: Dict[Any, Tuple[slice, ...]] = {}
+        self.region_indices: Dict[Any, Tuple[np.ndarray, ...]] = {}
+
+        cache_filename = self._regions_cache_filename(atlas_filename)
+        regions = self._load_regions(cache_filename)
+        if regions is None:
+            regions = self._calc_regions()
+            self._store_regions(cache_filename, regions)
+
+        coords = regions["coords"]
+        for idx, mask_value in enumerate(regions["values"].tolist()):
+            offset, next_offset = regions["offsets"][idx:idx + 2]
+            self.atlas_mask_values.append(mask_value)
+            self.region_slices[mask_value] = tuple(
+                slice(int(start), int(end))
+                for start, end in zip(regions["starts"][idx], regions["ends"][idx])
+            )
+            self.region_indices[mask_value] = tuple(coords[:, offset:next_offset])
+
+    def _calc_regions(self) -> Dict[str, np.ndarray]:
+        """
+        Find boxes and voxel coordinates of all atlas regions.
+
+        Returns a dict of arrays that can be stored with `numpy.savez`.
+        """
         do_crop = self.get_parameter_value("crop_result")
         max_voxels = self.get_parameter_value("max_num_voxels")
 
-        # prepare the slices for cropping the image
-        self.crop_slices = {}
-        if not (do_crop or max_voxels):
-            self.atlas_mask_values = atlas_mask_values
-        else:
-            for mask_value in atlas_mask_values:
-                mask_array = (self.atlas_array == mask_value).astype("uint8")
-                mask = nibabel.Nifti1Image(mask_array, affine=self.atlas.affine)
-                mask, crop_slices = nilearn.image.crop_img(
-                    mask, pad=True, return_offset=True,
-                )
-                if max_voxels and math.prod(mask.shape) > max_voxels:
-                    continue
-
-                self.atlas_mask_values.append(mask_value)
-
-                if do_crop:
-                    self.crop_slices[mask_value] = crop_slices
+        # the voxels of all labels are found in the same pass as the boxes
+        values, counts, crop_slices, indices = find_label_regions(self.atlas_array, pad=1, return_indices=True)
+        full_slices = tuple(slice(0, s) for s in self.atlas_array.shape)
+
+        kept_values, starts, ends, coords, offsets = [], [], [], [], [0]
+        for mask_value, count, region_slices, region_indices in zip(values, counts, crop_slices, indices):
+            if max_voxels and math.prod(s.stop - s.start for s in region_slices) > max_voxels:
+                continue
+
+            if not do_crop:
+                region_slices = full_slices
+
+            # voxel coordinates relative to the region, in the same order as `np.nonzero`
+            region_coords = np.stack(np.unravel_index(region_indices, self.atlas_array.shape))
+            region_coords -= np.array([s.start for s in region_slices], dtype=region_coords.dtype)[:, None]
+
+            kept_values.append(mask_value)
+            starts.append([s.start for s in region_slices])
+            ends.append([s.stop for s in region_slices])
+            coords.append(region_coords)
+            offsets.append(offsets[-1] + int(count))
+
+        ndim = self.atlas_array.ndim
+        coords = np.concatenate(coords, axis=1) if coords else np.zeros((ndim, 0), dtype=np.intp)
+        return {
+            "values": np.array(kept_values, dtype=values.dtype),
+            "starts": np.array(starts, dtype=np.int64).reshape(-1, ndim),
+            "ends": np.array(ends, dtype=np.int64).reshape(-1, ndim),
+            "coords": np.stack(compact_indices(coords)) if coords.size else coords,
+            "offsets": np.array(offsets, dtype=np.int64),
+        }
+
+    def _regions_cache_filename(self, atlas_filename: Path) -> Path:
+        stat = atlas_filename.stat()
+        key = json.dumps({
+            "atlas_file": str(atlas_filename),
+            "mtime": stat.st_mtime_ns,
+            "size": stat.st_size,
+            "crop_result": self.get_parameter_value("crop_result"),
+            "max_num_voxels": self.get_parameter_value("max_num_voxels"),
+            "version": self.version,
+        }, sort_keys=True)
+        return config.TEMP_PATH / "cache" / self.name / f"{hashlib.sha224(key.encode()).hexdigest()}.npz"
+
+    def _load_regions(self, filename: Path) -> Optional[Dict[str, np.ndarray]]:
+        try:
+            with np.load(filename) as fp:
+                return {key: fp[key] for key in fp.files}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, zipfile.BadZipFile) as e:
+            self.log.warning(f"Ignoring invalid region cache {filename}: {type(e).__name__}: {e}")
+
+    def _store_regions(self, filename: Path, regions: Dict[str, np.ndarray]):
+        # parallel workers may compute the same regions,
+        #   so write to a unique file and atomically move it in place
+        os.makedirs(filename.parent, exist_ok=True)
+        temp_filename = filename.with_name(f"{filename.name}.{secrets.token_hex(8)}.tmp")
+        try:
+            with open(temp_filename, "wb") as fp:
+                np.savez(fp, **regions)
+            os.replace(temp_filename, filename)
+        except OSError as e:
+            self.log.warning(f"Could not store region cache {filename}: {type(e).__name__}: {e}")
+            temp_filename.unlink(missing_ok=True)
+
+    def get_input_region(
+            self,
+            input_shape: Tuple[int, ...],
+            output_region: Optional[Region] = None,
+    ) -> Optional[Region]:
+        # images of different shape are resampled to the atlas first
+        if getattr(self, "atlas", None) is None or tuple(input_shape) != self.atlas.shape:
+            return None
+        # the outputs only contain voxels inside the region boxes
+        return union_region(self.region_slices.values(), input_shape)
 
     def process_objects(
             self,
@@ -123,19 +212,27 @@ class ImageMaskAtlasModule(ImageProcessModuleBase):
             if stub or self.atlas.shape == image.shape:
                 brain = image.src
             else:
-                brain = nilearn.image.resample_to_img(
-                    source_img=image.src,
-                    target_img=self.atlas,
+                brain = resample_image(
+                    image.src,
+                    target_shape=self.atlas.shape,
+                    target_affine=self.atlas.affine,
                     interpolation=self.get_parameter_value("interpolation")
                 )
 
+            # read the voxel data only once for all regions
+            brain_data = None if stub else np.asanyarray(brain.dataobj)
+
             for mask_value in self.atlas_mask_values:
                 if stub:
                     masked_image = image
                 else:
-                    mask = (self.atlas_array == mask_value)#.astype("uint8")
+                    region_slices = self.region_slices[mask_value]
+                    region_indices = self.region_indices[mask_value]
 
-                    masked_data = brain.dataobj * mask
+                    # only touch the voxels inside the region's box
+                    region_data = brain_data[region_slices]
+                    masked_data = np.zeros(region_data.shape, dtype=region_data.dtype)
+                    masked_data[region_indices] = region_data[region_indices]
 
                     # TODO: this has to be tested for all possible dtypes
                     #   and put into every module (with some overriding options)
@@ -144,16 +241,11 @@ class ImageMaskAtlasModule(ImageProcessModuleBase):
 
                     masked_data = to_output_dtype(masked_data, output_dtype)
 
-                    #print(masked_data.dtype, masked_data.min(), masked_data.max())
-
                     masked_image = nibabel.Nifti1Image(
                         masked_data,
-                        affine=brain.affine,
+                        affine=crop_affine(brain.affine, region_slices),
                     )
 
-                    if mask_value in self.crop_slices:
-                        masked_image = masked_image.slicer[self.crop_slices[mask_value]]
-
                 yield self.image_replace(
                     image=image,
                     action_name=f"mask_{mask_value}",
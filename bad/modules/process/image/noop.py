@@ -1,6 +1,7 @@
 from typing import List, Generator
 
 from bad.util.image import resample_to_shape
+from bad.util.region import Region
 from ...base import ModuleGroup
 from ...params import *
 from .base import ImageProcessModuleBase, ImageObject
@@ -10,6 +11,7 @@ class ImageNoopModule(ImageProcessModuleBase):
 
     name = "image_noop"
     help = "Just for debugging. Module does nothing."
+    one_output_per_input = True
 
     parameters = [
         *ImageProcessModuleBase.parameters
@@ -22,3 +24,13 @@ class ImageNoopModule(ImageProcessModuleBase):
     ) -> Generator[ImageObject, None, None]:
         for image in images:
             yield image
+
+    def get_input_region(
+            self,
+            input_shape: Tuple[int, ...],
+            output_region: Optional[Region] = None,
+    ) -> Optional[Region]:
+        return output_region
+
+    def get_output_shape(self, input_shape: Tuple[int, ...]) -> Optional[Tuple[int, ...]]:
+        return tuple(input_shape)
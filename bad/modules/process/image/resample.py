@@ -1,14 +1,34 @@
-from typing import List, Generator
+from typing import List, Generator, Dict, Optional
 
-from bad.util.image import resample_to_shape
+import nibabel
+import numpy as np
+
+from bad.util.image import resample_images_to_shape, resampled_affine
+from bad.util.resample import resample_array, image_array
 from ...base import ModuleGroup
 from ...params import *
-from .base import ImageProcessModuleBase, ImageObject
+from .base import ImageProcessModuleBase, ImageObject, VoxelData
 
 
 class ImageResampleModule(ImageProcessModuleBase):
 
     name = "image_resample"
+    help = """
+    Resamples each image to a new resolution, either in percent of the input or to a fixed size.
+
+    With `none` or `linear` interpolation, images of the same geometry are resampled
+    together in batches, which is faster than one image at a time. The default
+    `continuous` (spline) interpolation is done by scipy for each image on its own.
+    """
+
+    # number of incoming images that are collected
+    # to resample those of the same geometry together
+    #   (only for the interpolations that support batching)
+    batch_size = 16
+    batched_interpolations = ("nearest", "linear")
+
+    fusable = True
+    one_output_per_input = True
 
     parameters = [
         ParameterSelect(
@@ -64,38 +84,91 @@ class ImageResampleModule(ImageProcessModuleBase):
             self.get_parameter_value("output_z"),
         )
 
+    def target_shape(self, shape: Tuple[int, ...]) -> Tuple[int, int, int]:
+        mode = self.get_parameter_value("mode")
+
+        if mode == "fixed":
+            return self.fixed_target_shape()
+
+        elif mode == "percent":
+            target_percent = self.get_parameter_value("output_percent")
+            return tuple(
+                max(1, int(value * target_percent / 100))
+                for value in shape
+            )
+
+        raise ValueError(f"Invalid resample mode '{mode}'")
+
+    def get_output_shape(self, input_shape: Tuple[int, ...]) -> Optional[Tuple[int, ...]]:
+        if len(input_shape) != 3:
+            return None
+        return tuple(self.target_shape(input_shape))
+
     def process_objects(
             self,
             images: Iterable[ImageObject],
             stub: bool = False
     ) -> Generator[ImageObject, None, None]:
+        if stub:
+            for image in images:
+                yield self.image_replace(image=image, src=image.src)
+            return
 
-        mode = self.get_parameter_value("mode")
-        target_percent = self.get_parameter_value("output_percent")
+        batch_size = self.batch_size
+        if self.get_parameter_value("interpolation") not in self.batched_interpolations:
+            # nothing to gain from holding several images in memory
+            batch_size = 1
 
+        batch = []
         for image in images:
-            if stub:
-                src = image.src
-            else:
-                if mode == "fixed":
-                    target_shape = self.fixed_target_shape()
-
-                elif mode == "percent":
-                    target_shape = tuple(
-                        max(1, int(value * target_percent / 100))
-                        for value in image.shape
-                    )
-
-                else:
-                    raise ValueError(f"Invalid resample mode '{mode}'")
-
-                src = resample_to_shape(
-                    image.src,
-                    shape=target_shape,
-                    interpolation=self.get_parameter_value("interpolation"),
-                )
-
-            yield self.image_replace(
-                image=image,
-                src=src,
+            batch.append(image)
+            if len(batch) >= batch_size:
+                yield from self.process_batch(batch)
+                batch.clear()
+
+        if batch:
+            yield from self.process_batch(batch)
+
+    def process_batch(self, images: List[ImageObject]) -> List[ImageObject]:
+        """
+        Resample all images of the same geometry in one go.
+
+        Returns the resampled images in the same order.
+        """
+        interpolation = self.get_parameter_value("interpolation")
+
+        groups: Dict[tuple, List[int]] = {}
+        for idx, image in enumerate(images):
+            key = (tuple(image.src.shape), image.src.affine.tobytes())
+            groups.setdefault(key, []).append(idx)
+
+        results: List[Optional[ImageObject]] = [None] * len(images)
+        for indices in groups.values():
+            sources = resample_images_to_shape(
+                [images[idx].src for idx in indices],
+                shape=self.target_shape(images[indices[0]].shape),
+                interpolation=interpolation,
             )
+            for idx, src in zip(indices, sources):
+                results[idx] = self.image_replace(image=images[idx], src=src)
+
+        return results
+
+    def process_voxels(self, voxels: VoxelData) -> VoxelData:
+        target_shape = self.target_shape(voxels.shape)
+        target_affine = resampled_affine(voxels.affine, voxels.shape, target_shape)
+        if voxels.shape[:3] == tuple(target_shape[:3]) and np.allclose(target_affine, voxels.affine):
+            return voxels
+
+        data = resample_array(
+            np.asanyarray(voxels.data), voxels.affine,
+            target_shape=target_shape,
+            target_affine=target_affine,
+            interpolation=self.get_parameter_value("interpolation"),
+        )
+        return VoxelData(
+            data=image_array(data),
+            affine=target_affine,
+            # like nilearn.image.new_img_like
+            image_class=nibabel.Nifti1Image if voxels.image_class is nibabel.Nifti1Pair else voxels.image_class,
+        )
@@ -1,3 +1,4 @@
+import dataclasses
 from typing import List, Generator
 
 import nibabel
@@ -6,13 +7,17 @@ import numpy
 import numpy as np
 
 from bad import config
+from bad.util.image import crop_affine
+from bad.util.region import Region
 from ...base import ModuleGroup, ModuleTag
 from ...params import *
-from .base import ImageProcessModuleBase, ImageObject
+from .base import ImageProcessModuleBase, ImageObject, VoxelData
 
 
 class ImageSlice(ImageProcessModuleBase):
     name = "image_slice"
+    fusable = True
+    one_output_per_input = True
     help = """
     Slice a 2-dimensional array from 3-dimensional voxels. 
     """
@@ -39,19 +44,43 @@ class ImageSlice(ImageProcessModuleBase):
         if stub:
             yield from images
 
-        axis = self.get_parameter_value("slice_axis")
-        slice_offset = self.get_parameter_value("slice_offset")
-
         for image in images:
-
-            slice_args = [
-                slice(None)
-                for i in range(image.src.ndim)
-            ]
-            offset = min(slice_offset, image.src.shape[axis] - 1)
-            slice_args[axis] = slice(offset, offset + 1)
-
             yield self.image_replace(
                 image,
-                src=image.src.slicer[tuple(slice_args)]
+                src=image.src.slicer[self.get_slices(image.src.shape)]
             )
+
+    def process_voxels(self, voxels: VoxelData) -> VoxelData:
+        slices = self.get_slices(voxels.shape)
+        return dataclasses.replace(
+            voxels,
+            # a copy, like nibabel's slicer
+            data=np.array(voxels.data[slices]),
+            affine=crop_affine(voxels.affine, slices),
+        )
+
+    def get_slices(self, shape: Tuple[int, ...]) -> Tuple[slice, ...]:
+        axis = self.get_parameter_value("slice_axis")
+        offset = min(self.get_parameter_value("slice_offset"), shape[axis] - 1)
+
+        slices = [slice(None)] * len(shape)
+        slices[axis] = slice(offset, offset + 1)
+        return tuple(slices)
+
+    def get_output_shape(self, input_shape: Tuple[int, ...]) -> Optional[Tuple[int, ...]]:
+        return tuple(
+            s.stop - s.start if s != slice(None) else size
+            for s, size in zip(self.get_slices(input_shape), input_shape)
+        )
+
+    def get_input_region(
+            self,
+            input_shape: Tuple[int, ...],
+            output_region: Optional[Region] = None,
+    ) -> Optional[Region]:
+        slices = list(self.get_slices(input_shape))
+        # the other axes of the output are the same as the input
+        for axis, output_slice in enumerate(output_region or ()):
+            if slices[axis] == slice(None):
+                slices[axis] = output_slice
+        return tuple(slices)
@@ -1,11 +1,13 @@
+import operator
+import os
+import tempfile
 from typing import List, Generator
 
 import nibabel
-import nilearn.image
-import numpy
 import numpy as np
 
 from bad import config
+from bad.util.region import Region
 from ...base import ModuleGroup, ModuleTag
 from ...params import *
 from .base import ImageProcessModuleBase, ImageObject
@@ -13,9 +15,12 @@ from .base import ImageProcessModuleBase, ImageObject
 
 class ImageSliceCombine(ImageProcessModuleBase):
     """
-    Slices each input image and combines all slices.
+    Slices each input image and combines all slices into one image.
 
-    TODO: This is not suitable for the processing stage
+    The combined array is allocated once (in the data type of the source images)
+    and each slice is written into it as soon as it is read, so only one source
+    image needs to be loaded at a time. With `memory_map` the combined array
+    is kept in a temporary file instead of memory.
     """
     name = "image_slice_combine"
     tags = [ModuleTag.MULTI_IMAGE_PROCESS]
@@ -31,6 +36,11 @@ class ImageSliceCombine(ImageProcessModuleBase):
             description="Voxel offset of the slice",
             min_value=0,
         ),
+        ParameterBool(
+            name="memory_map",
+            default_value=False,
+            description="Keep the combined image in a temporary file instead of memory",
+        ),
         *ImageProcessModuleBase.parameters
     ]
 
@@ -39,36 +49,87 @@ class ImageSliceCombine(ImageProcessModuleBase):
             images: Iterable[ImageObject],
             stub: bool = False
     ) -> Generator[ImageObject, None, None]:
-
-        slices = []
         axis = self.get_parameter_value("slice_axis")
-        dummy_image = None
+        # lists and the objects passed by the graph tell the (estimated) number of images,
+        #   images of a different shape are skipped and more slices grow the array
+        count = operator.length_hint(images)
+
+        combined: Optional[np.ndarray] = None
+        first_image = None
+        num_slices = 0
 
         for image in images:
-            if dummy_image and image.shape != dummy_image.shape:
+            if first_image and image.shape != first_image.shape:
                 continue
 
-            slice_args = [
-                slice(None)
-                for i in range(image.src.ndim)
-            ]
-            offset = min(self.get_parameter_value("slice_offset"), image.src.shape[axis] - 1)
-            slice_args[axis] = slice(offset, offset + 1)
+            # only read the slice from the image data
+            block = np.asanyarray(image.src.dataobj[self.get_slices(image.shape)])
 
-            slices.append(
-                image.src.slicer[tuple(slice_args)].get_fdata()
-            )
-            if not dummy_image:
-                dummy_image = image
+            if combined is None:
+                first_image = image
+                combined = self._allocate(block.shape, axis, count or 16, block.dtype)
 
-        if slices:
-            combined_array = numpy.concatenate(slices, axis=axis)
+            elif num_slices >= combined.shape[axis] or not np.can_cast(block.dtype, combined.dtype):
+                combined = self._reallocate(
+                    combined, axis,
+                    size=max(combined.shape[axis], num_slices * 2),
+                    dtype=np.promote_types(block.dtype, combined.dtype),
+                )
+
+            index = [slice(None)] * combined.ndim
+            index[axis] = slice(num_slices, num_slices + 1)
+            combined[tuple(index)] = block
+            num_slices += 1
+
+        if combined is not None:
+            index = [slice(None)] * combined.ndim
+            index[axis] = slice(0, num_slices)
             combined_image = nibabel.Nifti1Image(
-                combined_array,
-                affine=dummy_image.src.affine,
+                combined[tuple(index)],
+                affine=first_image.src.affine,
             )
             yield self.image_replace(
-                image=dummy_image,
+                image=first_image,
                 src=combined_image,
                 filename="combined.nii.gz",
             )
+
+    def get_slices(self, shape: Tuple[int, ...]) -> Tuple[slice, ...]:
+        axis = self.get_parameter_value("slice_axis")
+        offset = min(self.get_parameter_value("slice_offset"), shape[axis] - 1)
+
+        slices = [slice(None)] * len(shape)
+        slices[axis] = slice(offset, offset + 1)
+        return tuple(slices)
+
+    def get_input_region(
+            self,
+            input_shape: Tuple[int, ...],
+            output_region: Optional[Region] = None,
+    ) -> Optional[Region]:
+        return self.get_slices(input_shape)
+
+    def _allocate(
+            self,
+            slice_shape: Tuple[int, ...],
+            axis: int,
+            size: int,
+            dtype: np.dtype,
+    ) -> np.ndarray:
+        shape = list(slice_shape)
+        shape[axis] = size
+        if self.get_parameter_value("memory_map"):
+            os.makedirs(config.TEMP_PATH, exist_ok=True)
+            # the anonymous file is removed when the array is released
+            return np.memmap(
+                tempfile.TemporaryFile(dir=config.TEMP_PATH),
+                dtype=dtype, mode="w+", shape=tuple(shape),
+            )
+        return np.zeros(shape, dtype=dtype)
+
+    def _reallocate(self, array: np.ndarray, axis: int, size: int, dtype: np.dtype) -> np.ndarray:
+        new_array = self._allocate(array.shape, axis, size, dtype)
+        index = [slice(None)] * array.ndim
+        index[axis] = slice(0, array.shape[axis])
+        new_array[tuple(index)] = array
+        return new_array
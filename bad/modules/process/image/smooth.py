@@ -0,0 +1,101 @@
+import concurrent.futures
+import os
+from typing import List, Generator
+
+import numpy as np
+
+from bad.parallel import ProcessWorker
+from bad.util.image import smooth_volume
+from ...params import *
+from .base import ImageProcessModuleBase, ImageObject, VoxelData
+
+
+class ImageSmoothModule(ImageProcessModuleBase):
+
+    name = "image_smooth"
+    help = """
+    Gaussian smoothing with the full-width-at-half-maximum given in millimeters.
+
+    Uses the same kernel as CAT12/SPM smoothing but runs in memory
+    without starting the matlab runtime. The result is stored as float32.
+    """
+
+    parameters = [
+        ParameterFloat(
+            name="smooth_x", default_value=6., min_value=0.,
+            description="Full-width-at-half-maximum in mm on x-axis",
+        ),
+        ParameterFloat(
+            name="smooth_y", default_value=6., min_value=0.,
+            description="Full-width-at-half-maximum in mm on y-axis",
+        ),
+        ParameterFloat(
+            name="smooth_z", default_value=6., min_value=0.,
+            description="Full-width-at-half-maximum in mm on z-axis",
+        ),
+        *ImageProcessModuleBase.parameters
+    ]
+
+    # number of threads per image, None for the number of CPUs
+    #   divided by the size of the process pool that runs the module
+    num_threads = None
+
+    fusable = True
+    one_output_per_input = True
+
+    def smooth_vector(self) -> List[float]:
+        return [
+            self.get_parameter_value("smooth_x"),
+            self.get_parameter_value("smooth_y"),
+            self.get_parameter_value("smooth_z"),
+        ]
+
+    def process_objects(
+            self,
+            images: Iterable[ImageObject],
+            stub: bool = False
+    ) -> Generator[ImageObject, None, None]:
+        for image in images:
+            if stub:
+                yield self.image_replace(image)
+            else:
+                yield self.image_replace(
+                    image,
+                    src=self.process_voxels(VoxelData.from_image(image.src)).to_image(),
+                )
+
+    def process_voxels(self, voxels: VoxelData) -> VoxelData:
+        # full-width-at-half-maximum in voxels
+        fwhm = [
+            mm / voxel_size if voxel_size else 0.
+            for mm, voxel_size in zip(self.smooth_vector(), voxels.voxel_size[:3])
+        ]
+        num_threads = self.get_num_threads()
+        data = smooth_volume(
+            np.asanyarray(voxels.data, dtype=np.float32),
+            fwhm=fwhm,
+            num_threads=num_threads,
+            executor=self._get_executor(num_threads) if num_threads > 1 else None,
+        )
+        return VoxelData(data=data, affine=voxels.affine)
+
+    def get_num_threads(self) -> int:
+        if self.num_threads:
+            return self.num_threads
+        return max(1, (os.cpu_count() or 1) // (ProcessWorker.current_pool_size() or 1))
+
+    def _get_executor(self, num_threads: int) -> concurrent.futures.ThreadPoolExecutor:
+        # a forked process does not inherit the threads of the executor
+        executor, pid = getattr(self, "_executor", (None, None))
+        if executor is None or pid != os.getpid():
+            executor = concurrent.futures.ThreadPoolExecutor(num_threads)
+            self._executor = (executor, os.getpid())
+        return executor
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop("_executor", None)
+        return state
+
+    def get_output_shape(self, input_shape: Tuple[int, ...]) -> Optional[Tuple[int, ...]]:
+        return tuple(input_shape)
@@ -1,19 +1,38 @@
 import os
 import queue
 from multiprocessing import Process, current_process, Manager
-from typing import List, Callable
+from typing import List, Callable, Optional
 
 from .workerbase import WorkerBase
 
 
 class ProcessWorker(WorkerBase):
 
+    # size of the pool, only set inside its processes
+    _current_pool_size: Optional[int] = None
+
     def __init__(self, size: int = 0):
         super().__init__(size=size)
         self._manager = Manager()
         self._queue = self._manager.Queue()
+        self._cancel_event = self._manager.Event()
         self._processes: List[Process] = []
 
+    @property
+    def manager(self):
+        """
+        The `multiprocessing.Manager` of the pool,
+        to create objects that are shared with the calls
+        """
+        return self._manager
+
+    @staticmethod
+    def current_pool_size() -> Optional[int]:
+        """
+        The size of the pool when called inside one of its processes, otherwise None
+        """
+        return ProcessWorker._current_pool_size
+
     def running(self) -> bool:
         return bool(self._processes)
 
@@ -43,11 +62,13 @@ class ProcessWorker(WorkerBase):
             t.join()
 
     def _mainloop(self):
+        ProcessWorker._current_pool_size = self._size
+
         while not self._do_stop:
             try:
                 action = self._queue.get(timeout=1)
                 # print("ACTION", action, self._do_stop)
-                if action.get("call"):
+                if action.get("call") and not self._cancel_event.is_set():
                     action["call"]()
                 if action.get("stop"):
                     self._do_stop = True
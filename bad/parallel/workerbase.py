@@ -1,5 +1,6 @@
 import os
 import queue
+import threading
 from threading import current_thread
 from multiprocessing import current_process
 from functools import partial
@@ -11,6 +12,7 @@ class WorkerBase:
     def __init__(self, size: int = 0):
        self._do_stop = None
        self._queue = queue.Queue()
+       self._cancel_event = threading.Event()
        self._size = size or os.cpu_count()
 
     def __enter__(self):
@@ -24,6 +26,15 @@ class WorkerBase:
     def size(self) -> int:
         return self._size
 
+    @property
+    def cancel_event(self):
+        """
+        Event that is set by `cancel`.
+        Long running calls can pass it along and check it
+        to stop cooperatively.
+        """
+        return self._cancel_event
+
     def running(self) -> bool:
         raise NotImplementedError
 
@@ -46,6 +57,13 @@ class WorkerBase:
         self._do_stop = True
         self._stop()
 
+    def cancel(self):
+        """
+        Skip all calls that have not started yet and set the `cancel_event`.
+        Use `stop` to wait for the running calls.
+        """
+        self._cancel_event.set()
+
     def put(self, callable: Callable, *args, **kwargs):
         if args or kwargs:
             callable = partial(callable, *args, **kwargs)
@@ -61,7 +79,7 @@ class WorkerBase:
         while not self._do_stop:
             try:
                 action = self._queue.get(timeout=1)
-                if action.get("call"):
+                if action.get("call") and not self._cancel_event.is_set():
                     action["call"]()
                 if action.get("stop"):
                     self._do_stop = True
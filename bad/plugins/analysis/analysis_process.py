@@ -9,7 +9,7 @@ from functools import partial
 import numpy as np
 
 from bad import config
-from bad.process import ProcessBase, EventType, Progress
+from bad.process import ProcessBase, ProcessPriority, EventType, Progress
 from bad.modules import *
 from bad.parallel import ProcessWorker
 
@@ -20,6 +20,7 @@ from bad.plugins.analysis.analysis import Analysis
 
 class AnalysisProcess(ProcessBase):
     name = "analysis"
+    priority = ProcessPriority.INTERACTIVE
 
     def run(self):
         # print(json.dumps(self.kwargs, indent=2))
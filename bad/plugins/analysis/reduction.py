@@ -12,10 +12,14 @@ from bad import config
 from bad.modules import *
 from bad.util.image import nibabel_to_numpy_float
 from bad.util.numpy_iterable import NumpyIterable
+from bad.util.region import restrict_to_region
 
 
 class AnalysisReduction:
 
+    # number of images that are passed through the process modules at once
+    process_batch_size = 16
+
     def __init__(
             self,
             modules: List[Module],
@@ -289,11 +293,37 @@ class AnalysisReduction:
             )
 
     def iter_processed_image_objects(self, files: List[dict]) -> Generator[Tuple[ImageObject, dict], None, None]:
-        for image, attributes in self.iter_image_objects(files):
+        # images are passed through the process modules in small batches
+        #   so modules like `image_resample` can process them together
+        iterable = self.iter_image_objects(files)
+        while True:
+            batch = list(itertools.islice(iterable, self.process_batch_size))
+            if not batch:
+                break
+
+            images = [image for image, _ in batch]
+            for image in images:
+                # only read the voxels that the process modules need
+                image.src = restrict_to_region(
+                    image.src,
+                    ModuleGraph.get_required_region(self.process_modules, image.shape),
+                )
+
             for module in self.process_modules:
-                image = next(module.process_objects([image]))
+                images = self._process_image_batch(module, images)
 
-            yield image, attributes
+            for image, (_, attributes) in zip(images, batch):
+                yield image, attributes
+
+    @staticmethod
+    def _process_image_batch(module: ImageProcessModuleBase, images: List[ImageObject]) -> List[ImageObject]:
+        if getattr(module, "one_output_per_input", False):
+            return list(module.process_objects(images))
+        # the module might produce several images per input, just use the first output of each
+        return [
+            next(module.process_objects([image]))
+            for image in images
+        ]
 
     def run_reduction(self, target_path: Union[str, Path], run_index: int = 0):
         assert self.reduction_module, "Can not run reduction without reduction module"
@@ -377,12 +407,14 @@ class AnalysisReduction:
             for image, attributes in images:
                 image = nibabel_to_numpy_float(image.src)
 
-                if normalize_image_mode:
-                    image = self._normalize(image, normalize_image_mode, {})
-
-                if np.any(np.isnan(image)):
+                # min and max are NaN if any voxel is NaN
+                values = self._get_normalize_values(image, mode=normalize_image_mode)
+                if np.isnan(values["min_v"]) or np.isnan(values["max_v"]):
                     raise ValueError(f"NaN value in processed image id='{attributes['id']}'")
 
+                if normalize_image_mode:
+                    image = self._normalize(image, normalize_image_mode, values)
+
                 yield image
 
                 attribute_table.append(attributes)
@@ -411,6 +443,9 @@ class AnalysisReduction:
         return values
 
     def _normalize(self, data: np.ndarray, mode: str, values: dict) -> np.ndarray:
+        """
+        Normalize `data` in-place (if it is a float array)
+        """
         if mode == "no":
             return data
 
@@ -419,12 +454,17 @@ class AnalysisReduction:
 
         min_v, max_v = values["min_v"], values["max_v"]
 
+        if not np.issubdtype(data.dtype, np.floating):
+            data = data.astype(np.float64)
+
         if mode == "zero_one":
             if min_v - max_v:
-                data = (data - min_v) / (max_v - min_v)
+                data -= min_v
+                data /= (max_v - min_v)
 
         elif mode == "plus_minus_one":
-            max_v = np.abs(data).max()
+            # absolute maximum of this data, without an np.abs() copy
+            max_v = max(-data.min(), data.max())
             if max_v:
                 data /= max_v
 
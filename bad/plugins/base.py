@@ -3,7 +3,7 @@ from typing import Optional, Iterable, Mapping, Any, Sequence, Union, Type, List
 import pymongo.database
 
 from bad import logger
-from bad.process import ProcessItem, ProcessDb
+from bad.process import ProcessItem, ProcessDb, summarize_throughput
 from bad.modules import Module, registered_modules, ModuleFactory
 
 registered_plugins = dict()
@@ -91,6 +91,7 @@ class PluginBase:
             **process_data,
             "events": list(events),
             "object_count": object_count,
+            "throughput": summarize_throughput(process_data),
         }
 
     @classmethod
@@ -1,14 +1,40 @@
 import datetime
+import re
 import uuid
-from typing import Optional, Iterable
+from typing import Optional, Iterable, Dict, Tuple
+
+import tornado.ioloop
 
 from bad.plugins import PluginBase
+from bad.process import process_log_filename, read_log
 from bad.server.handlers import JsonBaseHandler, DbRestHandler
 
 
 class ProcessPlugin(PluginBase):
+    """
+    Clients can follow the log output of a process with the websocket messages
+
+        process:<process-uuid>:log_follow    {"offset": -65536}
+        process:<process-uuid>:log_unfollow
+
+    New lines are sent as `process:<process-uuid>:log` messages.
+    """
     name = "process"
 
+    # milliseconds between checks of the followed log files
+    log_interval = 500
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (client_id, process_uuid) -> file offset
+        self._log_follows: Dict[Tuple[str, str], int] = {}
+        self._log_callback: Optional[tornado.ioloop.PeriodicCallback] = None
+
+    def terminate(self):
+        if self._log_callback is not None:
+            self._log_callback.stop()
+            self._log_callback = None
+
     def get_handlers(self) -> Optional[Iterable]:
         return [
             (r"/api/process/event/([a-z0-9\-]*)/?", EventRestHandler),
@@ -17,6 +43,38 @@ class ProcessPlugin(PluginBase):
             (r"/api/process/([a-z0-9\-]*)/?", ProcessRestHandler),
         ]
 
+    def on_websocket_log_follow(self, client_id: str, uuid: str, data: dict):
+        if not re.match(r"^[a-z0-9\-]+$", uuid):
+            return
+        offset = data.get("offset")
+        self._log_follows[(client_id, uuid)] = -65536 if offset is None else int(offset)
+        if self._log_callback is None:
+            self._log_callback = tornado.ioloop.PeriodicCallback(self._send_log_lines, self.log_interval)
+            self._log_callback.start()
+        self._send_log_lines()
+
+    def on_websocket_log_unfollow(self, client_id: str, uuid: str, data: dict):
+        self._log_follows.pop((client_id, uuid), None)
+
+    def _send_log_lines(self):
+        for (client_id, uuid), offset in list(self._log_follows.items()):
+            if not self.server.call_plugin("websocket", "has_client", client_id=client_id):
+                self._log_follows.pop((client_id, uuid), None)
+                continue
+
+            lines, new_offset = read_log(process_log_filename(uuid), offset)
+            self._log_follows[(client_id, uuid)] = new_offset
+            if lines or new_offset != offset:
+                self.server.send_message(
+                    f"process:{uuid}:log",
+                    {"uuid": uuid, "lines": lines, "offset": new_offset},
+                    client=client_id,
+                )
+
+        if not self._log_follows and self._log_callback is not None:
+            self._log_callback.stop()
+            self._log_callback = None
+
 
 class ProcessRestHandler(DbRestHandler):
 
@@ -72,12 +72,18 @@ class WebSocketPlugin(PluginBase):
     ):
         if client:
             if isinstance(client, str):
-                client = self.clients[client]
+                client = self.clients.get(client)
+                if client is None:
+                    # disconnected in the meantime
+                    return
             client.write_message(message)
         else:
             for client_id, client in self.clients.items():
                 client.write_message(message)
 
+    def has_client(self, client_id: str) -> bool:
+        return client_id in self.clients
+
     def _add_client(self, client: WebSocketHandler):
         self.log.debug("new client", client)
         self.clients[client.client_id] = client
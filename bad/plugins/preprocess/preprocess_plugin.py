@@ -51,6 +51,22 @@ class PreprocessPlugin(PluginBase):
                 than available CPU cores or hyper-threads. Also, for heavy modules like
                 the *CAT12 Preprocessing* the memory requirements for each process are
                 several Gigabytes.
+                
+                A memory watchdog pauses processes when the available memory gets low
+                and continues them when there is enough memory again. This is
+                recorded in the *watchdog* events of the process.
+                """
+            ),
+            ParameterBool(
+                name="distributed", default_value=False,
+                description="Distribute the source files to the work queue workers on all nodes",
+                help="""
+                Instead of running the pipeline in local processes, the source files are
+                split into work items which are processed by the work queue workers
+                (`python bad/main.py worker`) on any number of machines.
+                
+                All workers need access to the database and to the same
+                source and target paths.
                 """
             ),
             ParameterFilepath(
@@ -80,6 +96,16 @@ class PreprocessPlugin(PluginBase):
                   parameters have changed, the source is skipped.  
                 """
             ),
+            ParameterBool(
+                name="link_files", default_value=False,
+                description="Store unmodified source files as hardlinks",
+                help="""
+                Source files that pass the pipeline unchanged are stored as hardlinks
+                instead of copies, where the file system allows it. This saves time and
+                disk space, but the stored files and the source files are then the same
+                files and must never be changed in-place.
+                """
+            ),
         ])
         return form
 
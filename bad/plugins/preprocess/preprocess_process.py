@@ -1,12 +1,17 @@
+import os
 import time
 import signal
-from typing import Dict, Generator, Iterable, List, Optional
+import threading
+from typing import Any, Callable, Dict, Generator, Iterable, List, Mapping, Optional
 from functools import partial
 
 import numpy as np
 
 from bad import config
-from bad.process import ProcessBase, EventType, Progress
+from bad.process import (
+    ProcessBase, ProcessDb, ProcessPriority, ProcessResources, EventType, Progress, ThroughputCounter,
+    WorkItemStatus, ConcurrencyLimit, MemoryWatchdog,
+)
 from bad.modules import *
 from bad.parallel import ProcessWorker
 
@@ -15,6 +20,33 @@ import bad.plugins.preprocess
 
 class PreprocessingProcess(ProcessBase):
     name = "preprocessing"
+    priority = ProcessPriority.BATCH
+
+    # seconds between checks of the work queue in distributed mode
+    work_queue_poll_interval = 2.
+    # seconds after which a warning is stored if no worker has claimed the pending work items
+    work_queue_stall_seconds = 300.
+
+    # seconds to wait for the current objects after `cancel`, before the process is killed
+    cancel_timeout = 120.
+
+    @classmethod
+    def get_resources(cls, kwargs: Mapping[str, Any]) -> ProcessResources:
+        plugin = kwargs.get("plugin")
+        if isinstance(plugin, Mapping) and plugin.get("distributed"):
+            # the work is done by the work queue workers
+            return ProcessResources(cpus=1)
+        return super().get_resources(kwargs)
+
+    @classmethod
+    def get_memory_per_cpu(cls, kwargs: Mapping[str, Any]) -> float:
+        plugin = kwargs.get("plugin")
+        module_dicts = plugin.get("modules") if isinstance(plugin, Mapping) else None
+        for module_dict in module_dicts or []:
+            module_class = registered_modules.get(module_dict.get("name"))
+            if module_class is not None and "cat12" in module_class.group:
+                return config.CAT12_MEMORY_PER_PROCESS
+        return config.PREPROCESS_MEMORY_PER_PROCESS
 
     def run(self):
         graph = self.create_module_graph()
@@ -30,6 +62,10 @@ class PreprocessingProcess(ProcessBase):
         source_object_count_map = graph.get_source_object_counts()
         self.process_item.store_source_object_count(source_object_count_map)
 
+        if self.kwargs["plugin"].get("distributed"):
+            self._run_distributed(sum(source_object_count_map.values()))
+            return
+
         num_processes = self.kwargs["plugin"].get("num_processes") or 1
 
         run_graph_kwargs = {
@@ -42,63 +78,269 @@ class PreprocessingProcess(ProcessBase):
         else:
             with ProcessWorker(num_processes) as pool:
                 self._pool = pool
-                for i in range(pool.size):
-                    pool.put(partial(
-                        self._run_graph,
-                        **run_graph_kwargs,
-                        interval=pool.size,
-                        offset=i,
-                    ))
+                # fewer workers are active when the host memory gets low
+                concurrency = ConcurrencyLimit(pool.manager, pool.size)
+                watchdog = MemoryWatchdog(concurrency, on_decision=self._store_watchdog_event)
+                watchdog.start()
+                try:
+                    for i in range(pool.size):
+                        pool.put(partial(
+                            self._run_graph,
+                            **run_graph_kwargs,
+                            interval=pool.size,
+                            offset=i,
+                            cancel_event=pool.cancel_event,
+                            concurrency=concurrency,
+                        ))
+                    pool.stop()
+                finally:
+                    watchdog.stop()
             self._pool = None
 
+        if self.cancelled:
+            self.process_item.store_event(
+                EventType.INFO, "cancelled, completed objects are kept and skipped by the next run",
+            )
+
+    def _run_distributed(self, num_sources: int):
+        """
+        Publish the sources as work items and wait until the workers are done.
+
+        Each work item processes every n-th source file of each source module,
+        like the sub-processes of a local run.
+        """
+        if self.cancelled:
+            return
+        num_items = max(1, min(num_sources, config.WORK_QUEUE_MAX_ITEMS))
+        self._work_queue = ProcessDb().work_queue()
+        self._work_queue.publish(
+            self.uuid, self.name,
+            [{"interval": num_items, "offset": i} for i in range(num_items)],
+        )
+        self.process_item.store_event(EventType.INFO, f"published {num_items} work items")
+
+        # time since when items are pending but none is claimed
+        stalled_since = None
+        stall_warned = False
+        while not self._work_queue.is_finished(self.uuid):
+            counts = self._work_queue.status_counts(self.uuid)
+            self.process_item.store_progress(Progress("running pipeline on workers", data=counts))
+
+            if counts.get(WorkItemStatus.PENDING) and not counts.get(WorkItemStatus.CLAIMED):
+                if stalled_since is None:
+                    stalled_since = time.time()
+                elif not stall_warned and time.time() - stalled_since >= self.work_queue_stall_seconds:
+                    self.process_item.store_event(
+                        EventType.WARNING,
+                        f"no worker has claimed a work item for {round(time.time() - stalled_since)} seconds"
+                        f", are workers running (`python bad/main.py worker`)?",
+                        data=counts,
+                    )
+                    stall_warned = True
+            else:
+                stalled_since = None
+                stall_warned = False
+
+            time.sleep(self.work_queue_poll_interval)
+
+        counts = self._work_queue.status_counts(self.uuid)
+        self.process_item.store_progress(Progress("running pipeline on workers", data=counts))
+
+        for item in self._work_queue.failed_items(self.uuid):
+            self.process_item.store_event(
+                EventType.ERROR, item["error"],
+                data={"work_item": item["uuid"], "payload": item["payload"], "worker": item["worker"]},
+            )
+        if self.cancelled:
+            return
+        if counts.get(WorkItemStatus.FAILED) or counts.get(WorkItemStatus.CANCELLED):
+            raise RuntimeError(
+                f"{counts.get(WorkItemStatus.FAILED, 0)} work items failed"
+                f" and {counts.get(WorkItemStatus.CANCELLED, 0)} were cancelled"
+            )
+
+    def run_work_item(
+            self,
+            payload: Mapping[str, Any],
+            worker: str,
+            is_cancelled: Optional[Callable[[], bool]] = None,
+    ):
+        """
+        Run the graph for one work item of a distributed run.
+
+        :param is_cancelled: optional callable, stops processing further
+            source objects once it returns True, e.g. when the lease is lost
+        """
+        # modules are prepared once per worker
+        if getattr(self, "_work_graph", None) is None:
+            graph = self.create_module_graph()
+            graph.prepare_modules()
+            self._work_graph = graph
+            self._work_counter = ThroughputCounter(self.process_item, worker=worker)
+
+        self._run_graph(
+            self._work_graph,
+            interval=payload["interval"],
+            offset=payload["offset"],
+            counter=self._work_counter,
+            is_cancelled=is_cancelled,
+        )
+        self.process_item.flush()
+        # the next work item has other source files
+        self.process_item.clear_counted_files()
+
+    @property
+    def cancelled(self) -> bool:
+        return getattr(self, "_cancelled", False)
+
+    def cancel(self):
+        """
+        Stop cooperatively: no further source objects are started,
+        the objects in the pipeline are completed and stored and all
+        buffered database writes are flushed. Because targets are written
+        atomically, a following run with a skip policy continues
+        where this one stopped.
+
+        If the workers did not stop after `cancel_timeout` seconds,
+        the process sends itself another SIGTERM, which kills it.
+        """
+        if self.cancelled:
+            return
+        self._cancelled = True
+
+        pool = getattr(self, "_pool", None)
+        if pool:
+            pool.cancel()
+
+        work_queue = getattr(self, "_work_queue", None)
+        if work_queue:
+            work_queue.cancel(self.uuid)
+
+        timer = threading.Timer(self.cancel_timeout, self._on_cancel_timeout)
+        timer.daemon = True
+        timer.start()
+
+    def _store_watchdog_event(self, text: str, data: dict):
+        self.process_item.store_event(EventType.WATCHDOG, text, data=data)
+
+    def _on_cancel_timeout(self):
+        self.log.warning(f"workers did not stop within {self.cancel_timeout} seconds")
+        os.kill(os.getpid(), signal.SIGTERM)
+
     def kill(self):
         pool = getattr(self, "_pool", None)
         if pool:
             pool.kill()
             self._pool = None
 
+        work_queue = getattr(self, "_work_queue", None)
+        if work_queue:
+            work_queue.cancel(self.uuid)
+            self._work_queue = None
+
     def _run_graph(
             self,
             graph: ModuleGraph,
             interval: int = 1,
             offset: int = 0,
+            counter: Optional[ThroughputCounter] = None,
+            cancel_event: Optional[threading.Event] = None,
+            concurrency: Optional[ConcurrencyLimit] = None,
+            is_cancelled: Optional[Callable[[], bool]] = None,
     ):
+        if is_cancelled is None:
+            # sub-processes get the event of the pool, `self.cancelled` is only set in the main process
+            is_cancelled = cancel_event.is_set if cancel_event is not None else lambda: self.cancelled
+
+        def _wait_until_active():
+            # paused workers wait here until the watchdog activates them again
+            concurrency.wait_until_active(offset, is_cancelled)
+
+        if counter is None:
+            counter = ThroughputCounter(self.process_item, worker=str(offset))
+        # a counter can be continued over several runs
+        initial_counts = dict(counter.counts)
+        done_sources = set()
+        skipped_sources = set()
+
+        def _update_counter():
+            counter.update(
+                sources=initial_counts["sources"] + len(done_sources),
+                skipped_sources=initial_counts["skipped_sources"] + len(skipped_sources),
+                skipped=initial_counts["skipped"] + graph.report["skipped_objects"],
+                targets=initial_counts["targets"] + graph.report["stored_objects"],
+                bytes=initial_counts["bytes"] + graph.report["stored_bytes"],
+            )
+
         def _existing_target_callback(data: dict):
             self.process_item.store_object(
                 data, skipped=True,
             )
+            done_sources.add(data["actions"][0]["data"]["filename"])
+            skipped_sources.add(data["actions"][0]["data"]["filename"])
+            _update_counter()
 
-        for processed_object in graph.process(
-                source_types=["image"],
-                interval=interval,
-                offset=offset,
-                existing_target_callback=_existing_target_callback,
-        ):
-            self.process_item.store_object(
-                processed_object.to_dict(),
+        if concurrency is not None:
+            concurrency.register(offset)
+        try:
+            for processed_object in graph.process(
+                    source_types=["image"],
+                    interval=interval,
+                    offset=offset,
+                    existing_target_callback=_existing_target_callback,
+                    is_cancelled=is_cancelled,
+                    wait_until_active=_wait_until_active if concurrency is not None else None,
+            ):
+                object_data = processed_object.to_dict()
+                self.process_item.store_object(object_data)
+                processed_object.discard()
+                done_sources.add(object_data["actions"][0]["data"]["filename"])
+                _update_counter()
+
+                # leave the remaining objects of a module batch,
+                #   each stored target is complete at this point
+                if is_cancelled():
+                    break
+
+            # a continued counter becomes active again with the next run
+            counter.finish()
+
+            self.process_item.store_event(
+                EventType.GRAPH_RESULT,
+                data={
+                    "sub_process": offset,
+                    "report": graph.report,
+                    "cancelled": is_cancelled(),
+                },
             )
-            processed_object.discard()
-
-        self.process_item.store_event(
-            EventType.GRAPH_RESULT,
-            data={
-                "sub_process": offset,
-                "report": graph.report,
-            },
-        )
+
+        finally:
+            if concurrency is not None:
+                concurrency.unregister(offset)
+            self.process_item.flush()
 
 
 def main():
     proc = PreprocessingProcess.create_from_commandline()
 
+    main_pid = os.getpid()
+
     def on_terminate(sig_num, stack_frame):
-        proc.log.info("SIGTERM received")
-        proc.kill()
-        exit(-9)  # tell ProcessRunner that we were killed
+        # the first SIGTERM stops cooperatively, a second one
+        #   (or one to a forked sub-process) kills immediately
+        if proc.cancelled or os.getpid() != main_pid:
+            proc.log.info("SIGTERM received, killing")
+            proc.kill()
+            exit(-9)  # tell ProcessRunner that we were killed
+
+        proc.log.info("SIGTERM received, stopping after the current objects")
+        proc.cancel()
 
     signal.signal(signal.SIGTERM, on_terminate)
 
     proc.run_and_catch()
+    if proc.cancelled:
+        exit(-9)
 
 
 if __name__ == "__main__":
@@ -1,6 +1,12 @@
 from .base import ProcessBase, registered_processes
-from .processdb import ProcessStatus, ProcessItem, Progress, ProcessDb, EventType
+from .processdb import (
+    ProcessStatus, ProcessPriority, ProcessResources, ProcessItem, Progress, ProcessDb, EventType
+)
+from .progress import ThroughputCounter, summarize_throughput
+from .processlog import ProcessLog, process_log_filename, read_log
 from .runner import ProcessRunner
 from .scheduler import ProcessScheduler
+from .watchdog import ConcurrencyLimit, MemoryWatchdog, available_memory, process_tree_rss
+from .workqueue import WorkItemStatus, WorkQueue, WorkQueueWorker
 
 
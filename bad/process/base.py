@@ -7,6 +7,7 @@ from typing import Mapping, Any, Optional, List, Dict, Iterable
 from bad import logger
 from bad.db import DatabaseMixin
 from bad.modules import ModuleFactory, Module, ModuleGraph
+from .processdb import ProcessPriority, ProcessResources
 
 registered_processes = dict()
 
@@ -32,9 +33,17 @@ class ProcessBase(DatabaseMixin):
         if __name__ == "__main__":
             MyProcess.run_from_commandline()
 
+    Objects, events and progress of the `process_item` are written to the
+    database in bulk. They are flushed after `run` and when the process exits.
     """
     name: str = None
 
+    # start priority in the ProcessScheduler, see `ProcessPriority`
+    priority: int = ProcessPriority.NORMAL
+
+    # gigabytes of memory per used CPU, 0 for unknown
+    memory_per_cpu: float = 0.
+
     def __init_subclass__(cls, **kwargs):
         assert cls.name, f"Must {cls.__name__}.name property"
         if cls.name in registered_processes:
@@ -57,7 +66,7 @@ class ProcessBase(DatabaseMixin):
         self.uuid = uuid
         self.do_raise = do_raise
         self.log = logger.Logger(f"{self.name}/{self.uuid}")
-        self.process_item = ProcessDb().get_process(self.uuid)
+        self.process_item = ProcessDb(buffered=True).get_process(self.uuid)
         assert self.process_item, f"running {self.__class__.__name__} on non-existing process '{self.uuid}'"
 
     def __repr__(self):
@@ -75,13 +84,35 @@ class ProcessBase(DatabaseMixin):
         self.do_raise = state["do_raise"]
 
         self.log = logger.Logger(f"{self.name}/{self.uuid}")
-        self.process_item = ProcessDb().get_process(self.uuid)
+        self.process_item = ProcessDb(buffered=True).get_process(self.uuid)
         assert self.process_item, f"running {self.__class__.__name__} on non-existing process '{self.uuid}'"
 
     @property
     def kwargs(self) -> Mapping[str, Any]:
         return self.process_item.kwargs
 
+    @classmethod
+    def get_resources(cls, kwargs: Mapping[str, Any]) -> ProcessResources:
+        """
+        Return the resources that a run with the given kwargs will occupy.
+
+        The default uses the `num_processes` setting of the plugin.
+        """
+        plugin = kwargs.get("plugin")
+        cpus = 1
+        if isinstance(plugin, Mapping):
+            cpus = max(1, int(plugin.get("num_processes") or 1))
+        return ProcessResources(cpus=cpus, memory=cpus * cls.get_memory_per_cpu(kwargs))
+
+    @classmethod
+    def get_memory_per_cpu(cls, kwargs: Mapping[str, Any]) -> float:
+        """
+        Return the gigabytes of memory per used CPU for a run with the given kwargs.
+
+        The default is `memory_per_cpu`.
+        """
+        return cls.memory_per_cpu
+
     def create_module_graph(self, **kwargs) -> ModuleGraph:
         """Only suitable for processing stage!"""
         kwargs.setdefault("modules", [
@@ -89,8 +120,9 @@ class ProcessBase(DatabaseMixin):
             for module_dict in self.process_item.kwargs["plugin"]["modules"]
         ])
         kwargs.setdefault("target_path", self.process_item.kwargs["plugin"]["target_path"])
-        if "skip_policy" in self.process_item.kwargs["plugin"]:
-            kwargs.setdefault("skip_policy", self.process_item.kwargs["plugin"]["skip_policy"])
+        for key in ("skip_policy", "link_files"):
+            if key in self.process_item.kwargs["plugin"]:
+                kwargs.setdefault(key, self.process_item.kwargs["plugin"][key])
         return ModuleGraph(**kwargs)
 
     def store_event(
@@ -127,6 +159,7 @@ class ProcessBase(DatabaseMixin):
     def run_and_catch(self):
         try:
             self.run()
+            self.process_item.flush()
 
         except Exception as e:
             self.log.error(f"{type(e).__name__}: {e}")
@@ -138,3 +171,12 @@ class ProcessBase(DatabaseMixin):
 
     def run(self):
         raise NotImplementedError
+
+    def run_work_item(self, payload: Mapping[str, Any], worker: str):
+        """
+        Run one item of the `WorkQueue` that was published by `run`.
+
+        Called by a `WorkQueueWorker` on any node, usually several times
+        on the same instance for different items.
+        """
+        raise NotImplementedError
@@ -0,0 +1,240 @@
+import datetime
+import os
+import threading
+import time
+from multiprocessing.util import Finalize
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple
+
+import pymongo
+import pymongo.errors
+from pymongo.database import Database
+
+from bad import logger
+
+
+class BulkWriter:
+    """
+    Buffers inserts and updates of database documents and writes them in bulk.
+
+    The buffer is written when it holds `max_documents`, when the oldest
+    buffered document is `max_delay` seconds old, on `flush` and when the
+    process exits (also for `multiprocessing` child processes).
+
+    Updates and increments of the same document are merged.
+    Increments added with `increment_once` are only applied if their marker
+    document did not exist before, the markers are upserted in bulk as well.
+    Errors of the background flush are logged and re-raised by the next `flush`.
+    """
+
+    max_documents = 1000
+    max_delay = 1.
+
+    def __init__(self, database: Callable[[], Database]):
+        self._database = database
+        self.log = logger.Logger("bulk-writer")
+        self._lock = threading.RLock()
+        # serializes the writes so that batches are written in the order they were taken
+        self._write_lock = threading.Lock()
+        self._inserts: Dict[str, List[dict]] = {}
+        # (collection name, filter) -> update values
+        self._updates: Dict[Tuple[str, Tuple[Tuple[str, Any], ...]], dict] = {}
+        # (collection name, filter) -> increments
+        self._increments: Dict[Tuple[str, Tuple[Tuple[str, Any], ...]], Dict[str, int]] = {}
+        # marker collection name -> marker filter -> (collection name, filter) and increments
+        self._markers: Dict[str, Dict[Tuple[Tuple[str, Any], ...], Tuple[tuple, Dict[str, int]]]] = {}
+        self._num_documents = 0
+        self._first_time: Optional[float] = None
+        self._error: Optional[Exception] = None
+        self._pid: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._finalizer: Optional[Finalize] = None
+
+    def insert(self, collection_name: str, document: dict):
+        with self._lock:
+            self._check_process()
+            self._inserts.setdefault(collection_name, []).append(document)
+            full = self._add_document()
+        if full:
+            self.flush()
+
+    def update(self, collection_name: str, filter: Mapping[str, Any], values: Mapping[str, Any]):
+        """
+        Buffer a `{"$set": values}` update of the document that matches `filter`
+        """
+        with self._lock:
+            self._check_process()
+            key = (collection_name, tuple(sorted(filter.items())))
+            full = False
+            if key in self._updates:
+                self._updates[key].update(values)
+            else:
+                self._updates[key] = dict(values)
+                full = self._add_document()
+        if full:
+            self.flush()
+
+    def increment(self, collection_name: str, filter: Mapping[str, Any], values: Mapping[str, int]):
+        """
+        Buffer an `{"$inc": values}` update of the document that matches `filter`
+        """
+        with self._lock:
+            self._check_process()
+            key = (collection_name, tuple(sorted(filter.items())))
+            full = False
+            if key in self._increments:
+                increments = self._increments[key]
+                for name, value in values.items():
+                    increments[name] = increments.get(name, 0) + value
+            else:
+                self._increments[key] = dict(values)
+                full = self._add_document()
+        if full:
+            self.flush()
+
+    def increment_once(
+            self,
+            marker_collection_name: str,
+            marker: Mapping[str, Any],
+            collection_name: str,
+            filter: Mapping[str, Any],
+            values: Mapping[str, int],
+    ):
+        """
+        Buffer an `{"$inc": values}` update of the document that matches `filter`
+        which is only applied if the `marker` document is new in its collection.
+
+        The marker collection needs a unique index over the marker fields.
+        """
+        with self._lock:
+            self._check_process()
+            markers = self._markers.setdefault(marker_collection_name, {})
+            marker_key = tuple(sorted(marker.items()))
+            full = False
+            if marker_key not in markers:
+                markers[marker_key] = ((collection_name, tuple(sorted(filter.items()))), dict(values))
+                full = self._add_document()
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._check_process()
+        with self._write_lock:
+            with self._lock:
+                self._check_process()
+                inserts, updates, increments = self._inserts, self._updates, self._increments
+                markers = self._markers
+                self._inserts, self._updates, self._increments, self._markers = {}, {}, {}, {}
+                self._num_documents = 0
+                self._first_time = None
+                error, self._error = self._error, None
+
+            self._write(inserts, updates, increments, markers)
+        if error is not None:
+            raise error
+
+    def close(self):
+        """
+        Stop the background flush and write the remaining documents
+        """
+        self._stop_event.set()
+        thread = self._thread
+        if thread is not None and thread is not threading.current_thread() and self._pid == os.getpid():
+            thread.join()
+        self.flush()
+
+    def _add_document(self) -> bool:
+        """
+        Count a new buffered document, returns True if the buffer should be flushed.
+        Must be called with the lock held, flush after releasing it.
+        """
+        self._num_documents += 1
+        if self._first_time is None:
+            self._first_time = time.time()
+        if self._num_documents >= self.max_documents:
+            return True
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._flush_loop, name="bulk-writer", daemon=True)
+            self._thread.start()
+        return False
+
+    def _check_process(self):
+        """
+        Reset the state after a fork, the buffered documents belong to the parent process
+        """
+        pid = os.getpid()
+        if pid != self._pid:
+            self._pid = pid
+            self._inserts, self._updates, self._increments, self._markers = {}, {}, {}, {}
+            self._num_documents = 0
+            self._first_time = None
+            self._thread = None
+            self._write_lock = threading.Lock()
+            self._stop_event = threading.Event()
+            self._finalizer = Finalize(self, self.close, exitpriority=10)
+
+    def _flush_loop(self):
+        while not self._stop_event.wait(self.max_delay / 4):
+            with self._lock:
+                due = self._first_time is not None and time.time() - self._first_time >= self.max_delay
+            if due:
+                try:
+                    self.flush()
+                except Exception as e:
+                    self.log.error(f"{type(e).__name__}: {e}")
+                    with self._lock:
+                        self._error = e
+
+    def _write(
+            self,
+            inserts: Dict[str, List[dict]],
+            updates: Dict[tuple, dict],
+            increments: Dict[tuple, Dict[str, int]],
+            markers: Dict[str, Dict[tuple, Tuple[tuple, Dict[str, int]]]],
+    ):
+        if not inserts and not updates and not increments and not markers:
+            return
+        db = self._database()
+        for collection_name, documents in inserts.items():
+            db[collection_name].insert_many(documents, ordered=True)
+
+        for marker_collection_name, marker_map in markers.items():
+            new_markers = self._upsert_markers(db[marker_collection_name], list(marker_map))
+            for marker_key in new_markers:
+                key, values = marker_map[marker_key]
+                key_increments = increments.setdefault(key, {})
+                for name, value in values.items():
+                    key_increments[name] = key_increments.get(name, 0) + value
+
+        requests_per_collection: Dict[str, list] = {}
+        for key in list(updates) + [k for k in increments if k not in updates]:
+            collection_name, filter = key
+            update = {}
+            if key in updates:
+                update["$set"] = updates[key]
+            if key in increments:
+                update["$inc"] = increments[key]
+            requests_per_collection.setdefault(collection_name, []).append(
+                pymongo.UpdateOne(dict(filter), update)
+            )
+        for collection_name, requests in requests_per_collection.items():
+            db[collection_name].bulk_write(requests, ordered=True)
+
+    @staticmethod
+    def _upsert_markers(collection, marker_keys: List[tuple]) -> List[tuple]:
+        """
+        Upsert the marker documents and return the keys of the markers that did not exist before
+        """
+        timestamp = datetime.datetime.utcnow().isoformat()
+        requests = [
+            pymongo.UpdateOne(dict(marker_key), {"$setOnInsert": {"timestamp": timestamp}}, upsert=True)
+            for marker_key in marker_keys
+        ]
+        try:
+            upserted = collection.bulk_write(requests, ordered=False).upserted_ids
+        except pymongo.errors.BulkWriteError as e:
+            # markers that have been inserted concurrently by another process
+            upserted = {u["index"]: u["_id"] for u in e.details.get("upserted", [])}
+
+        return [marker_keys[index] for index in sorted(upserted)]
@@ -0,0 +1,99 @@
+import select
+import socket
+import threading
+from typing import Optional
+
+from bad import config, logger
+
+
+def notify_scheduler(port: Optional[int] = None):
+    """
+    Wake up the `ProcessScheduler`, e.g. after a process has been requested.
+
+    Sends a datagram to the scheduler's local port. Nothing happens
+    if no scheduler is listening, it will find the process by polling.
+    """
+    port = config.SCHEDULER_NOTIFY_PORT if port is None else port
+    if not port:
+        return
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto(b"wakeup", ("127.0.0.1", port))
+    except OSError:
+        pass
+
+
+class SchedulerWakeup:
+    """
+    The receiving end of `notify_scheduler`.
+
+    If `config.SCHEDULER_NOTIFY_PORT` is 0 or the port can not be bound,
+    `wait` sleeps for the timeout and is only woken up by `notify`
+    from the same process. An explicit `port` of 0 binds any free port.
+    """
+    def __init__(self, port: Optional[int] = None):
+        self.log = logger.Logger("scheduler-wakeup")
+        self.port: Optional[int] = None
+        self._socket: Optional[socket.socket] = None
+        self._event = threading.Event()
+
+        if port is None:
+            port = config.SCHEDULER_NOTIFY_PORT
+            if not port:
+                return
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.bind(("127.0.0.1", port))
+        except OSError as e:
+            self.log.warning(f"Can not listen on port {port}, falling back to polling: {e}")
+            sock.close()
+            return
+
+        sock.setblocking(False)
+        self._socket = sock
+        self.port = sock.getsockname()[1]
+
+    @property
+    def is_listening(self) -> bool:
+        """
+        True if other processes can wake up this instance with `notify_scheduler`
+        """
+        return self._socket is not None
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+    def notify(self):
+        """
+        Wake up a waiting `wait` call, e.g. from another thread
+        """
+        if self.port:
+            notify_scheduler(self.port)
+        else:
+            self._event.set()
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Wait until notified or until timeout.
+
+        :return: bool, True if notified
+        """
+        if self._socket is None:
+            notified = self._event.wait(timeout)
+            self._event.clear()
+            return notified
+
+        readable, _, _ = select.select([self._socket], [], [], timeout)
+        if not readable:
+            return False
+
+        # drain all pending notifications
+        while True:
+            try:
+                self._socket.recv(64)
+            except (BlockingIOError, InterruptedError):
+                break
+        return True
@@ -4,14 +4,19 @@ import os
 import signal
 import uuid
 import traceback
-from typing import Mapping, Any, Optional, Union, Sequence, List
+from typing import Mapping, Any, Optional, Union, Sequence, List, Dict, Set, Tuple
 
 import pymongo
+import pymongo.errors
 from pymongo.database import Collection
 
 from bad.db import DatabaseMixin
 from bad import logger
 from bad.modules import ModuleObject
+from .notify import notify_scheduler
+from .bulkwriter import BulkWriter
+from .progress import summarize_throughput
+from .workqueue import WorkQueue
 
 
 class ProcessStatus:
@@ -23,6 +28,15 @@ class ProcessStatus:
     KILLED = "killed"
 
 
+class ProcessPriority:
+    """
+    Requested processes with higher priority are started first
+    """
+    BATCH = 0
+    NORMAL = 10
+    INTERACTIVE = 20
+
+
 class EventType:
     INFO = "info"
     STARTED = "started"
@@ -32,6 +46,8 @@ class EventType:
     ERROR = "error"
     EXCEPTION = "exception"
     GRAPH_RESULT = "graph_result"
+    WATCHDOG = "watchdog"
+    WARNING = "warning"
 
 
 @dataclasses.dataclass
@@ -43,6 +59,25 @@ class Progress:
         return vars(self)
 
 
+@dataclasses.dataclass
+class ProcessResources:
+    """
+    The resources a process occupies while running.
+
+    `cpus` is the number of CPU slots, `memory` the number of gigabytes,
+    where 0 means unknown/not limited.
+    """
+    cpus: int = 1
+    memory: float = 0.
+
+    def to_dict(self):
+        return vars(self)
+
+    @classmethod
+    def from_dict(cls, data: Optional[Mapping[str, Any]]) -> "ProcessResources":
+        return cls(**(data or {}))
+
+
 class ProcessItem:
     """
     A link between a running Process and the database
@@ -54,6 +89,8 @@ class ProcessItem:
             uuid: str,
             kwargs: Mapping[str, Any],
             source_uuid: Optional[str] = None,
+            priority: int = ProcessPriority.NORMAL,
+            resources: Optional[ProcessResources] = None,
     ):
         self.db = db
         now = datetime.datetime.utcnow().isoformat()
@@ -67,6 +104,10 @@ class ProcessItem:
             "pid": None,
             "progress": None,
             "source_object_count": None,
+            "worker_progress": {},
+            "object_count": {"source": {}, "target": {}},
+            "priority": priority,
+            "resources": (resources or ProcessResources()).to_dict(),
         }
         self.log = logger.Logger(self.uuid)
 
@@ -104,11 +145,21 @@ class ProcessItem:
     def pid(self) -> Optional[int]:
         return self._data["pid"]
 
+    @property
+    def priority(self) -> int:
+        return self._data.get("priority", ProcessPriority.NORMAL)
+
+    @property
+    def resources(self) -> ProcessResources:
+        return ProcessResources.from_dict(self._data.get("resources"))
+
     def update_from_db(self) -> "ProcessItem":
         self.db._read_item(self)
         return self
 
     def store_status(self, status: str, pid: Optional[int] = None):
+        if status in (ProcessStatus.FINISHED, ProcessStatus.FAILED, ProcessStatus.KILLED):
+            self.clear_counted_files()
         self._data["status"] = status
         update_only = ["status"]
         if pid is not None:
@@ -116,6 +167,13 @@ class ProcessItem:
             update_only.append("pid")
         self.db._store_item(self, update_only=update_only)
 
+    def clear_counted_files(self):
+        """
+        Forget the files that have been counted by this instance,
+        the markers in the database still prevent counting them twice
+        """
+        self.db._counted_files.pop(self.uuid, None)
+
     def store_source_object_count(self, count_map: dict):
         self._data["source_object_count"] = count_map
         self.db._store_item(self, update_only="source_object_count")
@@ -124,6 +182,19 @@ class ProcessItem:
         self._data["progress"] = progress.to_dict()
         self.db._store_item(self, update_only="progress")
 
+    def store_worker_progress(self, worker: str, counts: Mapping[str, Any]):
+        """
+        Store the counters of one worker, see `ThroughputCounter`
+        """
+        self._data.setdefault("worker_progress", {})[worker] = dict(counts)
+        self.db._store_worker_progress(self, worker, counts)
+
+    def throughput(self) -> dict:
+        """
+        Aggregated progress of all workers, see `summarize_throughput`
+        """
+        return summarize_throughput(self._data)
+
     def store_event(
             self,
             type: str,
@@ -165,6 +236,12 @@ class ProcessItem:
             skipped=skipped,
         )
 
+    def flush(self):
+        """
+        Write all buffered objects, events and updates of the database
+        """
+        self.db.flush()
+
     def kill(self):
         if self.pid:
             try:
@@ -177,10 +254,21 @@ class ProcessItem:
 
 
 class ProcessDb(DatabaseMixin):
+    """
+    Database access for processes.
 
-    def __init__(self):
+    If `buffered` is True, objects, events and updates of process items
+    are written in bulk by a `BulkWriter`. Call `flush` to write them immediately.
+    """
+    def __init__(self, buffered: bool = False):
         super().__init__()
         self.log = logger.Logger("process-db")
+        self.writer: Optional[BulkWriter] = BulkWriter(self.database) if buffered else None
+        # process uuid -> set of counted (source/target, module uuid, filename),
+        #   saves the database requests for files that are already counted
+        self._counted_files: Dict[str, Set[Tuple[str, str, str]]] = {}
+
+        self.collection().create_index("status")
 
         coll = self.collection_events()
         coll.create_index("process_uuid")
@@ -200,6 +288,18 @@ class ProcessDb(DatabaseMixin):
             pymongo.IndexModel("target_filename"),
         ])
 
+        self.collection_counted_files().create_index(
+            [
+                ("process_uuid", pymongo.ASCENDING),
+                ("key", pymongo.ASCENDING),
+                ("module", pymongo.ASCENDING),
+                ("filename", pymongo.ASCENDING),
+            ],
+            unique=True,
+        )
+
+        WorkQueue.create_indexes(self.collection_work_items())
+
         coll = self.analysis_results()
         coll.create_indexes([
             pymongo.IndexModel("process_uuid"),
@@ -209,6 +309,10 @@ class ProcessDb(DatabaseMixin):
             pymongo.IndexModel("run_index"),
         ])
 
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
+
     def collection(self) -> Collection:
         return self.database()["process"]
 
@@ -218,23 +322,51 @@ class ProcessDb(DatabaseMixin):
     def collection_objects(self) -> Collection:
         return self.database()["process_objects"]
 
+    def collection_counted_files(self) -> Collection:
+        return self.database()["process_counted_files"]
+
     def analysis_results(self) -> Collection:
         return self.database()["analysis_results"]
 
+    def collection_work_items(self) -> Collection:
+        return self.database()["process_work_items"]
+
+    def work_queue(self) -> WorkQueue:
+        return WorkQueue(self.collection_work_items())
+
     def request_process(
             self,
             name: str,
             kwargs: Optional[Mapping[str, Any]] = None,
             source_uuid: Optional[str] = None,
+            priority: Optional[int] = None,
+            resources: Optional[ProcessResources] = None,
     ) -> ProcessItem:
+        """
+        Request a process to be run by the `ProcessScheduler`.
+
+        If `priority` or `resources` are not given, they are taken from the
+        registered process class (`ProcessBase.priority`, `ProcessBase.get_resources`).
+        """
+        from .base import registered_processes
+        process_class = registered_processes.get(name)
+        kwargs = kwargs or {}
+        if priority is None:
+            priority = process_class.priority if process_class else ProcessPriority.NORMAL
+        if resources is None and process_class:
+            resources = process_class.get_resources(kwargs)
+
         item = ProcessItem(
             db=self,
             name=name,
             uuid=f"p-{uuid.uuid4()}",
-            kwargs=kwargs or {},
+            kwargs=kwargs,
             source_uuid=source_uuid,
+            priority=priority,
+            resources=resources,
         )
         self._store_item(item)
+        notify_scheduler()
         return item
 
     def get_process(self, uuid: str) -> Optional[ProcessItem]:
@@ -244,7 +376,11 @@ class ProcessDb(DatabaseMixin):
 
     def get_objects_count(self, process_uuid: str) -> dict:
         """
-        Returns processed object counts
+        Returns processed object counts.
+
+        The counts are maintained in the process document while objects are stored.
+        They are aggregated from the objects for processes that were created
+        before the counters existed.
 
         :param process_uuid: str, ID of running or finished process
         :return: dict
@@ -257,6 +393,13 @@ class ProcessDb(DatabaseMixin):
                 }
             }
         """
+        data = self.collection().find_one({"uuid": process_uuid}, projection=["object_count"])
+        if data and data.get("object_count") is not None:
+            return {
+                "source": data["object_count"].get("source") or {},
+                "target": data["object_count"].get("target") or {},
+            }
+
         coll = self.collection_objects()
 
         def _get_file_count(source: bool):
@@ -299,12 +442,24 @@ class ProcessDb(DatabaseMixin):
                     for key, value in new_data.items()
                     if key in update_only
                 }
-            coll.update_one(
-                {"uuid": item.uuid},
-                {"$set": new_data},
-            )
+            if self.writer is not None:
+                self.writer.update(coll.name, {"uuid": item.uuid}, new_data)
+            else:
+                coll.update_one(
+                    {"uuid": item.uuid},
+                    {"$set": new_data},
+                )
+
+    def _store_worker_progress(self, item: ProcessItem, worker: str, counts: Mapping[str, Any]):
+        new_data = {f"worker_progress.{worker}": dict(counts)}
+        if self.writer is not None:
+            self.writer.update(self.collection().name, {"uuid": item.uuid}, new_data)
+        else:
+            self.collection().update_one({"uuid": item.uuid}, {"$set": new_data})
 
     def _read_item(self, item: ProcessItem) -> bool:
+        # pending updates first
+        self.flush()
         coll = self.collection()
         data = coll.find_one({"uuid": item.uuid})
         if not data:
@@ -320,8 +475,7 @@ class ProcessDb(DatabaseMixin):
             data: Optional[Mapping[str, Any]] = None,
     ):
         # self.log.debug(f"store_event({item}, {repr(type)}, {repr(text)}, {repr(data)}")
-        coll = self.collection_events()
-        coll.insert_one({
+        self._insert(self.collection_events(), {
             "uuid": f"e-{uuid.uuid4()}",
             "process_uuid": item.uuid,
             "source_uuid": item.source_uuid,
@@ -337,8 +491,7 @@ class ProcessDb(DatabaseMixin):
             data: Mapping[str, Any],
             skipped: bool,
     ):
-        coll = self.collection_objects()
-        coll.insert_one({
+        document = {
             "uuid": f"o-{uuid.uuid4()}",
             "process_uuid": item.uuid,
             "source_uuid": item.source_uuid,
@@ -350,4 +503,75 @@ class ProcessDb(DatabaseMixin):
             "target_module": data["actions"][-1]["module"]["uuid"],
             "skipped": skipped,
             "data": data,
-        })
+        }
+        self._insert(self.collection_objects(), document)
+        self._count_object(item, document)
+
+    def _count_object(self, item: ProcessItem, document: dict):
+        """
+        Increment the number of distinct source and target files per module.
+
+        A marker document is upserted for each counted file and the counter
+        is only incremented if the marker is new. Work items that are retried
+        or claimed by another worker are therefore not counted twice.
+        With a `BulkWriter`, markers and increments are written with the next flush.
+        """
+        counted = self._counted_files.setdefault(item.uuid, set())
+        file_keys = []
+        for key in ("source", "target"):
+            file_key = (key, str(document[f"{key}_module"]), document[f"{key}_filename"])
+            if file_key not in counted:
+                counted.add(file_key)
+                file_keys.append(file_key)
+
+        if self.writer is not None:
+            for key, module_uuid, filename in file_keys:
+                self.writer.increment_once(
+                    self.collection_counted_files().name,
+                    {"process_uuid": item.uuid, "key": key, "module": module_uuid, "filename": filename},
+                    self.collection().name,
+                    {"uuid": item.uuid},
+                    {f"object_count.{key}.{module_uuid}": 1},
+                )
+            return
+
+        increments = {}
+        for key, module_uuid, filename in self._insert_counted_files(item, file_keys):
+            name = f"object_count.{key}.{module_uuid}"
+            increments[name] = increments.get(name, 0) + 1
+
+        if increments:
+            self.collection().update_one({"uuid": item.uuid}, {"$inc": increments})
+
+    def _insert_counted_files(
+            self,
+            item: ProcessItem,
+            file_keys: Sequence[Tuple[str, str, str]],
+    ) -> List[Tuple[str, str, str]]:
+        """
+        Upsert the markers of the files and return the file keys
+        whose markers did not exist before
+        """
+        if not file_keys:
+            return []
+
+        requests = []
+        for key, module_uuid, filename in file_keys:
+            requests.append(pymongo.UpdateOne(
+                {"process_uuid": item.uuid, "key": key, "module": module_uuid, "filename": filename},
+                {"$setOnInsert": {"timestamp": datetime.datetime.utcnow().isoformat()}},
+                upsert=True,
+            ))
+        try:
+            upserted = self.collection_counted_files().bulk_write(requests, ordered=False).upserted_ids
+        except pymongo.errors.BulkWriteError as e:
+            # markers that have been inserted concurrently by another worker
+            upserted = {u["index"]: u["_id"] for u in e.details.get("upserted", [])}
+
+        return [file_keys[index] for index in sorted(upserted)]
+
+    def _insert(self, coll: Collection, document: dict):
+        if self.writer is not None:
+            self.writer.insert(coll.name, document)
+        else:
+            coll.insert_one(document)
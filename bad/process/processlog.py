@@ -0,0 +1,132 @@
+import collections
+import logging
+import logging.handlers
+import os
+import threading
+from pathlib import Path
+from typing import Deque, Dict, IO, List, Optional, Tuple, Union
+
+from bad import config
+
+
+def process_log_filename(uuid: str) -> Path:
+    return config.LOG_PATH / f"{uuid}.log"
+
+
+class ProcessLog:
+    """
+    Captures the output of a process line by line.
+
+    All lines are written to a rotating log file,
+    the last `tail_lines` lines of each stream are kept in memory.
+    """
+
+    # maximum length of a line in the in-memory tail
+    max_tail_line_length = 1000
+
+    def __init__(
+            self,
+            filename: Union[str, Path],
+            max_bytes: Optional[int] = None,
+            backup_count: Optional[int] = None,
+            tail_lines: int = 100,
+    ):
+        self.filename = Path(filename)
+        os.makedirs(self.filename.parent, exist_ok=True)
+        self._handler = logging.handlers.RotatingFileHandler(
+            self.filename,
+            maxBytes=config.LOG_MAX_BYTES if max_bytes is None else max_bytes,
+            backupCount=config.LOG_BACKUP_COUNT if backup_count is None else backup_count,
+            encoding="utf-8",
+        )
+        self._tails: Dict[str, Deque[str]] = collections.defaultdict(
+            lambda: collections.deque(maxlen=tail_lines)
+        )
+        self._threads: List[threading.Thread] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write_line(self, line: str, stream: str = "stdout"):
+        line = line.rstrip("\r\n")
+        # handle() holds the handler's lock, the lines of stdout and stderr are written from two threads
+        self._handler.handle(logging.makeLogRecord({"msg": line}))
+        if len(line) > self.max_tail_line_length:
+            line = line[:self.max_tail_line_length] + " ..."
+        self._tails[stream].append(line)
+
+    def tail(self, stream: str = "stdout") -> str:
+        return "\n".join(self._tails[stream])
+
+    def capture(self, fp: IO[bytes], stream: str = "stdout"):
+        """
+        Read lines from the binary stream in a background thread until it closes
+        """
+        thread = threading.Thread(target=self._read_stream, args=(fp, stream), daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def join(self, timeout: Optional[float] = None):
+        """
+        Wait for the captured streams to close
+        """
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = [t for t in self._threads if t.is_alive()]
+
+    def close(self):
+        self._handler.close()
+
+    def _read_stream(self, fp: IO[bytes], stream: str):
+        for line in iter(fp.readline, b""):
+            self.write_line(line.decode(errors="ignore"), stream)
+
+
+def read_log(
+        filename: Union[str, Path],
+        offset: int = 0,
+        max_bytes: int = 1 << 20,
+) -> Tuple[List[str], int]:
+    """
+    Read the complete lines of a log file, starting at `offset`.
+
+    If the file has been rotated since the last read
+    (it is smaller than `offset`), it is read from the start.
+
+    A negative `offset` reads (about) the last `-offset` bytes.
+
+    :return: tuple of list of lines and the offset for the next call
+    """
+    try:
+        size = os.path.getsize(filename)
+    except OSError:
+        return [], max(0, offset)
+
+    if offset < 0:
+        offset = max(0, size + offset)
+        skip_partial = offset > 0
+    else:
+        skip_partial = False
+        if offset > size:
+            offset = 0
+
+    with open(filename, "rb") as fp:
+        fp.seek(offset)
+        data = fp.read(max_bytes)
+
+    if skip_partial:
+        # start at a line boundary
+        idx = data.find(b"\n")
+        if idx < 0:
+            return [], offset
+        data = data[idx + 1:]
+        offset += idx + 1
+
+    idx = data.rfind(b"\n")
+    if idx < 0:
+        return [], offset
+    data = data[:idx + 1]
+    return data.decode(errors="ignore").splitlines(), offset + len(data)
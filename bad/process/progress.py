@@ -0,0 +1,129 @@
+import time
+from typing import Any, Mapping, Optional
+
+
+class ThroughputCounter:
+    """
+    Cumulative counters of one worker of a process.
+
+    The counters are published to the process item at most
+    every `publish_interval` seconds (and on `publish`).
+    `finish` publishes that the worker is idle until the next `update`.
+    """
+
+    publish_interval = 2.
+
+    def __init__(self, process_item: "ProcessItem", worker: str = "0"):
+        self.process_item = process_item
+        # the worker is used as a database key
+        self.worker = str(worker).replace(".", "_")
+        self.started = time.time()
+        self.counts = {
+            "sources": 0,
+            "skipped_sources": 0,
+            "skipped": 0,
+            "targets": 0,
+            "bytes": 0,
+        }
+        self.finished = False
+        self._last_publish_time: Optional[float] = None
+
+    def update(self, **counts: int):
+        """
+        Set the current value of some counters and publish them if it's time
+        """
+        self.counts.update(counts)
+        self.finished = False
+        cur_time = time.time()
+        if self._last_publish_time is None or cur_time - self._last_publish_time >= self.publish_interval:
+            self.publish(cur_time)
+
+    def publish(self, cur_time: Optional[float] = None):
+        cur_time = time.time() if cur_time is None else cur_time
+        self._last_publish_time = cur_time
+        self.process_item.store_worker_progress(self.worker, {
+            **self.counts,
+            "started": self.started,
+            "updated": cur_time,
+            "finished": self.finished,
+        })
+
+    def finish(self):
+        """
+        Publish the counters of a worker that has no more sources to process
+        """
+        self.finished = True
+        self.publish()
+
+
+def summarize_throughput(process_data: Mapping[str, Any]) -> dict:
+    """
+    Aggregate the worker counters of a process document
+    (see `ThroughputCounter`) into totals, rates and an ETA.
+
+    The rates only include the workers that are not finished (unless all are)
+    and the sources per second only the sources that have not been skipped,
+    which are much faster than the remaining ones.
+
+    :return: dict
+        {
+            "sources_total": int or None,
+            "sources_done": int, including the skipped sources,
+            "skipped_sources": int,
+            "skipped": int,
+            "targets": int,
+            "bytes": int,
+            "sources_per_second": float,
+            "objects_per_second": float,
+            "bytes_per_second": float,
+            "elapsed": float, seconds since the first worker started,
+            "eta": float or None, estimated seconds until all sources are done,
+        }
+    """
+    workers = (process_data.get("worker_progress") or {}).values()
+    total = process_data.get("source_object_count")
+    summary = {
+        "sources_total": sum(total.values()) if total else None,
+        "sources_done": 0,
+        "skipped_sources": 0,
+        "skipped": 0,
+        "targets": 0,
+        "bytes": 0,
+        "sources_per_second": 0.,
+        "objects_per_second": 0.,
+        "bytes_per_second": 0.,
+        "elapsed": 0.,
+        "eta": None,
+    }
+    if not workers:
+        return summary
+
+    for worker in workers:
+        summary["sources_done"] += worker["sources"]
+        summary["skipped_sources"] += worker.get("skipped_sources", 0)
+        summary["skipped"] += worker["skipped"]
+        summary["targets"] += worker["targets"]
+        summary["bytes"] += worker["bytes"]
+
+    active_workers = [w for w in workers if not w.get("finished")] or workers
+    for worker in active_workers:
+        # workers run in parallel, so their rates add up
+        duration = worker["updated"] - worker["started"]
+        if duration > 0:
+            processed = worker["sources"] - worker.get("skipped_sources", 0)
+            summary["sources_per_second"] += processed / duration
+            summary["objects_per_second"] += worker["targets"] / duration
+            summary["bytes_per_second"] += worker["bytes"] / duration
+
+    started = min(w["started"] for w in workers)
+    updated = max(w["updated"] for w in workers)
+    summary["elapsed"] = updated - started
+
+    if summary["sources_total"] is not None:
+        remaining = max(0, summary["sources_total"] - summary["sources_done"])
+        if not remaining:
+            summary["eta"] = 0.
+        elif summary["sources_per_second"] > 0:
+            summary["eta"] = remaining / summary["sources_per_second"]
+
+    return summary
@@ -1,5 +1,5 @@
 import time
-from typing import Optional
+from typing import Optional, Union
 
 import sys
 import os
@@ -12,12 +12,17 @@ from bad.process import (
     registered_processes, ProcessStatus, EventType,
     ProcessItem, ProcessDb, Progress
 )
+from .processlog import ProcessLog, process_log_filename
+from .runtime import ForkserverProcess, forkserver_available
 
 
 class ProcessRunner:
     """
     Runs a registered ProcessBase inside a subprocess.
 
+    With `config.PROCESS_RUNTIME == "forkserver"` the process file is run in a process
+    forked from a warm python runtime, otherwise in a new python interpreter.
+
     A `ProcessItem` must be created by `ProcessDb.request_process` before.
     Status and events of the db process are updated accordingly.
     """
@@ -30,7 +35,7 @@ class ProcessRunner:
             raise ValueError(f"process '{self.name}' is not registered")
         self.log = logger.Logger(f"runner/{self.name}/{self.uuid}")
         self.db = ProcessDb()
-        self.process: Optional[subprocess.Popen] = None
+        self.process: Optional[Union[subprocess.Popen, ForkserverProcess]] = None
         self._kill = False
 
     def process_item(self) -> ProcessItem:
@@ -38,6 +43,10 @@ class ProcessRunner:
         assert item, f"ProcessRunner called for non-existing process {self.name}/{self.uuid}"
         return item
 
+    @classmethod
+    def use_forkserver(cls) -> bool:
+        return config.PROCESS_RUNTIME == "forkserver" and forkserver_available()
+
     def kill(self):
         """
         Kills a running process
@@ -57,25 +66,43 @@ class ProcessRunner:
         args = [sys.executable, python_file, self.uuid]
         item = self.process_item()
 
-        output, output_err = "", ""
+        log = ProcessLog(process_log_filename(self.uuid))
         start_time = time.time()
+
+        def _output_data(**kwargs) -> dict:
+            # only a tail of the output goes into the events, the complete output is in the log file
+            return {
+                **kwargs,
+                "stdout": log.tail("stdout"),
+                "stderr": log.tail("stderr"),
+                "log_filename": str(log.filename),
+                "runtime": time.time() - start_time,
+            }
+
         try:
             self.log.info("calling subprocess", args)
             # item.store_event(EventType.INFO, "calling subprocess")
 
-            self.process = subprocess.Popen(
-                args, cwd=root_path,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                env={
-                    "PYTHONPATH": config.BASE_PATH,
-                    # push the current config to the process
-                    **{
-                        f"BAD_{key}": value
-                        for key, value in config.to_dict(string_values=True).items()
-                    },
-                }
-            )
+            env = {
+                "PYTHONPATH": config.BASE_PATH,
+                # push the current config to the process
+                **{
+                    f"BAD_{key}": value
+                    for key, value in config.to_dict(string_values=True).items()
+                },
+            }
+            if self.use_forkserver():
+                # python is already running with all heavy modules imported
+                self.process = ForkserverProcess(args[1:], cwd=root_path, env=env)
+            else:
+                self.process = subprocess.Popen(
+                    args, cwd=root_path,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    env=env,
+                )
+            log.capture(self.process.stdout, "stdout")
+            log.capture(self.process.stderr, "stderr")
             item.store_status(ProcessStatus.STARTED, pid=self.process.pid)
             item.store_event(EventType.STARTED)
 
@@ -85,20 +112,14 @@ class ProcessRunner:
                     self.process.wait()
                     break
 
-                if self.process.poll() is not None:  # it's finished
-                    break
-
                 try:
-                    output_, output_err_ = self.process.communicate(timeout=1)
-                    output += output_.decode(errors="ignore")
-                    output_err += output_err_.decode(errors="ignore")
-
+                    self.process.wait(timeout=.5)
+                    break
                 except subprocess.TimeoutExpired:  # keep on running
                     pass
 
-                except ValueError:  # buffer has gone away
-                    break
-
+            # read the remaining output
+            log.join(timeout=5)
             run_time = time.time() - start_time
 
             item.store_progress(Progress())
@@ -106,43 +127,27 @@ class ProcessRunner:
             if self._kill:
                 self.log.info(f"subprocess killed after {run_time} seconds")
                 item.store_status(ProcessStatus.KILLED)
-                item.store_event(EventType.KILLED, data={
-                    "stdout": output,
-                    "stderr": output_err,
-                    "runtime": run_time
-                })
+                item.store_event(EventType.KILLED, data=_output_data())
             elif self.process.returncode == 0:
                 self.log.info(f"subprocess finished after {run_time} seconds")
                 item.store_status(ProcessStatus.FINISHED)
-                item.store_event(EventType.FINISHED, data={
-                    "stdout": output,
-                    "stderr": output_err,
-                    "runtime": run_time
-                })
+                item.store_event(EventType.FINISHED, data=_output_data())
             elif self.process.returncode in (-9, -15, 247):
                 self.log.info(f"subprocess KILLED after {run_time} seconds")
                 item.store_status(ProcessStatus.KILLED)
-                item.store_event(EventType.KILLED, data={
-                    "stdout": output,
-                    "stderr": output_err,
-                    "runtime": run_time
-                })
+                item.store_event(EventType.KILLED, data=_output_data())
             else:
                 self.log.info(f"subprocess FAILED after {run_time} seconds")
                 item.store_status(ProcessStatus.FAILED)
-                item.store_event(EventType.FAILED, data={
-                    "return_code": self.process.returncode,
-                    "stdout": output,
-                    "stderr": output_err,
-                    "runtime": run_time
-                })
+                item.store_event(EventType.FAILED, data=_output_data(
+                    return_code=self.process.returncode,
+                ))
 
         except Exception as e:
             run_time = time.time() - start_time
             self.log.error(f"subprocess failed after {run_time} seconds: {type(e).__name__}: {e}")
             item.store_status(ProcessStatus.FAILED)
-            item.store_exception_event(e, data={
-                "stdout": output,
-                "stderr": output_err,
-                "runtime": run_time,
-            })
+            item.store_exception_event(e, data=_output_data())
+
+        finally:
+            log.close()
@@ -0,0 +1,158 @@
+import multiprocessing
+import os
+import runpy
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from typing import IO, List, Optional, Union
+
+from bad import config
+
+
+# modules that are imported once by the forkserver instead of by each process
+PRELOAD_MODULES = [
+    "numpy",
+    "scipy",
+    "pandas",
+    "sklearn",
+    "nibabel",
+    "nilearn",
+    "pymongo",
+    "bad.modules",
+    "bad.process",
+]
+
+_context: Optional[multiprocessing.context.BaseContext] = None
+_context_lock = threading.Lock()
+
+
+def forkserver_available() -> bool:
+    return "forkserver" in multiprocessing.get_all_start_methods()
+
+
+def get_forkserver_context(preload: Optional[List[str]] = None) -> multiprocessing.context.BaseContext:
+    """
+    Return the multiprocessing forkserver context of this process.
+
+    The forkserver is started with the first process and preloads
+    `PRELOAD_MODULES`, the modules of all registered processes and `preload`.
+    """
+    global _context
+    with _context_lock:
+        if _context is None:
+            from bad.process import registered_processes
+            modules = PRELOAD_MODULES + [
+                process_class.__module__
+                for process_class in registered_processes.values()
+                if process_class.__module__ != "__main__"
+            ] + list(preload or [])
+
+            _context = multiprocessing.get_context("forkserver")
+            _context.set_forkserver_preload(list(dict.fromkeys(modules)))
+
+        return _context
+
+
+class ForkserverProcess:
+    """
+    Runs a python file as `__main__` in a process forked from the warm forkserver.
+
+    Supports the parts of `subprocess.Popen` that the `ProcessRunner` uses:
+    `pid`, `returncode`, `stdout`, `stderr`, `poll`, `wait`, `terminate` and `kill`.
+    """
+    def __init__(
+            self,
+            args: List[Union[str, Path]],
+            cwd: Optional[Union[str, Path]] = None,
+            env: Optional[dict] = None,
+    ):
+        self.args = [str(a) for a in args]
+        ctx = get_forkserver_context()
+
+        stdout_read, stdout_write = ctx.Pipe(duplex=False)
+        stderr_read, stderr_write = ctx.Pipe(duplex=False)
+
+        self._process = ctx.Process(
+            target=_run_file,
+            kwargs=dict(
+                args=self.args,
+                cwd=str(cwd) if cwd is not None else None,
+                env=env,
+                config_values=config.to_dict(),
+                stdout=stdout_write,
+                stderr=stderr_write,
+            ),
+            name=f"bad-{Path(self.args[0]).stem}",
+        )
+        self._process.start()
+        stdout_write.close()
+        stderr_write.close()
+
+        self.stdout: IO[bytes] = _to_file(stdout_read)
+        self.stderr: IO[bytes] = _to_file(stderr_read)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.args}, pid={self.pid})"
+
+    @property
+    def pid(self) -> int:
+        return self._process.pid
+
+    @property
+    def returncode(self) -> Optional[int]:
+        return self._process.exitcode
+
+    def poll(self) -> Optional[int]:
+        return self._process.exitcode
+
+    def wait(self, timeout: Optional[float] = None) -> int:
+        self._process.join(timeout)
+        if self._process.exitcode is None:
+            raise subprocess.TimeoutExpired(self.args, timeout)
+        return self._process.exitcode
+
+    def terminate(self):
+        self._process.terminate()
+
+    def kill(self):
+        self._process.kill()
+
+
+def _to_file(connection) -> IO[bytes]:
+    fp = os.fdopen(os.dup(connection.fileno()), "rb")
+    connection.close()
+    return fp
+
+
+def _run_file(
+        args: List[str],
+        cwd: Optional[str],
+        env: Optional[dict],
+        config_values: dict,
+        stdout,
+        stderr,
+):
+    """
+    Executed in the forked process, like `python <args>` would.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    os.dup2(stdout.fileno(), 1)
+    os.dup2(stderr.fileno(), 2)
+    stdout.close()
+    stderr.close()
+
+    if env:
+        os.environ.update({key: str(value) for key, value in env.items()})
+        if env.get("PYTHONPATH") and str(env["PYTHONPATH"]) not in sys.path:
+            sys.path.insert(0, str(env["PYTHONPATH"]))
+    if cwd:
+        os.chdir(cwd)
+
+    # the forkserver might have been started with another config
+    for key, value in config_values.items():
+        setattr(config, key, value)
+
+    sys.argv = list(args)
+    runpy.run_path(args[0], run_name="__main__")
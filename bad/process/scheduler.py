@@ -1,50 +1,204 @@
-import time
-from typing import Optional
+import threading
+from typing import Optional, Dict, Iterable, List, Container
 
-from bad import logger
-from bad.process import ProcessDb, ProcessStatus, ProcessRunner
+from bad import config, logger
+from bad.process import ProcessDb, ProcessStatus, ProcessRunner, ProcessPriority, ProcessResources
+from .notify import SchedulerWakeup
+
+
+class ResourceSlots:
+    """
+    Bookkeeping of the CPU and memory slots of concurrently running processes
+    """
+    def __init__(self, cpus: int, memory: float = 0.):
+        self.cpus = max(1, cpus)
+        self.memory = memory
+        self.used_cpus = 0
+        self.used_memory = 0.
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}("
+            f"cpus={self.used_cpus}/{self.cpus}, memory={self.used_memory}/{self.memory})"
+        )
+
+    @property
+    def is_empty(self) -> bool:
+        return self.used_cpus == 0 and self.used_memory == 0
+
+    def fits(self, resources: ProcessResources) -> bool:
+        """
+        Returns True if the resources are available.
+
+        A process that requests more than the total slots is only
+        allowed to run if nothing else is running.
+        """
+        if self.is_empty:
+            return True
+        if self.used_cpus + resources.cpus > self.cpus:
+            return False
+        if self.memory > 0 and self.used_memory + resources.memory > self.memory:
+            return False
+        return True
+
+    def acquire(self, resources: ProcessResources):
+        self.used_cpus += resources.cpus
+        self.used_memory += resources.memory
+
+    def release(self, resources: ProcessResources):
+        self.used_cpus = max(0, self.used_cpus - resources.cpus)
+        self.used_memory = max(0., self.used_memory - resources.memory)
+
+
+def sort_requested(process_data: Iterable[dict]) -> List[dict]:
+    """
+    Sort requested processes by priority (highest first) and creation date
+    """
+    return sorted(
+        process_data,
+        key=lambda p: (-p.get("priority", ProcessPriority.NORMAL), p["date_created"]),
+    )
+
+
+def select_requested(
+        process_data: Iterable[dict],
+        slots: ResourceSlots,
+        exclude_uuids: Container[str] = (),
+) -> List[dict]:
+    """
+    Select the requested processes that can be started now.
+
+    Processes are considered in order of `sort_requested`. Selection stops
+    at the first process that does not fit, so a large process is not
+    starved by smaller ones that were requested later or with lower priority.
+    """
+    selected = []
+    used = ResourceSlots(slots.cpus, slots.memory)
+    used.acquire(ProcessResources(cpus=slots.used_cpus, memory=slots.used_memory))
+
+    for data in sort_requested(process_data):
+        if data["uuid"] in exclude_uuids:
+            continue
+        resources = ProcessResources.from_dict(data.get("resources"))
+        if not used.fits(resources):
+            break
+        used.acquire(resources)
+        selected.append(data)
+
+    return selected
 
 
 class ProcessScheduler:
     """
-    Runs 'forever' and picks and runs requested processes from the database
+    Runs 'forever' and picks and runs requested processes from the database.
+
+    Several processes run concurrently as long as their declared
+    `ProcessResources` fit into `config.SCHEDULER_CPUS` and `config.SCHEDULER_MEMORY`.
+    Processes with higher `ProcessPriority` are started first.
+
+    The scheduler is woken up by `notify_scheduler` when a process is requested
+    and when a running process finishes. The database is polled
+    every `poll_interval` seconds, or every `notified_poll_interval` seconds
+    as a fallback if the wakeup port could be bound.
     """
-    def __init__(self):
+
+    # seconds between looks at the database without notifications
+    poll_interval = 1.
+    # seconds to wait for a notification before looking at the database again
+    notified_poll_interval = 5.
+
+    def __init__(self, cpus: Optional[int] = None, memory: Optional[float] = None):
         self.db = ProcessDb()
         self.log = logger.Logger("scheduler")
+        self.slots = ResourceSlots(
+            cpus=config.SCHEDULER_CPUS if cpus is None else cpus,
+            memory=config.SCHEDULER_MEMORY if memory is None else memory,
+        )
         self._do_stop = False
-        self._runner: Optional[ProcessRunner] = None
+        self._runners: Dict[str, ProcessRunner] = {}
+        self._threads: Dict[str, threading.Thread] = {}
+        self._resources: Dict[str, ProcessResources] = {}
+        self._wakeup: Optional[SchedulerWakeup] = None
 
     def run(self):
-        self.log.info("started")
+        self.log.info("started", self.slots)
         self._do_stop = False
-        while not self._do_stop:
-            requested_procs = list(
-                self.db.collection()
-                .find({"status": ProcessStatus.REQUESTED})
-                .sort("date_created")
-                .limit(1)
-            )
-            if not requested_procs:
-                # self.log.debug("idle..")
-                time.sleep(1)
-                continue
-
-            name, uuid = requested_procs[0]["name"], requested_procs[0]["uuid"]
-            self._run_process(name, uuid)
+        self._wakeup = SchedulerWakeup()
+        poll_interval = self.notified_poll_interval if self._wakeup.is_listening else self.poll_interval
+        try:
+            while not self._do_stop:
+                self._remove_finished()
+                if not self._start_requested():
+                    # self.log.debug("idle..")
+                    self._wakeup.wait(poll_interval)
+        finally:
+            for thread in list(self._threads.values()):
+                thread.join()
+            self._remove_finished()
+            self._wakeup.close()
+            self._wakeup = None
 
     def stop(self):
+        """
+        Stop picking new processes, running processes are finished
+        """
         self._do_stop = True
+        if self._wakeup is not None:
+            self._wakeup.notify()
+
+    def _start_requested(self) -> int:
+        requested_procs = list(
+            self.db.collection()
+            .find(
+                {"status": ProcessStatus.REQUESTED},
+                projection=["name", "uuid", "priority", "resources", "date_created"],
+            )
+        )
+        selected = select_requested(requested_procs, self.slots, exclude_uuids=self._runners)
+        for data in selected:
+            self._run_process(data["name"], data["uuid"], ProcessResources.from_dict(data.get("resources")))
+        return len(selected)
+
+    def _run_process(self, name: str, uuid: str, resources: ProcessResources):
+        self.log.debug("running", name, uuid, resources)
+        try:
+            runner = ProcessRunner(name, uuid)
+        except ValueError as e:
+            self.log.error(f"{type(e).__name__}: {e}")
+            item = self.db.get_process(uuid)
+            if item:
+                item.store_status(ProcessStatus.FAILED)
+                item.store_exception_event(e)
+            return
+
+        self.slots.acquire(resources)
+        self._runners[uuid] = runner
+        self._resources[uuid] = resources
+        self._threads[uuid] = thread = threading.Thread(
+            target=self._run_runner, args=(runner, ), name=f"runner-{uuid}",
+        )
+        thread.start()
+
+    def _run_runner(self, runner: ProcessRunner):
+        try:
+            runner.run()
+        finally:
+            # resources are free again
+            if self._wakeup is not None:
+                self._wakeup.notify()
 
-    def _run_process(self, name: str, uuid: str):
-        self.log.debug("running", name, uuid)
-        self._runner = ProcessRunner(name, uuid)
-        self._runner.run()
-        self._runner = None
+    def _remove_finished(self):
+        for uuid, thread in list(self._threads.items()):
+            if not thread.is_alive():
+                thread.join()
+                self.slots.release(self._resources.pop(uuid))
+                self._threads.pop(uuid)
+                self._runners.pop(uuid)
 
     def kill(self, uuid: str) -> bool:
-        if self._runner and self._runner.uuid == uuid:
-            self._runner.kill()
+        runner = self._runners.get(uuid)
+        if runner:
+            runner.kill()
             return True
         else:
             return False
@@ -0,0 +1,250 @@
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from bad import config, logger
+
+
+PROC_PATH = Path("/proc")
+
+
+def available_memory() -> Optional[int]:
+    """
+    Return the memory (in bytes) that is available for new allocations
+    without swapping, or None if it can not be determined (linux only).
+    """
+    try:
+        with open(PROC_PATH / "meminfo") as fp:
+            for line in fp:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+
+
+def process_tree_rss(pid: int) -> Optional[int]:
+    """
+    Return the resident memory (in bytes) of the process and all its
+    descendants (e.g. a matlab runtime), or None if the process does not exist
+    or it can not be determined (linux only).
+    """
+    rss = _process_rss(pid)
+    if rss is None:
+        return None
+
+    children = _child_pids()
+    pids = children.get(pid, [])
+    while pids:
+        child_pid = pids.pop()
+        rss += _process_rss(child_pid) or 0
+        pids.extend(children.get(child_pid, []))
+
+    return rss
+
+
+def _process_rss(pid: int) -> Optional[int]:
+    try:
+        statm = (PROC_PATH / str(pid) / "statm").read_text().split()
+        return int(statm[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _child_pids() -> Dict[int, List[int]]:
+    children = {}
+    for path in PROC_PATH.iterdir():
+        if not path.name.isdigit():
+            continue
+        try:
+            stat = (path / "stat").read_text()
+            # the process name in parentheses might contain spaces
+            ppid = int(stat[stat.rindex(")") + 2:].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(path.name))
+    return children
+
+
+class ConcurrencyLimit:
+    """
+    Limits the number of pool workers that process source objects at the same time.
+
+    Workers `register` with their index and call `wait_until_active`
+    before each source object. Of all registered workers, those with the
+    lowest indices up to `limit` are active, the others pause. When an active
+    worker is done and calls `unregister`, the next paused worker continues.
+
+    The state is kept in objects of a `multiprocessing.Manager`
+    so the instance can be passed to the sub-processes of a pool.
+    """
+
+    # seconds between checks of a paused worker
+    poll_interval = 1.
+
+    def __init__(self, manager, max_workers: int):
+        self.max_workers = max_workers
+        self._limit = manager.Value("i", max_workers)
+        # worker index -> pid
+        self._workers = manager.dict()
+
+    @property
+    def limit(self) -> int:
+        return self._limit.value
+
+    @limit.setter
+    def limit(self, value: int):
+        self._limit.value = max(1, min(self.max_workers, value))
+
+    def register(self, index: int):
+        self._workers[index] = os.getpid()
+
+    def unregister(self, index: int):
+        self._workers.pop(index, None)
+
+    def worker_pids(self) -> Dict[int, int]:
+        return self._workers.copy()
+
+    def is_active(self, index: int) -> bool:
+        return index in sorted(self._workers.keys())[:self.limit]
+
+    def wait_until_active(self, index: int, is_cancelled: Optional[Callable[[], bool]] = None):
+        paused = False
+        while not self.is_active(index):
+            if is_cancelled is not None and is_cancelled():
+                return
+            if not paused:
+                logger.log.info(f"worker {index} paused by the memory watchdog")
+                paused = True
+            time.sleep(self.poll_interval)
+        if paused:
+            logger.log.info(f"worker {index} continues")
+
+
+class MemoryWatchdog:
+    """
+    Samples the resident memory of the workers of a `ConcurrencyLimit`
+    and the available memory of the host every `interval` seconds
+    and adjusts the number of active workers.
+
+    If less than `min_available` gigabytes are available, one worker less
+    will start new source objects. If, after `scale_up_delay` seconds,
+    enough memory is available for another worker (its peak memory so far),
+    one more worker is activated again, up to the configured maximum.
+
+    Each decision is passed to `on_decision(text, data)`.
+    """
+
+    # seconds to wait after a change before activating another worker
+    scale_up_delay = 60.
+    # seconds to wait after a change before pausing another worker,
+    #   because a paused worker releases its memory only after the current object
+    scale_down_delay = 10.
+
+    def __init__(
+            self,
+            concurrency: ConcurrencyLimit,
+            on_decision: Callable[[str, dict], None],
+            interval: Optional[float] = None,
+            min_available: Optional[float] = None,
+            read_rss: Callable[[int], Optional[int]] = process_tree_rss,
+            read_available: Callable[[], Optional[int]] = available_memory,
+    ):
+        self.concurrency = concurrency
+        self.on_decision = on_decision
+        self.interval = config.WATCHDOG_INTERVAL if interval is None else interval
+        min_available = config.WATCHDOG_MIN_AVAILABLE_MEMORY if min_available is None else min_available
+        self.min_available = int(min_available * 2 ** 30)
+        self.read_rss = read_rss
+        self.read_available = read_available
+        self.log = logger.Logger("memory-watchdog")
+        self.peak_worker_rss = 0
+        self._last_change_time = time.time()
+        self._low_memory = False
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self.interval <= 0 or self.read_available() is None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._mainloop, name="memory-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def check(self) -> Optional[dict]:
+        """
+        Take a sample and adjust the concurrency.
+
+        :return: the decision data or None if nothing changed
+        """
+        worker_rss = {}
+        for index, pid in self.concurrency.worker_pids().items():
+            rss = self.read_rss(pid)
+            if rss is not None:
+                worker_rss[index] = rss
+        available = self.read_available()
+        if not worker_rss or available is None:
+            return None
+
+        self.peak_worker_rss = max(self.peak_worker_rss, *worker_rss.values())
+        limit = self.concurrency.limit
+        # workers above the limit are paused, workers that are done don't count
+        active = min(limit, len(worker_rss))
+        since_change = time.time() - self._last_change_time
+
+        action = None
+        if available < self.min_available:
+            if active > 1:
+                if since_change >= self.scale_down_delay:
+                    action, limit = "scale_down", active - 1
+            elif not self._low_memory:
+                # reported once until enough memory is available again
+                action = "low_memory"
+                self._low_memory = True
+
+        else:
+            self._low_memory = False
+            if (limit < self.concurrency.max_workers
+                    and since_change >= self.scale_up_delay
+                    and available - self.min_available > self.peak_worker_rss):
+                action, limit = "scale_up", limit + 1
+
+        if action is None:
+            return None
+
+        if limit != self.concurrency.limit:
+            self.concurrency.limit = limit
+            self._last_change_time = time.time()
+
+        data = {
+            "action": action,
+            "workers": self.concurrency.limit,
+            "max_workers": self.concurrency.max_workers,
+            "available_memory": available,
+            "min_available_memory": self.min_available,
+            "peak_worker_rss": self.peak_worker_rss,
+            "worker_rss": {str(index): rss for index, rss in sorted(worker_rss.items())},
+        }
+        text = {
+            "scale_down": f"low memory, reducing active workers to {limit}",
+            "scale_up": f"enough memory, increasing active workers to {limit}",
+            "low_memory": "low memory, but only one worker is active",
+        }[action] + f" ({available / 2 ** 30:.1f}GB available)"
+
+        self.log.info(text)
+        self.on_decision(text, data)
+        return data
+
+    def _mainloop(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                self.log.error(f"{type(e).__name__}: {e}")
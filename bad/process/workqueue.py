@@ -0,0 +1,287 @@
+import datetime
+import os
+import socket
+import threading
+import time
+import traceback
+import uuid as uuidlib
+from typing import Any, Callable, Dict, List, Mapping, Optional
+
+import pymongo
+from pymongo.collection import Collection
+
+from bad import config, logger
+
+
+class WorkItemStatus:
+    PENDING = "pending"
+    CLAIMED = "claimed"
+    DONE = "done"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+def default_worker_name() -> str:
+    return f"{socket.gethostname()}/{os.getpid()}"
+
+
+class WorkQueue:
+    """
+    A work queue in a database collection, shared by workers on any number of nodes.
+
+    A worker claims an item with a lease of `lease_seconds`
+    (default `config.WORK_QUEUE_LEASE_SECONDS`) and has to renew
+    the lease with `heartbeat` until it calls `complete` or `fail`.
+    Items with an expired lease (e.g. because the worker node died) are
+    claimed again by other workers. Failed items are retried `max_attempts` times.
+
+    Leases are compared against the clocks of the workers,
+    so the clocks of all nodes need to be synchronized (e.g. via NTP).
+    """
+
+    max_attempts = 3
+
+    def __init__(self, collection: Collection, lease_seconds: Optional[float] = None):
+        self.collection = collection
+        self.lease_seconds = config.WORK_QUEUE_LEASE_SECONDS if lease_seconds is None else lease_seconds
+
+    @classmethod
+    def create_indexes(cls, collection: Collection):
+        collection.create_indexes([
+            pymongo.IndexModel("uuid"),
+            pymongo.IndexModel([("process_uuid", pymongo.ASCENDING), ("status", pymongo.ASCENDING)]),
+            pymongo.IndexModel([("status", pymongo.ASCENDING), ("lease_expires", pymongo.ASCENDING)]),
+        ])
+
+    def publish(self, process_uuid: str, process_name: str, payloads: List[Mapping[str, Any]]) -> List[str]:
+        """
+        Add one work item per payload.
+
+        :return: list of item uuids
+        """
+        now = datetime.datetime.utcnow().isoformat()
+        documents = [
+            {
+                "uuid": f"w-{uuidlib.uuid4()}",
+                "process_uuid": process_uuid,
+                "process_name": process_name,
+                "index": index,
+                "payload": dict(payload),
+                "status": WorkItemStatus.PENDING,
+                "worker": None,
+                "lease_expires": 0.,
+                "attempts": 0,
+                "error": None,
+                "date_created": now,
+            }
+            for index, payload in enumerate(payloads)
+        ]
+        if documents:
+            self.collection.insert_many(documents)
+        return [doc["uuid"] for doc in documents]
+
+    def claim(self, worker: str, process_uuid: Optional[str] = None) -> Optional[dict]:
+        """
+        Claim the next pending item or an item whose lease has expired.
+
+        :return: the work item or None
+        """
+        now = time.time()
+        filter = {
+            "$or": [
+                {"status": WorkItemStatus.PENDING},
+                {"status": WorkItemStatus.CLAIMED, "lease_expires": {"$lt": now}},
+            ],
+        }
+        if process_uuid is not None:
+            filter["process_uuid"] = process_uuid
+
+        return self.collection.find_one_and_update(
+            filter,
+            {
+                "$set": {
+                    "status": WorkItemStatus.CLAIMED,
+                    "worker": worker,
+                    "lease_expires": now + self.lease_seconds,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("date_created", pymongo.ASCENDING), ("index", pymongo.ASCENDING)],
+            return_document=pymongo.ReturnDocument.AFTER,
+        )
+
+    def heartbeat(self, item: Mapping[str, Any], worker: str) -> bool:
+        """
+        Renew the lease of a claimed item.
+
+        :return: False if the lease has been lost (expired and claimed by
+            another worker, or the item was cancelled)
+        """
+        result = self.collection.update_one(
+            {"uuid": item["uuid"], "worker": worker, "status": WorkItemStatus.CLAIMED},
+            {"$set": {"lease_expires": time.time() + self.lease_seconds}},
+        )
+        return result.matched_count > 0
+
+    def complete(self, item: Mapping[str, Any], worker: str) -> bool:
+        result = self.collection.update_one(
+            {"uuid": item["uuid"], "worker": worker, "status": WorkItemStatus.CLAIMED},
+            {"$set": {"status": WorkItemStatus.DONE}},
+        )
+        return result.matched_count > 0
+
+    def fail(self, item: Mapping[str, Any], worker: str, error: str) -> bool:
+        """
+        Release the item for another attempt or mark it as failed
+        after `max_attempts` attempts.
+        """
+        attempts = item.get("attempts") or 1
+        result = self.collection.update_one(
+            {"uuid": item["uuid"], "worker": worker, "status": WorkItemStatus.CLAIMED},
+            {"$set": {
+                "status": WorkItemStatus.FAILED if attempts >= self.max_attempts else WorkItemStatus.PENDING,
+                "worker": None,
+                "lease_expires": 0.,
+                "error": error,
+            }},
+        )
+        return result.matched_count > 0
+
+    def cancel(self, process_uuid: str):
+        """
+        Cancel all unfinished items of a process.
+        Workers notice it with the next `heartbeat`.
+        """
+        self.collection.update_many(
+            {
+                "process_uuid": process_uuid,
+                "status": {"$in": [WorkItemStatus.PENDING, WorkItemStatus.CLAIMED]},
+            },
+            {"$set": {"status": WorkItemStatus.CANCELLED}},
+        )
+
+    def status_counts(self, process_uuid: str) -> Dict[str, int]:
+        counts = {}
+        for item in self.collection.find({"process_uuid": process_uuid}, projection=["status"]):
+            counts[item["status"]] = counts.get(item["status"], 0) + 1
+        return counts
+
+    def failed_items(self, process_uuid: str) -> List[dict]:
+        return list(self.collection.find(
+            {"process_uuid": process_uuid, "status": WorkItemStatus.FAILED},
+            projection={"_id": False},
+        ))
+
+    def is_finished(self, process_uuid: str) -> bool:
+        counts = self.status_counts(process_uuid)
+        return not counts.get(WorkItemStatus.PENDING) and not counts.get(WorkItemStatus.CLAIMED)
+
+
+class WorkQueueWorker:
+    """
+    Claims and runs the items of a `WorkQueue` until stopped.
+
+    The lease of the current item is renewed in a background thread.
+    By default, an item is run by the `run_work_item` method of the registered
+    process class of the item's process. Handlers can call `is_item_cancelled`
+    to stop early when the item has been cancelled or claimed by another worker.
+    """
+
+    # seconds to wait when the queue is empty
+    poll_interval = 2.
+
+    def __init__(
+            self,
+            queue: WorkQueue,
+            name: Optional[str] = None,
+            handler: Optional[Callable[[dict], None]] = None,
+    ):
+        self.queue = queue
+        self.name = name or default_worker_name()
+        self.handler = handler or self._run_process_work_item
+        self.log = logger.Logger(f"work-queue-worker/{self.name}")
+        self._stop_event = threading.Event()
+        # set by the heartbeat when the lease of the current item is lost
+        self._lease_lost: Optional[threading.Event] = None
+        # process uuid -> ProcessBase instance, to reuse prepared modules
+        self._processes: Dict[str, Any] = {}
+
+    def stop(self):
+        self._stop_event.set()
+
+    def is_item_cancelled(self) -> bool:
+        """
+        True if the lease of the currently running item is lost
+        """
+        return self._lease_lost is not None and self._lease_lost.is_set()
+
+    def run(self, until_empty: bool = False) -> int:
+        """
+        Run work items until `stop` is called
+        or, if `until_empty` is True, until the queue is empty.
+
+        :return: number of items run by this worker
+        """
+        self._stop_event.clear()
+        count = 0
+        while not self._stop_event.is_set():
+            item = self.queue.claim(self.name)
+            if item is None:
+                if until_empty:
+                    break
+                self._stop_event.wait(self.poll_interval)
+                continue
+
+            self.run_item(item)
+            count += 1
+
+        return count
+
+    def run_item(self, item: dict) -> bool:
+        """
+        Run a claimed item and renew it's lease while running.
+
+        :return: True if completed
+        """
+        lease_lost = self._lease_lost = threading.Event()
+        finished = threading.Event()
+
+        def _heartbeat():
+            while not finished.wait(self.queue.lease_seconds / 3):
+                if not self.queue.heartbeat(item, self.name):
+                    lease_lost.set()
+                    return
+
+        heartbeat_thread = threading.Thread(target=_heartbeat, name=f"heartbeat-{item['uuid']}", daemon=True)
+        heartbeat_thread.start()
+        try:
+            self.handler(item)
+
+        except Exception as e:
+            self.log.error(f"item {item['uuid']} failed: {type(e).__name__}: {e}")
+            self.queue.fail(item, self.name, f"{type(e).__name__}: {e}\n{traceback.format_exc()}")
+            return False
+
+        finally:
+            finished.set()
+            heartbeat_thread.join()
+
+        if lease_lost.is_set() or not self.queue.complete(item, self.name):
+            self.log.warning(f"lost lease of item {item['uuid']}, it was cancelled or claimed by another worker")
+            return False
+        return True
+
+    def _run_process_work_item(self, item: dict):
+        from bad.process import registered_processes
+
+        process = self._processes.get(item["process_uuid"])
+        if process is None:
+            try:
+                process_class = registered_processes[item["process_name"]]
+            except KeyError:
+                raise ValueError(f"process '{item['process_name']}' is not registered")
+            # keep only the most recent process
+            self._processes = {item["process_uuid"]: process_class(item["process_uuid"])}
+            process = self._processes[item["process_uuid"]]
+
+        process.run_work_item(item["payload"], worker=self.name, is_cancelled=self.is_item_cancelled)
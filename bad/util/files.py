@@ -0,0 +1,96 @@
+import os
+import secrets
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Generator, Union
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+# ioctl request to create a copy-on-write clone of a file (linux, e.g. btrfs, xfs)
+FICLONE = 0x40049409
+
+
+@contextmanager
+def atomic_filename(filename: Union[str, Path]) -> Generator[Path, None, None]:
+    """
+    Yield a temporary filename in the directory of `filename`
+    and move it to `filename` when the block succeeds.
+
+    Readers of `filename` never see a partially written file and an
+    interrupted write leaves the previous file untouched. The temporary file
+    is hidden and keeps the file extension, so the file type can be
+    derived from it (e.g. by nibabel).
+    """
+    filename = Path(filename)
+    temp_filename = filename.with_name(f".{secrets.token_hex(8)}.tmp.{filename.name}")
+    try:
+        yield temp_filename
+        os.replace(temp_filename, filename)
+    finally:
+        # still exists on error or if both names are links to the same file
+        if temp_filename.exists() or temp_filename.is_symlink():
+            temp_filename.unlink()
+
+
+def copy_file(
+        source: Union[str, Path],
+        destination: Union[str, Path],
+        link: bool = False,
+) -> str:
+    """
+    Copy the file without passing its content through python.
+
+    Tries, in this order:
+        - a hardlink (only if `link` is True)
+        - a copy-on-write clone (reflink)
+        - `os.copy_file_range`
+        - `shutil.copyfile` (which uses `sendfile` where available)
+
+    An existing `destination` is replaced.
+
+    :return: str, the method that was used, one of
+        "same", "link", "reflink", "copy_file_range", "copy"
+    """
+    source, destination = Path(source), Path(destination)
+    if destination.exists() and os.path.samefile(source, destination):
+        return "same"
+
+    if destination.exists() or destination.is_symlink():
+        destination.unlink()
+
+    if link:
+        try:
+            os.link(source, destination)
+            return "link"
+        except OSError:
+            pass
+
+    with open(source, "rb") as fsrc, open(destination, "wb") as fdst:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+                return "reflink"
+            except OSError:
+                pass
+
+        if hasattr(os, "copy_file_range"):
+            try:
+                size = os.fstat(fsrc.fileno()).st_size
+                offset = 0
+                while offset < size:
+                    copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - offset, offset, offset)
+                    if not copied:
+                        break
+                    offset += copied
+                if offset == size:
+                    return "copy_file_range"
+            except OSError:
+                pass
+
+    shutil.copyfile(source, destination)
+    return "copy"
@@ -1,10 +1,19 @@
-from typing import Optional, Tuple, Sequence, Union
+import concurrent.futures
+import contextlib
+import math
+import os
+from pathlib import Path
+from typing import Optional, Tuple, Sequence, Union, List
 
+import nibabel.arrayproxy
 import numpy as np
-from nilearn import image as niimage
-from nibabel.filebasedimages import SerializableImage
+import scipy.ndimage
+import scipy.special
+from nibabel.filebasedimages import SerializableImage, ImageFileError
 import PIL.Image
 
+from .resample import resample_image, resample_images
+
 
 def get_image_slice(nibabel_image, axis: int = 0, offset: Optional[int] = None):
     slice_args = [slice(None) for i in range(nibabel_image.ndim)]
@@ -22,20 +31,49 @@ def np_to_pil(np_array: np.ndarray) -> PIL.Image.Image:
 
 
 def resample_to_shape(img, shape: Tuple[int, int, int], interpolation: str = "continuous"):
-    new_affine = img.affine * np.array([
-        img.shape[-3] / shape[-3],
-        img.shape[-2] / shape[-2],
-        img.shape[-1] / shape[-1],
-        1
-    ])
-    return niimage.resample_img(
+    return resample_image(
         img,
         target_shape=shape,
-        target_affine=new_affine,
+        target_affine=resampled_affine(img.affine, img.shape, shape),
+        interpolation=interpolation,
+    )
+
+
+def resample_images_to_shape(
+        images: Sequence,
+        shape: Tuple[int, int, int],
+        interpolation: str = "continuous",
+) -> List:
+    """
+    Like `resample_to_shape` for images that all share the same shape and affine,
+    resampled in one batch.
+    """
+    if not images:
+        return []
+    return resample_images(
+        images,
+        target_shape=shape,
+        target_affine=resampled_affine(images[0].affine, images[0].shape, shape),
         interpolation=interpolation,
     )
 
 
+def resampled_affine(
+        affine: np.ndarray,
+        source_shape: Sequence[int],
+        shape: Tuple[int, int, int],
+) -> np.ndarray:
+    """
+    The affine of a volume with `source_shape` and `affine` resampled to `shape`
+    """
+    return affine * np.array([
+        source_shape[-3] / shape[-3],
+        source_shape[-2] / shape[-2],
+        source_shape[-1] / shape[-1],
+        1
+    ])
+
+
 def get_volume_slices(
         volume: np.ndarray,
         offsets: Optional[Sequence[Optional[int]]] = None,
@@ -134,8 +172,17 @@ def to_output_dtype(data: np.ndarray, dtype: Union[str, np.dtype]) -> np.ndarray
 
 
 def nibabel_to_numpy_float(src: SerializableImage) -> np.ndarray:
+    """
+    Return the voxel data of `src` as a new float32 array.
+
+    The data is decoded directly to float32 and not cached in `src`,
+    so the caller may modify the array in-place.
+    """
     org_dtype = src.get_data_dtype()
-    data = src.get_fdata()
+    data = src.get_fdata(caching="unchanged", dtype=np.float32)
+    # an image in memory may return its float32 data object or its fdata cache
+    if src.in_memory:
+        data = data.copy()
 
     if org_dtype.name == "int16":
         data /= (2 * 16)
@@ -143,4 +190,205 @@ def nibabel_to_numpy_float(src: SerializableImage) -> np.ndarray:
     elif org_dtype.name == "int8":
         data /= (2 * 8)
 
-    return to_output_dtype(data, "float32")
+    return data
+
+
+def unmodified_image_filename(img: SerializableImage) -> Optional[Path]:
+    """
+    Return the filename of the (single) file that `img` was loaded from,
+    if data, header and affine of `img` are still the same as in the file.
+
+    Returns None if the image was not loaded from a file
+    or if storing it would create a different image.
+    """
+    if set(img.file_map) != {"image"}:
+        return None
+
+    filename = img.file_map["image"].filename
+    if not filename:
+        return None
+
+    # the data must still be read from the file
+    if not isinstance(img.dataobj, nibabel.arrayproxy.ArrayProxy):
+        return None
+    if not isinstance(img.dataobj.file_like, (str, Path)) or str(img.dataobj.file_like) != str(filename):
+        return None
+
+    try:
+        # only reads the header
+        file_img = img.__class__.from_filename(filename)
+    except (OSError, ImageFileError):
+        return None
+
+    if img.header.binaryblock != file_img.header.binaryblock:
+        return None
+    if img.affine is None or not np.array_equal(img.affine, file_img.affine):
+        return None
+
+    return Path(filename)
+
+
+def crop_affine(affine: np.ndarray, slices: Sequence[slice]) -> np.ndarray:
+    """
+    Return the affine of an image that is cropped by `slices`,
+    equivalent to what `nibabel`'s `img.slicer[slices]` does for step-1 slices.
+    """
+    offset = np.array([s.start or 0 for s in slices[:3]], dtype=np.float64)
+    new_affine = np.array(affine, dtype=np.float64)
+    new_affine[:3, 3] = affine[:3, :3] @ offset + affine[:3, 3]
+    return new_affine
+
+
+def foreground_box(mask: np.ndarray, margin: int = 0) -> Optional[Tuple[slice, ...]]:
+    """
+    Return the bounding box of all non-zero voxels of `mask`
+    with `margin` voxels added on each side (clipped to the shape).
+
+    Returns None if there are no non-zero voxels.
+    """
+    slices = []
+    for axis, size in enumerate(mask.shape):
+        other_axes = tuple(a for a in range(mask.ndim) if a != axis)
+        indices = np.flatnonzero(np.any(mask, axis=other_axes))
+        if not indices.size:
+            return None
+        slices.append(slice(
+            max(0, int(indices[0]) - margin),
+            min(size, int(indices[-1]) + 1 + margin),
+        ))
+
+    return tuple(slices)
+
+
+def compact_indices(indices: Sequence[np.ndarray]) -> Tuple[np.ndarray, ...]:
+    """
+    Convert a tuple of coordinate arrays (e.g. from `np.nonzero`)
+    to the smallest unsigned integer type that can hold the coordinates.
+    """
+    max_value = max((int(i.max()) for i in indices if i.size), default=0)
+    dtype = np.min_scalar_type(max_value)
+    return tuple(i.astype(dtype) for i in indices)
+
+
+def find_label_regions(
+        labels: np.ndarray,
+        pad: int = 1,
+        return_indices: bool = False,
+) -> Tuple[np.ndarray, np.ndarray, List[Tuple[slice, ...]]]:
+    """
+    Find the bounding box and voxel count of every label value
+    in a single pass over the label volume.
+
+    :param labels: integer array, e.g. an atlas
+    :param pad: int, number of voxels to add around each box (clipped to the volume),
+        `pad=1` matches `nilearn.image.crop_img(pad=True)`
+    :param return_indices: bool, if True, a fourth list is returned with
+        the flat (C-order) indices of the voxels of each label in ascending order
+    :return: tuple of (sorted label values, voxel counts, box slices)
+    """
+    values, inverse = np.unique(labels, return_inverse=True)
+    inverse = inverse.reshape(labels.shape)
+
+    counts = np.bincount(inverse.reshape(-1), minlength=len(values))
+    boxes = scipy.ndimage.find_objects(inverse + 1, max_label=len(values))
+
+    slices = []
+    for box in boxes:
+        slices.append(tuple(
+            slice(max(0, s.start - pad), min(size, s.stop + pad))
+            for s, size in zip(box, labels.shape)
+        ))
+
+    if return_indices:
+        # a stable sort keeps the voxels of each label in ascending order
+        order = np.argsort(inverse.reshape(-1), kind="stable")
+        indices = np.split(order, np.cumsum(counts)[:-1])
+        return values, counts, slices, indices
+
+    return values, counts, slices
+
+
+def smoothing_kernel(fwhm: float) -> np.ndarray:
+    """
+    1-dimensional smoothing kernel for a full-width-at-half-maximum in voxels.
+
+    Same as SPM's `spm_smoothkern` (used by CAT12), which is a Gaussian integrated
+    over a linear (1st degree B-spline) voxel, truncated at 6 sigma.
+    """
+    # variance of the Gaussian
+    s = (fwhm / math.sqrt(8. * math.log(2.))) ** 2 + np.finfo(np.float64).eps
+    size = int(round(6. * math.sqrt(s)))
+    x = np.arange(-size, size + 1, dtype=np.float64)
+
+    w1 = 1. / math.sqrt(2. * s)
+    w2 = -.5 / s
+    w3 = math.sqrt(s / 2. / math.pi)
+    kernel = (
+        .5 * (
+            scipy.special.erf(w1 * (x + 1)) * (x + 1)
+            + scipy.special.erf(w1 * (x - 1)) * (x - 1)
+            - 2. * scipy.special.erf(w1 * x) * x
+        )
+        + w3 * (np.exp(w2 * (x + 1) ** 2) + np.exp(w2 * (x - 1) ** 2) - 2. * np.exp(w2 * x ** 2))
+    )
+    kernel[kernel < 0] = 0
+    return kernel / kernel.sum()
+
+
+def smooth_volume(
+        data: np.ndarray,
+        fwhm: Sequence[float],
+        num_threads: Optional[int] = None,
+        executor: Optional[concurrent.futures.Executor] = None,
+) -> np.ndarray:
+    """
+    Separable smoothing of the first three axes of `data` in float32.
+
+    Voxels outside the volume are treated as zero, like in SPM.
+
+    :param data: array with at least 3 dimensions
+    :param fwhm: full-width-at-half-maximum in voxels for each of the first three axes
+    :param num_threads: number of threads, defaults to number of CPUs
+    :param executor: optional executor to run the threads in, otherwise
+        a new one is created if more than one thread is used
+    :return: new float32 array
+    """
+    num_threads = max(1, num_threads or os.cpu_count() or 1)
+    source = np.asarray(data, dtype=np.float32)
+    result = None
+
+    with contextlib.ExitStack() as stack:
+        if executor is None and num_threads > 1:
+            executor = stack.enter_context(concurrent.futures.ThreadPoolExecutor(num_threads))
+
+        for axis, axis_fwhm in enumerate(fwhm[:3]):
+            if not axis_fwhm or source.shape[axis] < 2:
+                continue
+            kernel = smoothing_kernel(axis_fwhm).astype(np.float32)
+            output = np.empty(source.shape, dtype=np.float32)
+
+            if num_threads == 1:
+                scipy.ndimage.correlate1d(
+                    source, kernel, axis=axis, output=output, mode="constant", cval=0.,
+                )
+            else:
+                # split into chunks along an axis that is not filtered right now
+                chunk_axis = 1 if axis == 0 else 0
+                bounds = np.linspace(0, source.shape[chunk_axis], min(num_threads, source.shape[chunk_axis]) + 1)
+                futures = []
+                for start, end in zip(bounds[:-1].astype(int), bounds[1:].astype(int)):
+                    index = [slice(None)] * source.ndim
+                    index[chunk_axis] = slice(start, end)
+                    index = tuple(index)
+                    futures.append(executor.submit(
+                        scipy.ndimage.correlate1d,
+                        source[index], kernel, axis=axis, output=output[index], mode="constant", cval=0.,
+                    ))
+                for future in futures:
+                    future.result()
+
+            source = result = output
+
+    if result is None:
+        result = source.copy() if source is data else source
+    return result
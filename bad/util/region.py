@@ -0,0 +1,151 @@
+from typing import Optional, Sequence, Tuple, Iterable
+
+import numpy as np
+from nibabel.filebasedimages import SerializableImage
+
+
+# a box of voxels, one slice (with step 1) per axis
+Region = Tuple[slice, ...]
+
+
+def normalize_region(region: Optional[Sequence[slice]], shape: Sequence[int]) -> Region:
+    """
+    Return the region with explicit start and stop for each axis of `shape`.
+
+    Missing axes (or a `None` region) cover the whole axis.
+    """
+    region = tuple(region or ())
+    if len(region) > len(shape):
+        raise ValueError(f"Region {region} has more axes than shape {shape}")
+
+    normalized = []
+    for axis, size in enumerate(shape):
+        if axis < len(region):
+            start, stop, step = region[axis].indices(size)
+            if step != 1:
+                raise ValueError(f"Region slices must have step 1, got {region[axis]}")
+            normalized.append(slice(start, max(start, stop)))
+        else:
+            normalized.append(slice(0, size))
+
+    return tuple(normalized)
+
+
+def union_region(regions: Iterable[Sequence[slice]], shape: Sequence[int]) -> Optional[Region]:
+    """
+    Return the bounding box of all regions or None if there are no regions
+    """
+    starts, stops = None, None
+    for region in regions:
+        region = normalize_region(region, shape)
+        if starts is None:
+            starts = [s.start for s in region]
+            stops = [s.stop for s in region]
+        else:
+            starts = [min(start, s.start) for start, s in zip(starts, region)]
+            stops = [max(stop, s.stop) for stop, s in zip(stops, region)]
+
+    if starts is None:
+        return None
+    return tuple(slice(start, stop) for start, stop in zip(starts, stops))
+
+
+def is_full_region(region: Optional[Sequence[slice]], shape: Sequence[int]) -> bool:
+    if region is None:
+        return True
+    return normalize_region(region, shape) == normalize_region(None, shape)
+
+
+class RegionArrayProxy:
+    """
+    Array proxy that only reads `region` from the wrapped (nibabel) array proxy.
+
+    It has the shape of the wrapped proxy and all voxels outside
+    of the region are zero. Slicing within the region reads
+    directly from the wrapped proxy.
+    """
+
+    is_proxy = True
+
+    def __init__(self, proxy, region: Sequence[slice]):
+        self._proxy = proxy
+        self.region = normalize_region(region, proxy.shape)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({self.shape}, region={self.region})"
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return tuple(self._proxy.shape)
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self._proxy.dtype
+
+    def __array__(self, dtype=None, copy=None):
+        block = np.asanyarray(self._proxy[self.region])
+        data = np.zeros(self.shape, dtype=block.dtype if dtype is None else dtype)
+        data[self.region] = block
+        return data
+
+    def __getitem__(self, slicer):
+        if self._is_inside_region(slicer):
+            return self._proxy[slicer]
+        return self.__array__()[slicer]
+
+    def _is_inside_region(self, slicer) -> bool:
+        if not isinstance(slicer, tuple):
+            slicer = (slicer, )
+        if len(slicer) > self.ndim:
+            return False
+
+        for axis, size in enumerate(self.shape):
+            region = self.region[axis]
+            if axis >= len(slicer):
+                if region != slice(0, size):
+                    return False
+                continue
+
+            s = slicer[axis]
+            if isinstance(s, (int, np.integer)):
+                index = int(s) + size if s < 0 else int(s)
+                if not region.start <= index < region.stop:
+                    return False
+
+            elif isinstance(s, slice):
+                start, stop, step = s.indices(size)
+                indices = range(start, stop, step)
+                if step <= 0 or not indices:
+                    return False
+                if indices[0] < region.start or indices[-1] >= region.stop:
+                    return False
+
+            else:
+                return False
+
+        return True
+
+
+def restrict_to_region(
+        img: SerializableImage,
+        region: Optional[Sequence[slice]],
+) -> SerializableImage:
+    """
+    Return an image that only reads the voxels of `region` from the
+    data of `img` when accessed. All other voxels are zero.
+
+    Geometry and header stay the same. If `img` is already in memory
+    or the region covers the whole image, `img` is returned unchanged.
+    """
+    if img.in_memory or is_full_region(region, img.shape):
+        return img
+
+    return img.__class__(
+        RegionArrayProxy(img.dataobj, region),
+        affine=img.affine,
+        header=img.header,
+    )
@@ -0,0 +1,412 @@
+import functools
+import warnings
+from typing import Tuple, Sequence, List, Optional, Dict
+
+import numpy as np
+import nibabel
+import scipy.ndimage
+from nilearn import image as niimage
+from nibabel.filebasedimages import SerializableImage
+
+
+INTERPOLATION_ORDERS = {
+    "nearest": 0,
+    "linear": 1,
+    "continuous": 3,
+}
+
+
+class ResamplePlan:
+    """
+    Precomputed mapping from one voxel grid to another.
+
+    Creating the plan does all the work that only depends on the geometry
+    (shapes, affines and interpolation). `apply()` then only gathers and
+    interpolates the voxel data.
+
+    The results match `nilearn.image.resample_img` (with the default
+    `fill_value=0` and `clip=True`) for finite data, apart from
+    rounding differences of exact .5 values in integer outputs.
+
+    For transforms that are a pure per-axis scaling and shift (the common case
+    for `resample_to_shape`), `nearest` and `linear` interpolation is done
+    with precomputed per-axis indices and weights. Other cases use scipy
+    with the precomputed transform or target coordinates.
+    """
+    def __init__(
+            self,
+            source_shape: Sequence[int],
+            source_affine: np.ndarray,
+            target_shape: Sequence[int],
+            target_affine: np.ndarray,
+            interpolation: str = "continuous",
+    ):
+        if interpolation not in INTERPOLATION_ORDERS:
+            raise ValueError(
+                f"interpolation must be one of {', '.join(INTERPOLATION_ORDERS)}, got '{interpolation}'"
+            )
+        self.source_shape = tuple(int(s) for s in source_shape[:3])
+        self.target_shape = tuple(int(s) for s in target_shape[:3])
+        self.interpolation = interpolation
+        self.order = INTERPOLATION_ORDERS[interpolation]
+
+        source_affine = np.asarray(source_affine, dtype=np.float64)
+        target_affine = np.asarray(target_affine, dtype=np.float64)
+        if np.all(source_affine == target_affine):
+            transform = np.eye(4)
+        else:
+            transform = np.linalg.inv(source_affine) @ target_affine
+
+        self.matrix = transform[:3, :3]
+        self.offset = transform[:3, 3]
+        self.separable = bool(np.all(np.diag(np.diag(self.matrix)) == self.matrix))
+
+        # per-axis source coordinates of the target voxels
+        self._axis_coords: List[np.ndarray] = []
+        # per-axis (lower index, upper index, weight, invalid mask)
+        self._axis_gather: List[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]] = []
+        # (3, N) source coordinates of all target voxels
+        self._coords: Optional[np.ndarray] = None
+
+        if self.separable:
+            self._axis_coords = [
+                self.matrix[axis, axis] * np.arange(size, dtype=np.float64) + self.offset[axis]
+                for axis, size in enumerate(self.target_shape)
+            ]
+            if self.order <= 1:
+                self._axis_gather = [
+                    self._gather_axis(coords, size)
+                    for coords, size in zip(self._axis_coords, self.source_shape)
+                ]
+        else:
+            grid = np.indices(self.target_shape, dtype=np.float64).reshape(3, -1)
+            self._coords = self.matrix @ grid + self.offset[:, None]
+
+    def __repr__(self):
+        return (
+            f"{self.__class__.__name__}({self.source_shape} -> {self.target_shape}"
+            f", {self.interpolation}, separable={self.separable})"
+        )
+
+    def output_dtype(self, dtype: np.dtype) -> np.dtype:
+        """
+        The data type of the resampled data, the same way as nilearn chooses it
+        """
+        dtype = np.dtype(dtype)
+        if self.interpolation == "continuous" and dtype.kind == "i":
+            name = dtype.name.replace("int", "float")
+            if name in ("float8", "float16"):
+                name = "float32"
+            dtype = np.dtype(name)
+        return dtype.newbyteorder("=")
+
+    def apply(self, data: np.ndarray) -> np.ndarray:
+        """
+        Resample the array.
+
+        :param data: array with the source shape in the first three axes.
+            Any further axes (e.g. time) are resampled independently.
+        :return: new array with the target shape in the first three axes
+        """
+        self._check_shape(data)
+        return self._to_output(self._resample(data), data)
+
+    def apply_batch(self, datas: Sequence[np.ndarray]) -> List[np.ndarray]:
+        """
+        Resample several arrays of the same shape and dtype.
+
+        For `nearest` and `linear` interpolation of separable transforms,
+        the first two axes are interpolated for each array into a shared buffer
+        and the last axis is interpolated for the whole batch at once.
+        The source arrays themselves are never stacked.
+        Other cases (e.g. `continuous` interpolation) resample each array on its own.
+
+        The results are the same as calling `apply()` for each array.
+        """
+        if not datas:
+            return []
+        for data in datas:
+            self._check_shape(data)
+            if data.shape != datas[0].shape or data.dtype != datas[0].dtype:
+                raise ValueError(
+                    f"Can only batch arrays of same shape and dtype"
+                    f", got {data.shape}/{data.dtype} and {datas[0].shape}/{datas[0].dtype}"
+                )
+        if len(datas) == 1 or not self._axis_gather:
+            return [self.apply(data) for data in datas]
+
+        # batch axis goes first so every array is contiguous in the buffer
+        buffer = np.empty(
+            (len(datas), ) + self.target_shape[:2] + datas[0].shape[2:],
+            dtype=np.float64,
+        )
+        for idx, data in enumerate(datas):
+            for axis, gather in enumerate(self._axis_gather[:2]):
+                data = self._interpolate_axis(data, axis, *gather)
+            buffer[idx] = data
+
+        resampled = self._interpolate_axis(buffer, 3, *self._axis_gather[2])
+
+        return [
+            self._to_output(resampled[idx], data)
+            for idx, data in enumerate(datas)
+        ]
+
+    def _check_shape(self, data: np.ndarray):
+        if tuple(data.shape[:3]) != self.source_shape:
+            raise ValueError(f"Expected source shape {self.source_shape}, got {data.shape[:3]}")
+
+    def _resample(self, data: np.ndarray) -> np.ndarray:
+        if self._axis_gather:
+            return self._apply_gather(data)
+        return self._apply_scipy(data)
+
+    def _to_output(self, resampled: np.ndarray, data: np.ndarray) -> np.ndarray:
+        """
+        Convert the float64 interpolation result to the output dtype
+        and clip it to the range of the source `data`
+        """
+        dtype = self.output_dtype(data.dtype)
+
+        # round and saturate the same way as scipy does when writing to integer arrays
+        if dtype.kind in "iu":
+            info = np.iinfo(dtype)
+            resampled = np.trunc(resampled + np.copysign(.5, resampled))
+            resampled.clip(info.min, info.max, out=resampled)
+        resampled = resampled.astype(dtype, copy=False)
+
+        # nearest and linear values are (weighted averages of) source values or 0
+        #   and never leave the source range
+        if self.order > 1 and data.size:
+            v_min = min(np.nanmin(data), 0)
+            v_max = max(np.nanmax(data), 0)
+            resampled.clip(v_min, v_max, out=resampled)
+
+        return resampled
+
+    def _gather_axis(
+            self,
+            coords: np.ndarray,
+            size: int,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        # like scipy's "constant" mode: no interpolation outside of [0, size - 1]
+        invalid = (coords < 0) | (coords > size - 1)
+        if self.order == 0:
+            lower = np.clip(np.floor(coords + .5), 0, size - 1).astype(np.intp)
+            return lower, lower, np.zeros_like(coords), invalid
+
+        lower = np.clip(np.floor(coords), 0, size - 1).astype(np.intp)
+        upper = np.minimum(lower + 1, size - 1)
+        weight = np.where(invalid, 0., coords - lower)
+        return lower, upper, weight, invalid
+
+    def _apply_gather(self, data: np.ndarray) -> np.ndarray:
+        resampled = data
+        for axis, gather in enumerate(self._axis_gather):
+            resampled = self._interpolate_axis(resampled, axis, *gather)
+        return resampled
+
+    def _interpolate_axis(
+            self,
+            data: np.ndarray,
+            axis: int,
+            lower: np.ndarray,
+            upper: np.ndarray,
+            weight: np.ndarray,
+            invalid: np.ndarray,
+    ) -> np.ndarray:
+        shape = [1] * data.ndim
+        shape[axis] = -1
+        weight = weight.reshape(shape)
+
+        values = np.take(data, lower, axis=axis).astype(np.float64, copy=False)
+        if self.order == 1:
+            values *= 1. - weight
+            values += np.take(data, upper, axis=axis) * weight
+
+        if invalid.any():
+            index = [slice(None)] * values.ndim
+            index[axis] = invalid
+            values[tuple(index)] = 0.
+        return values
+
+    def _apply_scipy(self, data: np.ndarray) -> np.ndarray:
+        extra_shape = data.shape[3:]
+        resampled = np.zeros(self.target_shape + extra_shape, dtype=np.float64)
+        all_voxels = (slice(None), ) * 3
+
+        for index in np.ndindex(*extra_shape):
+            volume = data[all_voxels + index]
+            if self._coords is None:
+                # the diagonal as 1-D matrix selects scipy's faster zoom/shift code,
+                #   scipy always notes that 1-D matrices are interpreted this way since 0.18.0
+                with warnings.catch_warnings():
+                    warnings.filterwarnings(
+                        "ignore",
+                        message="The behavior of affine_transform with a 1-D array",
+                        category=UserWarning,
+                    )
+                    scipy.ndimage.affine_transform(
+                        volume,
+                        np.diag(self.matrix),
+                        offset=self.offset,
+                        output_shape=self.target_shape,
+                        output=resampled[all_voxels + index],
+                        order=self.order,
+                        cval=0,
+                    )
+            else:
+                resampled[all_voxels + index] = scipy.ndimage.map_coordinates(
+                    volume,
+                    self._coords,
+                    output=np.float64,
+                    order=self.order,
+                    cval=0,
+                ).reshape(self.target_shape)
+
+        return resampled
+
+
+@functools.lru_cache(maxsize=32)
+def _get_resample_plan(
+        source_shape: Tuple[int, ...],
+        source_affine: Tuple[float, ...],
+        target_shape: Tuple[int, ...],
+        target_affine: Tuple[float, ...],
+        interpolation: str,
+) -> ResamplePlan:
+    return ResamplePlan(
+        source_shape=source_shape,
+        source_affine=np.array(source_affine).reshape(4, 4),
+        target_shape=target_shape,
+        target_affine=np.array(target_affine).reshape(4, 4),
+        interpolation=interpolation,
+    )
+
+
+def get_resample_plan(
+        source_shape: Sequence[int],
+        source_affine: np.ndarray,
+        target_shape: Sequence[int],
+        target_affine: np.ndarray,
+        interpolation: str = "continuous",
+) -> ResamplePlan:
+    """
+    Return a (cached) `ResamplePlan` for the geometry.
+    """
+    return _get_resample_plan(
+        tuple(int(s) for s in source_shape[:3]),
+        tuple(np.asarray(source_affine, dtype=np.float64).reshape(-1).tolist()),
+        tuple(int(s) for s in target_shape[:3]),
+        tuple(np.asarray(target_affine, dtype=np.float64).reshape(-1).tolist()),
+        interpolation,
+    )
+
+
+def resample_image(
+        img: SerializableImage,
+        target_shape: Sequence[int],
+        target_affine: np.ndarray,
+        interpolation: str = "continuous",
+) -> SerializableImage:
+    """
+    Drop-in replacement for `nilearn.image.resample_img` with a target shape and affine,
+    which reuses the resampling plan for images of the same geometry.
+    """
+    target_shape = tuple(target_shape[:3])
+    if tuple(img.shape[:3]) == target_shape and np.allclose(target_affine, img.affine):
+        return img
+
+    data = resample_array(
+        np.asanyarray(img.dataobj), img.affine,
+        target_shape=target_shape, target_affine=target_affine, interpolation=interpolation,
+    )
+    return niimage.new_img_like(img, data, target_affine)
+
+
+def resample_array(
+        data: np.ndarray,
+        affine: np.ndarray,
+        target_shape: Sequence[int],
+        target_affine: np.ndarray,
+        interpolation: str = "continuous",
+) -> np.ndarray:
+    """
+    Resample the voxel `data` with `affine` to the target grid.
+
+    Returns the same data as `resample_image`, without building the image.
+    """
+    target_shape = tuple(target_shape[:3])
+    if tuple(data.shape[:3]) == target_shape and np.allclose(target_affine, affine):
+        return data
+
+    if data.dtype.kind == "f" and not np.all(np.isfinite(data)):
+        # nilearn knows how to handle NaNs
+        return np.asanyarray(niimage.resample_img(
+            nibabel.Nifti1Image(data, affine),
+            target_shape=target_shape,
+            target_affine=target_affine,
+            interpolation=interpolation,
+        ).dataobj)
+
+    plan = get_resample_plan(data.shape, affine, target_shape, target_affine, interpolation)
+    return plan.apply(data)
+
+
+def image_array(data: np.ndarray) -> np.ndarray:
+    """
+    Convert the data types that `nilearn.image.new_img_like` would convert
+    """
+    if data.dtype == bool:
+        return data.astype(np.uint8)
+    if data.dtype in (np.int64, np.uint64) and data.size:
+        info = np.iinfo(np.int32)
+        if info.min <= np.min(data) and np.max(data) <= info.max:
+            return data.astype(np.int32)
+    return data
+
+
+def resample_images(
+        images: Sequence[SerializableImage],
+        target_shape: Sequence[int],
+        target_affine: np.ndarray,
+        interpolation: str = "continuous",
+) -> List[SerializableImage]:
+    """
+    Like `resample_image` for a list of images that all share
+    the same shape and affine.
+
+    The voxel data of all images with the same data type
+    is resampled in one vectorized batch.
+    """
+    target_shape = tuple(target_shape[:3])
+    if len(images) <= 1 or (
+            tuple(images[0].shape[:3]) == target_shape and np.allclose(target_affine, images[0].affine)
+    ):
+        return [
+            resample_image(img, target_shape, target_affine, interpolation)
+            for img in images
+        ]
+
+    first = images[0]
+    for img in images[1:]:
+        if img.shape != first.shape or not np.all(img.affine == first.affine):
+            raise ValueError("resample_images() requires images of same shape and affine")
+
+    plan = get_resample_plan(first.shape, first.affine, target_shape, target_affine, interpolation)
+
+    results: List[Optional[SerializableImage]] = [None] * len(images)
+    batches: Dict[np.dtype, List[Tuple[int, np.ndarray]]] = {}
+    for idx, img in enumerate(images):
+        data = np.asanyarray(img.dataobj)
+        if data.dtype.kind == "f" and not np.all(np.isfinite(data)):
+            results[idx] = resample_image(img, target_shape, target_affine, interpolation)
+        else:
+            batches.setdefault(data.dtype, []).append((idx, data))
+
+    for batch in batches.values():
+        resampled = plan.apply_batch([data for _, data in batch])
+        for (idx, _), data in zip(batch, resampled):
+            results[idx] = niimage.new_img_like(images[idx], data, target_affine)
+
+    return results
@@ -15,6 +15,8 @@ const AutoTag = ({tag, className, ...props}) => {
                 color = "blue"; break;
             case "finished":
                 color = "green"; break;
+            case "warning":
+                color = "orange"; break;
             case "failed":
             case "exception":
             case "killed":
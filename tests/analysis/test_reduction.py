@@ -69,3 +69,29 @@ class TestReduction(BadTestCase):
                 self.assertEqual((2, 2), validation_attributes.shape)
                 #print(train_attributes)
                 #print(validation_attributes)
+
+    def test_300_process_image_batch(self):
+        images = [self.load_image_object("avg152T1_LR_nifti.nii.gz") for _ in range(3)]
+
+        class MultiOutputModule:
+            calls = 0
+            outputs = 0
+
+            def process_objects(self, objects, stub=False):
+                self.calls += 1
+                for obj in objects:
+                    for i in range(2):
+                        self.outputs += 1
+                        yield obj
+
+        # only the first output of each image is created
+        module = MultiOutputModule()
+        self.assertEqual(images, AnalysisReduction._process_image_batch(module, images))
+        self.assertEqual(3, module.calls)
+        self.assertEqual(3, module.outputs)
+
+        # the whole batch at once
+        module = MultiOutputModule()
+        module.one_output_per_input = True
+        AnalysisReduction._process_image_batch(module, images)
+        self.assertEqual(1, module.calls)
@@ -0,0 +1,215 @@
+"""
+A stand-in for the CAT12 standalone runtime.
+
+`create_cat12_stand_in(path)` creates a fake CAT12 installation
+whose `cat_standalone.sh` runs this file instead of matlab.
+It records each call to `<path>/calls.jsonl` and creates the
+output files of the deface, smooth and segment scripts
+by copying the input files.
+
+The `bad_cat12_worker.m` script of `Cat12Worker` is emulated
+by processing the jobs of the queue directory. The input files
+are read from the batch file of each job.
+
+If the file `<path>/wait` exists, the segment script waits
+after each image until the file `<path>/continue-<index>` exists.
+
+If the file `<path>/fail-<name>` exists, the script fails (like CAT12
+with `ignoreErrors = 0`) at the input file in the directory `<name>`.
+"""
+import json
+import os
+import re
+import shutil
+import sys
+import time
+from pathlib import Path
+from typing import List, Sequence, Tuple
+
+
+CAT12_DIRECTORY_NAME = "CAT12.8.1_r2042_stand_in"
+
+SEGMENT_PREFIXES = ("mwp1", "p0", "wm", "y_")
+
+
+def create_cat12_stand_in(path: Path) -> Path:
+    """
+    Create a fake CAT12 installation in `path`
+    and return the path to use as `config.CAT12_PATH`.
+    """
+    cat12_path = Path(path) / CAT12_DIRECTORY_NAME
+    standalone_path = cat12_path / "standalone"
+    os.makedirs(standalone_path)
+
+    (standalone_path / "cat_standalone_deface.m").write_text("\n".join([
+        "% stand-in",
+        "matlabbatch{1}.spm.tools.cat.tools.deface.data = '<UNDEFINED>';",
+    ]))
+    (standalone_path / "cat_standalone_smooth.m").write_text("\n".join([
+        "% stand-in",
+        "matlabbatch{1}.spm.spatial.smooth.data = '<UNDEFINED>';",
+        "matlabbatch{1}.spm.spatial.smooth.fwhm = '<UNDEFINED>';",
+        "matlabbatch{1}.spm.spatial.smooth.prefix = '<UNDEFINED>';",
+    ]))
+
+    (standalone_path / "cat_standalone_segment.m").write_text("\n".join([
+        "% stand-in",
+        "matlabbatch{1}.spm.tools.cat.estwrite.data = '<UNDEFINED>';",
+        *(
+            f"matlabbatch{{1}}.{name} = 0;"
+            for name in (
+                "spm.tools.cat.estwrite.output.surface",
+                "spm.tools.cat.estwrite.output.BIDS.BIDSno",
+                "spm.tools.cat.estwrite.extopts.registration.vox",
+                "spm.tools.cat.estwrite.extopts.segmentation.LASstr",
+                "spm.tools.cat.estwrite.extopts.segmentation.APP",
+                "spm.tools.cat.estwrite.opts.biasstr",
+                "spm.tools.cat.estwrite.opts.affreg",
+                "spm.tools.cat.estwrite.extopts.segmentation.NCstr",
+                "spm.tools.cat.estwrite.extopts.segmentation.gcutstr",
+                "spm.tools.cat.estwrite.extopts.segmentation.cleanupstr",
+                "spm.tools.cat.estwrite.extopts.segmentation.setCOM",
+                "spm.tools.cat.estwrite.extopts.segmentation.affmod",
+                "spm.tools.cat.estwrite.extopts.segmentation.SLC",
+                "spm.tools.cat.estwrite.output.GM.native",
+                "spm.tools.cat.estwrite.output.GM.warped",
+                "spm.tools.cat.estwrite.output.GM.mod",
+                "spm.tools.cat.estwrite.output.GM.dartel",
+                "spm.tools.cat.estwrite.extopts.admin.print",
+                "spm.tools.cat.estwrite.extopts.admin.ignoreErrors",
+            )
+        ),
+    ]))
+
+    script_filename = standalone_path / "cat_standalone.sh"
+    script_filename.write_text(
+        f"#!/bin/sh\n"
+        f"exec '{sys.executable}' '{Path(__file__).resolve()}' '{cat12_path / 'calls.jsonl'}' \"$@\"\n"
+    )
+    script_filename.chmod(0o755)
+
+    return cat12_path
+
+
+def read_calls(cat12_path: Path) -> List[dict]:
+    filename = Path(cat12_path) / "calls.jsonl"
+    if not filename.exists():
+        return []
+    return [
+        json.loads(line)
+        for line in filename.read_text().splitlines()
+    ]
+
+
+def wait_for_file(filename: Path, timeout: float = 30.):
+    start_time = time.time()
+    while not filename.exists():
+        if time.time() - start_time > timeout:
+            raise TimeoutError(f"Waited for {filename}")
+        time.sleep(.01)
+
+
+def parse_args(args: Sequence[str]) -> Tuple[Path, List[Path]]:
+    script, files = None, []
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg == "-b":
+            script = Path(args.pop(0))
+        elif arg.startswith("-"):
+            args.pop(0)
+        else:
+            files.append(Path(arg))
+    return script, files
+
+
+def parse_batch_files(batch_filename: Path) -> List[Path]:
+    """
+    Return the input files that `cat_standalone.sh` filled into the batch
+    """
+    if not batch_filename.exists():
+        raise FileNotFoundError(f"Batch file {batch_filename} not found")
+
+    match = re.search(r"^\S+ = \{\n(.*?)^};", batch_filename.read_text(), re.MULTILINE | re.DOTALL)
+    if not match:
+        raise ValueError(f"No input files in batch file {batch_filename}")
+    return [Path(line.strip("'")) for line in match.groups()[0].splitlines()]
+
+
+def run_script(cat12_path: Path, script: Path, files: List[Path]):
+    if not script.exists():
+        raise FileNotFoundError(f"Batch file {script} not found")
+
+    with open(cat12_path / "calls.jsonl", "a") as fp:
+        fp.write(json.dumps({
+            "script": script.name,
+            "files": [str(f) for f in files],
+            "inodes": [os.stat(f).st_ino for f in files],
+        }) + "\n")
+
+    for idx, filename in enumerate(files):
+        if (cat12_path / f"fail-{filename.parent.name}").exists():
+            raise ValueError(f"Failed at {filename}")
+
+        if "deface" in script.name:
+            shutil.copy(filename, filename.parent / f"anon_{filename.name}")
+
+        elif "smooth" in script.name:
+            shutil.copy(filename, filename.parent / f"smooth_{filename.name}")
+
+        elif "segment" in script.name:
+            os.makedirs(filename.parent / "mri", exist_ok=True)
+            for prefix in SEGMENT_PREFIXES:
+                shutil.copy(
+                    filename,
+                    filename.parent / "mri" / f"{prefix}{filename.name}",
+                )
+            os.makedirs(filename.parent / "report", exist_ok=True)
+            (filename.parent / "report" / f"cat_{Path(filename.name).stem}.xml").write_text("<xml/>")
+
+            if (cat12_path / "wait").exists():
+                wait_for_file(cat12_path / f"continue-{idx}")
+
+        else:
+            raise ValueError(f"Unknown script {script}")
+
+
+def run_worker(cat12_path: Path, script: Path):
+    """
+    Process the jobs of the queue like the matlab worker script
+    """
+    queue_path = Path(re.search(r"queue_path = '(.*)';", script.read_text()).groups()[0])
+    job_path = queue_path / "jobs"
+    while not (queue_path / "stop").exists():
+        jobs = sorted(job_path.glob("*.job"))
+        if not jobs:
+            time.sleep(.01)
+            continue
+
+        batch_filename = Path(jobs[0].read_text().strip())
+        run_filename = jobs[0].with_suffix(".run")
+        os.replace(jobs[0], run_filename)
+        try:
+            run_script(cat12_path, batch_filename, parse_batch_files(batch_filename))
+            status = "0"
+        except Exception as e:
+            print(f"job {jobs[0]} failed: {e}", file=sys.stderr)
+            status = "1"
+        run_filename.with_suffix(".tmp").write_text(status)
+        os.replace(run_filename.with_suffix(".tmp"), run_filename.with_suffix(".done"))
+
+
+def main(log_filename: str, *args: str):
+    cat12_path = Path(log_filename).parent
+    script, files = parse_args(args)
+
+    if script.name == "bad_cat12_worker.m":
+        with open(cat12_path / "calls.jsonl", "a") as fp:
+            fp.write(json.dumps({"script": script.name, "files": []}) + "\n")
+        run_worker(cat12_path, script)
+    else:
+        run_script(cat12_path, script, files)
+
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,84 @@
+import tempfile
+from pathlib import Path
+
+import nibabel
+import numpy as np
+
+from bad import config
+from bad.modules import *
+from tests.base import BadTestCase
+
+
+class TestAutoCropModule(BadTestCase):
+
+    def create_image(self, box: tuple, shape: tuple = (30, 31, 32)) -> ImageObject:
+        rng = np.random.default_rng(23)
+        # background noise below the threshold
+        data = rng.uniform(0, 1, size=shape).astype("float32")
+        data[box] = rng.uniform(50, 100, size=data[box].shape)
+        affine = np.array([
+            [2., .1, 0., -30.],
+            [0., 1.5, 0., -40.],
+            [0., 0., 1., -20.],
+            [0., 0., 0., 1.],
+        ])
+        return ImageObject(
+            src=nibabel.Nifti1Image(data, affine=affine),
+            filename="image.nii", sub_path="", source_path="",
+        )
+
+    def test_100_threshold(self):
+        image = self.create_image(np.s_[5:12, 10:20, 3:30])
+
+        module = ModuleFactory.new_module("image_autocrop", {"margin": 2}, prepare=True)
+        output = list(module.process_objects([image]))[0]
+
+        expected = image.src.slicer[3:14, 8:22, 1:32]
+        self.assertEqual(expected.shape, output.shape)
+        np.testing.assert_allclose(expected.affine, output.src.affine)
+        np.testing.assert_array_equal(expected.get_fdata(), output.src.get_fdata())
+        self.assertEqual("image_autocrop", output.actions[-1]["name"])
+
+        # empty images are not cropped
+        empty = ImageObject(
+            src=nibabel.Nifti1Image(np.zeros((10, 10, 10), dtype="float32"), affine=np.eye(4)),
+            filename="empty.nii", sub_path="", source_path="",
+        )
+        self.assertEqual((10, 10, 10), list(module.process_objects([empty]))[0].shape)
+
+    def test_200_mask(self):
+        images = [
+            self.create_image(np.s_[5:12, 10:20, 3:30]),
+            self.create_image(np.s_[1:2, 2:3, 3:4]),
+        ]
+
+        with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            mask = np.zeros((30, 31, 32), dtype="uint8")
+            mask[10:20, 5:25, 0:30] = 1
+            nibabel.Nifti1Image(mask, affine=np.eye(4)).to_filename(tmp_dir / "mask.nii.gz")
+
+            with config.ConfigOverload({"DATA_PATH": tmp_dir}):
+                module = ModuleFactory.new_module(
+                    "image_autocrop",
+                    {"mode": "mask", "mask_file": "mask.nii.gz", "margin": 1},
+                    prepare=True,
+                )
+
+            box = np.s_[9:21, 4:26, 0:31]
+            self.assertEqual(box, module.get_input_region((30, 31, 32)))
+            self.assertEqual(
+                np.s_[10:11, 4:26, 2:5],
+                module.get_input_region((30, 31, 32), np.s_[1:2, :, 2:5]),
+            )
+            self.assertIsNone(module.get_input_region((10, 10, 10)))
+
+            # all images are cropped to the same box
+            for image, output in zip(images, module.process_objects(images)):
+                expected = image.src.slicer[box]
+                self.assertEqual(expected.shape, output.shape)
+                np.testing.assert_allclose(expected.affine, output.src.affine)
+                np.testing.assert_array_equal(expected.get_fdata(), output.src.get_fdata())
+
+            with self.assertRaises(ValueError):
+                list(module.process_objects([self.create_image(np.s_[1:2], shape=(10, 10, 10))]))
@@ -0,0 +1,131 @@
+import os
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+import nibabel
+import nilearn.image
+import numpy as np
+
+from bad import config
+from bad.modules import *
+from tests.base import BadTestCase
+
+
+class TestMaskAtlasModule(BadTestCase):
+
+    def create_atlas(self, path: Path, image: ImageObject, num_regions: int = 5) -> str:
+        """
+        Store an integer atlas with `num_regions` regions (plus background)
+        derived from the intensities of `image`
+        """
+        data = image.src.get_fdata()
+        bins = np.quantile(data[data > 0], np.linspace(0, 1, num_regions + 1)[1:-1])
+        atlas_data = np.digitize(data, bins).astype("int16") + 1
+        atlas_data[data <= 0] = 0
+        nibabel.Nifti1Image(atlas_data, affine=image.src.affine).to_filename(path / "atlas.nii.gz")
+        return "atlas.nii.gz"
+
+    def expected_images(self, image: ImageObject, atlas: nibabel.Nifti1Image, crop: bool) -> dict:
+        """
+        The straight-forward full-volume implementation
+        """
+        atlas_array = np.asanyarray(atlas.dataobj)
+        expected = {}
+        for mask_value in np.unique(atlas_array):
+            mask = atlas_array == mask_value
+            masked_image = nibabel.Nifti1Image(
+                (image.src.dataobj * mask).astype("float32"),
+                affine=image.src.affine,
+            )
+            if crop:
+                _, crop_slices = nilearn.image.crop_img(
+                    nibabel.Nifti1Image(mask.astype("uint8"), affine=atlas.affine),
+                    pad=True, return_offset=True,
+                )
+                masked_image = masked_image.slicer[crop_slices]
+            expected[f"mask_{mask_value}"] = masked_image
+        return expected
+
+    def test_100_regions_match_full_volume_masking(self):
+        image = self.load_image_object("avg152T1_LR_nifti.nii.gz")
+
+        with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            with config.ConfigOverload({"DATA_PATH": tmp_dir, "TEMP_PATH": tmp_dir / "tmp"}):
+                atlas_file = self.create_atlas(tmp_dir, image)
+                atlas = nibabel.load(tmp_dir / atlas_file)
+
+                for crop in (True, False):
+                    module = ModuleFactory.new_module(
+                        "image_mask_atlas",
+                        {"atlas_file": atlas_file, "crop_result": crop},
+                        prepare=True,
+                    )
+                    expected = self.expected_images(image, atlas, crop=crop)
+                    outputs = list(module.process_objects([image]))
+
+                    self.assertEqual(len(expected), len(outputs))
+                    for output in outputs:
+                        expected_image = expected[output.sub_path.name]
+                        self.assertEqual(expected_image.shape, output.shape)
+                        np.testing.assert_allclose(expected_image.affine, output.src.affine)
+                        np.testing.assert_array_equal(
+                            np.asanyarray(expected_image.dataobj),
+                            np.asanyarray(output.src.dataobj),
+                        )
+
+    def test_200_max_num_voxels(self):
+        image = self.load_image_object("avg152T1_LR_nifti.nii.gz")
+
+        with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            with config.ConfigOverload({"DATA_PATH": tmp_dir, "TEMP_PATH": tmp_dir / "tmp"}):
+                atlas_file = self.create_atlas(tmp_dir, image)
+
+                module = ModuleFactory.new_module(
+                    "image_mask_atlas",
+                    {"atlas_file": atlas_file, "max_num_voxels": 1},
+                    prepare=True,
+                )
+                self.assertEqual([], list(module.process_objects([image])))
+
+    def test_300_region_cache(self):
+        image = self.load_image_object("avg152T1_LR_nifti.nii.gz")
+
+        with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            with config.ConfigOverload({"DATA_PATH": tmp_dir, "TEMP_PATH": tmp_dir / "tmp"}):
+                atlas_file = self.create_atlas(tmp_dir, image)
+                params = {"atlas_file": atlas_file, "max_num_voxels": 200_000}
+
+                module = ModuleFactory.new_module("image_mask_atlas", params, prepare=True)
+                expected_outputs = list(module.process_objects([image]))
+
+                # the second module reads the regions from the cache
+                module = ModuleFactory.new_module("image_mask_atlas", params)
+                with patch.object(module, "_calc_regions", side_effect=AssertionError("not cached")):
+                    module.prepare()
+                outputs = list(module.process_objects([image]))
+
+                self.assertEqual(len(expected_outputs), len(outputs))
+                for expected, output in zip(expected_outputs, outputs):
+                    self.assertEqual(expected.sub_path, output.sub_path)
+                    np.testing.assert_array_equal(
+                        np.asanyarray(expected.src.dataobj),
+                        np.asanyarray(output.src.dataobj),
+                    )
+
+                # changed parameters are not read from cache
+                module = ModuleFactory.new_module("image_mask_atlas", {**params, "crop_result": False})
+                with patch.object(module, "_calc_regions", wraps=module._calc_regions) as calc_regions:
+                    module.prepare()
+                    self.assertEqual(1, calc_regions.call_count)
+
+                # modified atlas file is not read from cache
+                stat = (tmp_dir / atlas_file).stat()
+                os.utime(tmp_dir / atlas_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+                module = ModuleFactory.new_module("image_mask_atlas", params)
+                with patch.object(module, "_calc_regions", wraps=module._calc_regions) as calc_regions:
+                    module.prepare()
+                    self.assertEqual(1, calc_regions.call_count)
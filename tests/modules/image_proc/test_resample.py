@@ -0,0 +1,50 @@
+from unittest.mock import patch
+
+import nibabel
+import numpy as np
+
+from bad.modules import *
+from tests.base import BadTestCase
+
+
+class TestResampleModule(BadTestCase):
+
+    def test_100_batch_keeps_order(self):
+        src = self.load_image_object("avg152T1_LR_nifti.nii.gz").src
+        small_src = src.slicer[10:50, 10:60, 10:70]
+        images = [
+            ImageObject(src=src, filename="a.nii", sub_path="", source_path=""),
+            ImageObject(src=small_src, filename="b.nii", sub_path="", source_path=""),
+            ImageObject(
+                src=nibabel.Nifti1Image(src.get_fdata() * 2, affine=src.affine),
+                filename="c.nii", sub_path="", source_path="",
+            ),
+            ImageObject(src=small_src, filename="d.nii", sub_path="", source_path=""),
+        ]
+        for params in (
+                {"mode": "percent", "output_percent": 50},
+                {"mode": "fixed", "output_x": 20, "output_y": 21, "output_z": 22},
+                {"mode": "percent", "output_percent": 50, "interpolation": "linear"},
+        ):
+            module = ModuleFactory.new_module("image_resample", params)
+            module.batch_size = 3
+            batch_sizes = []
+            process_batch = module.process_batch
+
+            def _process_batch(batch):
+                batch_sizes.append(len(batch))
+                return process_batch(batch)
+
+            with patch.object(module, "process_batch", _process_batch):
+                outputs = list(module.process_objects(images))
+
+            # continuous interpolation is not batched
+            self.assertEqual([3, 1] if "interpolation" in params else [1, 1, 1, 1], batch_sizes)
+            self.assertEqual(len(images), len(outputs))
+            for image, output in zip(images, outputs):
+                expected = module.process_batch([image])[0]
+                self.assertEqual(image.filename, output.filename)
+                self.assertEqual(expected.shape, output.shape)
+                np.testing.assert_array_equal(
+                    np.asanyarray(expected.src.dataobj), np.asanyarray(output.src.dataobj),
+                )
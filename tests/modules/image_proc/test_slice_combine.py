@@ -0,0 +1,71 @@
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+import numpy as np
+
+from bad import config
+from bad.modules import *
+from tests.base import BadTestCase
+
+
+class TestSliceCombineModule(BadTestCase):
+
+    def test_100_combine(self):
+        images = [
+            self.load_image_object("avg152T1_LR_nifti.nii.gz"),
+            self.load_image_object("avg152T1_RL_nifti.nii.gz"),
+        ]
+        small_image = self.load_image_object("avg152T1_LR_nifti.nii.gz")
+        small_image.src = small_image.src.slicer[:50]
+        images.insert(1, small_image)
+
+        with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+            with config.ConfigOverload({"TEMP_PATH": Path(tmp_dir)}):
+                for axis in (0, 1, 2):
+                    expected = np.concatenate([
+                        np.take(np.asanyarray(images[idx].src.dataobj), [40], axis=axis)
+                        for idx in (0, 2)
+                    ], axis=axis)
+
+                    for memory_map in (False, True):
+                        module = ModuleFactory.new_module(
+                            "image_slice_combine",
+                            {"slice_axis": axis, "slice_offset": 40, "memory_map": memory_map},
+                        )
+                        # list input (known size) and generator input (unknown size)
+                        for input_images in (images, (image for image in images)):
+                            outputs = list(module.process_objects(input_images))
+
+                            self.assertEqual(1, len(outputs))
+                            data = np.asanyarray(outputs[0].src.dataobj)
+                            self.assertEqual(expected.dtype, data.dtype)
+                            np.testing.assert_array_equal(expected, data)
+                            np.testing.assert_allclose(images[0].src.affine, outputs[0].src.affine)
+
+    def test_200_allocate_graph_objects(self):
+        source = ModuleFactory.new_module("image_source_directory", {
+            "source_directory": str(self.DATA_PATH.relative_to(config.DATA_PATH)),
+            "glob_pattern": "avg152T1_*_nifti.nii.gz",
+        })
+        module = ModuleFactory.new_module(
+            "image_slice_combine",
+            {"slice_axis": 2, "slice_offset": 40},
+        )
+        graph = ModuleGraph([source, module])
+
+        for interval, offset, num_images in ((1, 0, 2), (2, 0, 1), (2, 1, 1)):
+            sizes = []
+            allocate = module._allocate
+
+            def _allocate(slice_shape, axis, size, dtype):
+                sizes.append(size)
+                return allocate(slice_shape, axis, size, dtype)
+
+            with patch.object(module, "_allocate", _allocate):
+                outputs = list(graph.process(interval=interval, offset=offset))
+
+            self.assertEqual(1, len(outputs))
+            self.assertEqual(num_images, outputs[0].shape[2])
+            # the graph passes the number of source images, the array is allocated once
+            self.assertEqual([num_images], sizes)
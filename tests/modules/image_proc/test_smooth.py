@@ -0,0 +1,100 @@
+import os
+import pickle
+
+import nibabel
+import numpy as np
+import scipy.ndimage
+
+from bad.modules import *
+from bad.parallel import ProcessWorker
+from bad.util.image import smoothing_kernel, smooth_volume
+from tests.base import BadTestCase
+
+
+def _pool_num_threads(module, results):
+    results.append(module.get_num_threads())
+
+
+class TestSmoothModule(BadTestCase):
+
+    def fwhm_of(self, line: np.ndarray) -> float:
+        """measure full-width-at-half-maximum of a 1-dimensional peak"""
+        center = int(np.argmax(line))
+        half = line[center] / 2.
+        x = np.arange(len(line))
+        left = np.interp(half, line[:center + 1], x[:center + 1])
+        right = np.interp(-half, -line[center:], x[center:])
+        return right - left
+
+    def test_100_kernel(self):
+        for fwhm in (1., 4., 8.):
+            kernel = smoothing_kernel(fwhm)
+            self.assertAlmostEqual(1., kernel.sum())
+            np.testing.assert_allclose(kernel, kernel[::-1])
+            # the integration over linear voxels slightly widens the Gaussian
+            self.assertAlmostEqual(fwhm, self.fwhm_of(kernel), delta=.5)
+
+        # large kernels approach the plain Gaussian
+        sigma = 10. / np.sqrt(8. * np.log(2.))
+        impulse = np.zeros(101)
+        impulse[50] = 1
+        kernel = smoothing_kernel(10.)
+        size = len(kernel) // 2
+        np.testing.assert_allclose(
+            scipy.ndimage.gaussian_filter1d(impulse, sigma, truncate=6.)[50 - size:50 + size + 1],
+            kernel,
+            atol=1e-3,
+        )
+
+    def test_110_threads(self):
+        data = np.random.default_rng(23).normal(size=(30, 31, 32, 2)).astype("float16")
+        expected = smooth_volume(data, (3, 2, 4), num_threads=1)
+        self.assertEqual(np.float32, expected.dtype)
+        self.assertEqual(data.shape, expected.shape)
+        np.testing.assert_array_equal(expected, smooth_volume(data, (3, 2, 4), num_threads=5))
+
+    def test_200_module(self):
+        data = np.zeros((41, 41, 41), dtype="int16")
+        data[20, 20, 20] = 1000
+        image = ImageObject(
+            src=nibabel.Nifti1Image(data, affine=np.diag([2., 1., .5, 1.])),
+            filename="impulse.nii", sub_path="", source_path="",
+        )
+        module = ModuleFactory.new_module("image_smooth", {"smooth_x": 8., "smooth_y": 8., "smooth_z": 4.})
+        output = list(module.process_objects([image]))[0]
+
+        output_data = np.asanyarray(output.src.dataobj)
+        self.assertEqual(np.float32, output_data.dtype)
+        self.assertEqual(image.shape, output.shape)
+        np.testing.assert_allclose(image.src.affine, output.src.affine)
+        self.assertAlmostEqual(1000., output_data.sum(), places=1)
+
+        # full-width-at-half-maximum in voxels
+        self.assertAlmostEqual(4., self.fwhm_of(output_data[:, 20, 20]), delta=.3)
+        self.assertAlmostEqual(8., self.fwhm_of(output_data[20, :, 20]), delta=.3)
+        self.assertAlmostEqual(8., self.fwhm_of(output_data[20, 20, :]), delta=.3)
+
+    def test_300_threads_per_process(self):
+        module = ModuleFactory.new_module("image_smooth")
+        self.assertEqual(os.cpu_count(), module.get_num_threads())
+
+        # the threads are shared by the processes of a pool
+        with ProcessWorker(2) as pool:
+            results = pool.manager.list()
+            for i in range(2):
+                pool.put(_pool_num_threads, module=module, results=results)
+            pool.stop()
+            self.assertEqual([max(1, os.cpu_count() // 2)] * 2, list(results))
+
+        module.num_threads = 2
+        image = ImageObject(
+            src=nibabel.Nifti1Image(np.ones((10, 10, 10), dtype="float32"), affine=np.eye(4)),
+            filename="ones.nii", sub_path="", source_path="",
+        )
+        list(module.process_objects([image, image]))
+        executor = module._get_executor(2)
+        list(module.process_objects([image]))
+        # one executor per module
+        self.assertIs(executor, module._get_executor(2))
+        # which is not pickled
+        self.assertEqual(2, pickle.loads(pickle.dumps(module)).get_num_threads())
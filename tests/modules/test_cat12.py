@@ -1,13 +1,26 @@
 import os
 import json
+import multiprocessing
+import subprocess
+import tempfile
 import unittest
 from pathlib import Path
+from unittest.mock import patch
 
+import nibabel
 import numpy as np
 
 from bad import config
 from bad.modules import *
+from bad.modules.matlab.cat12.worker import (
+    WORKER_SCRIPT, cat12_batch, parse_cat12_args, get_cat12_worker, stop_cat12_workers,
+)
 from tests.base import BadTestCase
+from tests.modules.cat12standin import create_cat12_stand_in, read_calls
+
+
+def _start_cat12_worker():
+    get_cat12_worker().start()
 
 
 @unittest.skipIf(len(str(config.CAT12_PATH)) <= 1 or not config.CAT12_PATH.exists(), "CAT12 package not at it's place")
@@ -47,3 +60,282 @@ class TestCat12Modules(BadTestCase):
             np.sum(image.src.get_fdata().flatten()),
             "Output image should have 'less data' than input image"
         )
+
+
+class TestCat12StandIn(BadTestCase):
+
+    def test_100_batches(self):
+        images = [
+            self.load_image_object(filename, sub_path=sub_path)
+            for sub_path in ("a", "b", "c")
+            for filename in ("avg152T1_LR_nifti.nii.gz", "avg152T1_RL_nifti.nii.gz")
+        ]
+
+        with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            cat12_path = create_cat12_stand_in(tmp_dir)
+            with config.ConfigOverload({
+                "CAT12_PATH": cat12_path,
+                "MATLAB_PATH": tmp_dir,
+                "TEMP_PATH": tmp_dir / "tmp",
+            }):
+                module = ModuleFactory.new_module("cat12_deface")
+                with patch.object(module, "batch_size", 4):
+                    outputs = list(module.process_objects(images))
+
+                calls = read_calls(cat12_path)
+                self.assertEqual([4, 2], [len(call["files"]) for call in calls])
+                self.assertEqual(["cat_standalone_deface.m"] * 2, [call["script"] for call in calls])
+
+                # outputs map back to their input images
+                self.assertEqual(len(images), len(outputs))
+                for image, output in zip(images, outputs):
+                    self.assertEqual(image.sub_path, output.sub_path)
+                    self.assertEqual(image.filename, output.filename)
+                    self.assertEqual("cat12_deface", output.actions[-1]["name"])
+                    np.testing.assert_array_equal(image.src.get_fdata(), output.src.get_fdata())
+
+                # temporary files are removed
+                self.assertEqual([], os.listdir(tmp_dir / "tmp"))
+
+                module = ModuleFactory.new_module("cat12_preprocess")
+                outputs = list(module.process_objects(images[:3]))
+                calls = read_calls(cat12_path)
+                self.assertEqual(3, len(calls))
+                self.assertEqual(3, len(calls[-1]["files"]))
+                self.assertRegex(calls[-1]["script"], r"patched_cat_standalone_segment_[0-9a-f]+\.m")
+                self.assertEqual(
+                    [
+                        (str(image.sub_path / "mri"), f"{prefix.rstrip('_')}_{image.filename}")
+                        for image in images[:3]
+                        for prefix in ("mwp1", "p0", "wm", "y_")
+                    ],
+                    [(str(o.sub_path), o.filename) for o in outputs],
+                )
+
+    def test_200_stream_finished_outputs(self):
+        images = [
+            self.load_image_object("avg152T1_LR_nifti.nii.gz", sub_path=sub_path)
+            for sub_path in ("a", "b", "c")
+        ]
+
+        with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            cat12_path = create_cat12_stand_in(tmp_dir)
+            (cat12_path / "wait").touch()
+            with config.ConfigOverload({
+                "CAT12_PATH": cat12_path,
+                "MATLAB_PATH": tmp_dir,
+                "TEMP_PATH": tmp_dir / "tmp",
+            }):
+                module = ModuleFactory.new_module("cat12_preprocess")
+                with patch.object(module, "poll_interval", .01):
+                    outputs = module.process_objects(images)
+
+                    # the outputs of each image are passed on while cat12 is still running
+                    for idx, image in enumerate(images):
+                        for prefix in ("mwp1", "p0", "wm", "y"):
+                            output = next(outputs)
+                            self.assertEqual(image.sub_path / "mri", output.sub_path)
+                            self.assertEqual(f"{prefix}_{image.filename}", output.filename)
+
+                        self.assertFalse((cat12_path / f"continue-{idx}").exists())
+                        (cat12_path / f"continue-{idx}").touch()
+
+                    self.assertEqual([], list(outputs))
+                    self.assertEqual(1, len(read_calls(cat12_path)))
+
+    def test_210_failing_image(self):
+        images = [
+            self.load_image_object("avg152T1_LR_nifti.nii.gz", sub_path=sub_path)
+            for sub_path in ("a", "b", "c", "d")
+        ]
+
+        with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            cat12_path = create_cat12_stand_in(tmp_dir)
+            # the images are staged in directories named by their index in the batch
+            (cat12_path / "fail-1").touch()
+            with config.ConfigOverload({
+                "CAT12_PATH": cat12_path,
+                "MATLAB_PATH": tmp_dir,
+                "TEMP_PATH": tmp_dir / "tmp",
+            }):
+                for name, num_outputs in (("cat12_preprocess", 4), ("cat12_deface", 1)):
+                    module = ModuleFactory.new_module(name)
+                    outputs = []
+                    with patch.object(module, "poll_interval", .01):
+                        with self.assertRaises(subprocess.CalledProcessError):
+                            for output in module.process_objects(images):
+                                outputs.append(output)
+
+                    # the outputs of all other images are passed on before the error
+                    self.assertEqual(
+                        [sub_path for sub_path in ("a", "c", "d") for _ in range(num_outputs)],
+                        [output.sub_path.parts[0] for output in outputs],
+                    )
+
+            calls = read_calls(cat12_path)
+            # the batch call and then the unfinished images one at a time,
+            #   deface has no finished outputs before the whole call is done
+            self.assertEqual(
+                [4, 1, 1, 1] + [4, 1, 1, 1, 1],
+                [len(call["files"]) for call in calls],
+            )
+
+    def test_300_worker(self):
+        images = [
+            self.load_image_object("avg152T1_LR_nifti.nii.gz", sub_path=sub_path)
+            for sub_path in ("a", "b", "c")
+        ]
+
+        with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            cat12_path = create_cat12_stand_in(tmp_dir)
+            with config.ConfigOverload({
+                "CAT12_PATH": cat12_path,
+                "MATLAB_PATH": tmp_dir,
+                "TEMP_PATH": tmp_dir / "tmp",
+                "CAT12_WORKER": True,
+            }):
+                try:
+                    deface = ModuleFactory.new_module("cat12_deface")
+                    with patch.object(deface, "batch_size", 2):
+                        defaced = list(deface.process_objects(images))
+                    self.assertEqual(3, len(defaced))
+
+                    outputs = []
+                    for voxel_size in (1.5, 2., 1.5):
+                        module = ModuleFactory.new_module("cat12_preprocess", {
+                            "normalized_voxel_size": voxel_size,
+                        })
+                        with patch.object(module, "poll_interval", .01):
+                            outputs.append(list(module.process_objects(defaced)))
+                    self.assertEqual([12, 12, 12], [len(o) for o in outputs])
+
+                    # the runtime is only started once
+                    calls = read_calls(cat12_path)
+                    self.assertEqual(
+                        ["bad_cat12_worker.m"] + ["cat_standalone_deface.m"] * 2,
+                        [call["script"] for call in calls[:3]],
+                    )
+                    self.assertEqual(1, [call["script"] for call in calls].count("bad_cat12_worker.m"))
+
+                    # patched scripts are named by their content
+                    scripts = [call["script"] for call in calls[3:]]
+                    self.assertEqual(3, len(scripts))
+                    self.assertEqual(scripts[0], scripts[2])
+                    self.assertNotEqual(scripts[0], scripts[1])
+
+                    # errors in a job are raised
+                    with self.assertRaises(subprocess.CalledProcessError):
+                        module.call_cat12("cat_standalone_unknown")
+
+                finally:
+                    stop_cat12_workers()
+
+                self.assertEqual(
+                    [],
+                    [name for name in os.listdir(tmp_dir / "tmp") if name.startswith("cat12-worker")],
+                )
+
+    @unittest.skipIf("fork" not in multiprocessing.get_all_start_methods(), "fork not available")
+    def test_305_worker_stopped_in_child_process(self):
+        with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            cat12_path = create_cat12_stand_in(tmp_dir)
+            with config.ConfigOverload({
+                "CAT12_PATH": cat12_path,
+                "MATLAB_PATH": tmp_dir,
+                "TEMP_PATH": tmp_dir / "tmp",
+                "CAT12_WORKER": True,
+            }):
+                # child processes exit with os._exit() which skips atexit handlers
+                process = multiprocessing.get_context("fork").Process(target=_start_cat12_worker)
+                process.start()
+                process.join(timeout=60)
+                self.assertEqual(0, process.exitcode)
+
+                self.assertEqual(
+                    ["bad_cat12_worker.m"],
+                    [call["script"] for call in read_calls(cat12_path)],
+                )
+                self.assertEqual(
+                    [],
+                    [name for name in os.listdir(tmp_dir / "tmp") if name.startswith("cat12-worker")],
+                )
+
+    def test_310_worker_batch(self):
+        script = "\n".join([
+            "% smooth",
+            "matlabbatch{1}.spm.spatial.smooth.data = '<UNDEFINED>';",
+            "matlabbatch{1}.spm.spatial.smooth.fwhm = '<UNDEFINED>';",
+            "matlabbatch{1}.spm.spatial.smooth.dtype = 0;",
+            "% matlabbatch{1}.spm.spatial.smooth.prefix = '<UNDEFINED>';",
+        ])
+        batch_filename, files, kwargs = parse_cat12_args([
+            "-b", "/cat12/smooth.m", "-a1", "[6, 6, 6]", "-a2", " 'smooth_' ",
+            "-a", "matlabbatch{1}.spm.spatial.smooth.im = 1;",
+            Path("/data/a.nii"), "/data/b.nii",
+        ])
+        self.assertEqual(Path("/cat12/smooth.m"), batch_filename)
+        self.assertEqual(
+            "\n".join([
+                "% smooth",
+                "matlabbatch{1}.spm.spatial.smooth.dtype = 0;",
+                "matlabbatch{1}.spm.spatial.smooth.data = {",
+                "'/data/a.nii'",
+                "'/data/b.nii'",
+                "};",
+                "matlabbatch{1}.spm.spatial.smooth.fwhm = [6, 6, 6];",
+                "matlabbatch{1}.spm.spatial.smooth.prefix =  'smooth_' ;",
+                "matlabbatch{1}.spm.spatial.smooth.im = 1;",
+            ]) + "\n",
+            cat12_batch(script, files, **kwargs),
+        )
+
+        with self.assertRaises(ValueError):
+            cat12_batch("% no files\n", files)
+
+        # the worker runs the rewritten batch, not cat_standalone with the shell arguments
+        worker_script = WORKER_SCRIPT.format(queue_path="/tmp/queue", poll_interval=.2)
+        self.assertIn("spm_jobman('run', {batch_file});", worker_script)
+        self.assertNotIn("cat_standalone(", worker_script)
+
+    def test_400_stage_unmodified_files(self):
+        with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            cat12_path = create_cat12_stand_in(tmp_dir)
+
+            source_filename = tmp_dir / "source.nii"
+            self.load_image_object("avg152T1_LR_nifti.nii.gz").src.to_filename(source_filename)
+
+            def load_image(modify: bool = False) -> ImageObject:
+                image = nibabel.load(source_filename)
+                if modify:
+                    image.header["descrip"] = b"modified"
+                return ImageObject(src=image, filename="image.nii", sub_path="", source_path="")
+
+            with config.ConfigOverload({
+                "CAT12_PATH": cat12_path,
+                "MATLAB_PATH": tmp_dir,
+                "TEMP_PATH": tmp_dir / "tmp",
+            }):
+                source_inode = source_filename.stat().st_ino
+
+                # linked
+                list(ModuleFactory.new_module("cat12_deface").process_objects([load_image()]))
+                self.assertEqual([source_inode], read_calls(cat12_path)[-1]["inodes"])
+
+                # stored again
+                list(ModuleFactory.new_module("cat12_deface").process_objects([load_image(modify=True)]))
+                self.assertNotEqual([source_inode], read_calls(cat12_path)[-1]["inodes"])
+
+                # copied, the segmentation might change the input file
+                with patch.object(nibabel.Nifti1Image, "to_filename", side_effect=AssertionError("not copied")):
+                    outputs = list(ModuleFactory.new_module("cat12_preprocess").process_objects([load_image()]))
+                self.assertNotEqual([source_inode], read_calls(cat12_path)[-1]["inodes"])
+                np.testing.assert_array_equal(
+                    nibabel.load(source_filename).get_fdata(),
+                    outputs[0].src.get_fdata(),
+                )
@@ -258,3 +258,262 @@ class TestModuleGraph(BadTestCase):
 
                 self.assertTrue(any(f.checksum) for f in target_files)
                 self.assertTrue(any(f.data) for f in target_files)
+
+    def test_600_region_pushdown(self):
+        from bad.util.region import RegionArrayProxy
+
+        shape = (91, 109, 91)
+        slice_module = ModuleFactory.new_module("image_slice", {"slice_axis": 1, "slice_offset": 40})
+        slab = np.s_[:, 40:41, :]
+
+        self.assertEqual(slab, ModuleGraph.get_required_region([slice_module], shape))
+        self.assertEqual(
+            slab,
+            ModuleGraph.get_required_region([ModuleFactory.new_module("image_noop"), slice_module], shape)
+        )
+        # resampling needs the whole input
+        self.assertIsNone(
+            ModuleGraph.get_required_region([ModuleFactory.new_module("image_resample"), slice_module], shape)
+        )
+        # the complete output of (stored) modules is needed
+        noop_module = ModuleFactory.new_module("image_noop")
+        self.assertIsNone(
+            ModuleGraph.get_required_region([noop_module, slice_module], shape, complete_modules={noop_module})
+        )
+
+        with config.ConfigOverload({
+            "DATA_PATH": self.DATA_PATH,
+        }):
+            graph = ModuleGraph([
+                self.create_source_module("image", traverse_tar=False),
+                ModuleFactory.new_module("image_noop"),
+                slice_module,
+            ])
+            graph.prepare_modules()
+
+            source_objects = list(graph.restrict_source_objects(graph.iter_source_objects()))
+            self.assertEqual(2, len(source_objects))
+            for obj in source_objects:
+                self.assertIsInstance(obj.src.dataobj, RegionArrayProxy)
+                self.assertEqual(shape, obj.shape)
+
+            objects = sorted(graph.process(), key=lambda o: o.filename)
+            self.assertEqual(["avg152T1_LR_nifti.nii.gz", "avg152T1_RL_nifti.nii.gz"], [o.filename for o in objects])
+            for obj in objects:
+                expected = self.load_image_object(obj.filename).src.slicer[slab]
+                self.assertEqual(expected.shape, obj.shape)
+                np.testing.assert_allclose(expected.affine, obj.src.affine)
+                np.testing.assert_array_equal(expected.get_fdata(), obj.src.get_fdata())
+
+    def test_610_region_pushdown_module_shapes(self):
+        import nibabel
+
+        image = self.load_image_object("avg152T1_LR_nifti.nii.gz")
+        shape = image.shape
+
+        with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            with config.ConfigOverload({"DATA_PATH": tmp_dir, "TEMP_PATH": tmp_dir / "tmp"}):
+                # a single region in a small box
+                atlas_data = np.zeros(shape, dtype="int16")
+                atlas_data[10:20, 30:50, 40:60] = 1
+                nibabel.Nifti1Image(atlas_data, affine=image.src.affine).to_filename(tmp_dir / "atlas.nii.gz")
+
+                mask_module = ModuleFactory.new_module(
+                    # skip the background region
+                    "image_mask_atlas", {"atlas_file": "atlas.nii.gz", "max_num_voxels": 10_000}, prepare=True,
+                )
+                box = mask_module.region_slices[1]
+                slice_module = ModuleFactory.new_module("image_slice", {"slice_axis": 1, "slice_offset": 40})
+
+                self.assertEqual([1], mask_module.atlas_mask_values)
+                self.assertEqual(box, ModuleGraph.get_required_region([mask_module], shape))
+                # the slice does not have the shape of the atlas and is resampled
+                self.assertEqual(
+                    np.s_[:, 40:41, :],
+                    ModuleGraph.get_required_region([slice_module, mask_module], shape),
+                )
+                # the output shape of the masked regions is unknown
+                self.assertEqual(box, ModuleGraph.get_required_region([mask_module, slice_module], shape))
+                # the output shape of the threshold crop is unknown
+                self.assertIsNone(
+                    ModuleGraph.get_required_region([
+                        ModuleFactory.new_module("image_autocrop"),
+                        mask_module,
+                    ], shape),
+                )
+
+    def test_700_fused_modules(self):
+        import nibabel
+
+        def create_graph(target_path: Path, fuse_modules: bool) -> ModuleGraph:
+            return ModuleGraph(
+                [
+                    self.create_source_module(
+                        "image",
+                        source_directory=self.DATA_PATH.relative_to(config.DATA_PATH),
+                    ),
+                    ModuleFactory.new_module("test_image_and_file"),
+                    ModuleFactory.new_module("image_resample", {"mode": "fixed", "output_x": 40}),
+                    ModuleFactory.new_module("image_smooth", {"module_store_result": True}),
+                    ModuleFactory.new_module("image_slice", {"slice_axis": 2, "slice_offset": 10}),
+                    ModuleFactory.new_module("image_resample", {"output_percent": 50}),
+                ],
+                target_path=config.relative_to_data_path(target_path),
+                fuse_modules=fuse_modules,
+            )
+
+        def action_modules(obj: ModuleObject) -> list:
+            return [
+                {key: value for key, value in action["module"].items() if key != "uuid"}
+                for action in obj.actions
+            ]
+
+        with config.ConfigOverload({
+            "DATA_PATH": "/",
+        }):
+            with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+                tmp_dir = Path(tmp_dir)
+
+                graph = create_graph(tmp_dir / "fused", True)
+                self.assertEqual(
+                    [
+                        ["test_image_and_file"],
+                        ["image_resample", "image_smooth"],
+                        ["image_slice", "image_resample"],
+                    ],
+                    [[m.name for m in modules] for modules in graph.iter_module_runs()],
+                )
+                fused_objects = sorted(graph.process(), key=lambda o: (str(o.sub_path), o.filename))
+                unfused_objects = sorted(
+                    create_graph(tmp_dir / "unfused", False).process(),
+                    key=lambda o: (str(o.sub_path), o.filename),
+                )
+
+                self.assertEqual(8, len(fused_objects))
+                self.assertEqual(len(unfused_objects), len(fused_objects))
+                for fused, unfused in zip(fused_objects, unfused_objects):
+                    self.assertEqual(type(unfused), type(fused))
+                    self.assertEqual(
+                        [a["name"] for a in unfused.actions],
+                        [a["name"] for a in fused.actions],
+                    )
+                    self.assertEqual(action_modules(unfused), action_modules(fused))
+                    if isinstance(fused, ImageObject):
+                        self.assertEqual((20, 16, 1), fused.shape)
+                        np.testing.assert_allclose(unfused.src.affine, fused.src.affine)
+                        # the slice affine is calculated differently, allow float32 rounding
+                        np.testing.assert_allclose(
+                            np.asanyarray(unfused.src.dataobj), np.asanyarray(fused.src.dataobj),
+                            rtol=1e-6,
+                        )
+
+                # same files are stored
+                for path in ("image_smooth", "image_resample"):
+                    fused_files = sorted(
+                        str(Path(fn).relative_to(tmp_dir / "fused"))
+                        for fn in glob.glob(str(tmp_dir / "fused" / path / "**" / "*.nii.gz"), recursive=True)
+                    )
+                    unfused_files = sorted(
+                        str(Path(fn).relative_to(tmp_dir / "unfused"))
+                        for fn in glob.glob(str(tmp_dir / "unfused" / path / "**" / "*.nii.gz"), recursive=True)
+                    )
+                    self.assertEqual(4, len(fused_files))
+                    self.assertEqual(unfused_files, fused_files)
+                    for filename in fused_files:
+                        fused_image = nibabel.load(tmp_dir / "fused" / filename)
+                        unfused_image = nibabel.load(tmp_dir / "unfused" / filename)
+                        self.assertEqual(unfused_image.get_data_dtype(), fused_image.get_data_dtype())
+                        np.testing.assert_allclose(
+                            unfused_image.get_fdata(), fused_image.get_fdata(), rtol=1e-6,
+                        )
+
+    def test_800_store_unmodified_files(self):
+        with config.ConfigOverload({
+            "DATA_PATH": "/",
+        }):
+            with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+                tmp_dir = Path(tmp_dir)
+
+                for link_files in (False, True):
+                    target_path = tmp_dir / f"link-{link_files}"
+                    graph = ModuleGraph(
+                        [
+                            self.create_source_module(
+                                "image",
+                                source_directory=self.DATA_PATH.relative_to(config.DATA_PATH),
+                            ),
+                            ModuleFactory.new_module("image_noop"),
+                        ],
+                        target_path=config.relative_to_data_path(target_path),
+                        link_files=link_files,
+                    )
+                    self.assertEqual(4, len(list(graph.process())))
+
+                    for RL in ("RL", "LR"):
+                        source_filename = self.DATA_PATH / f"avg152T1_{RL}_nifti.nii.gz"
+                        stored_filename = target_path / "image_noop" / source_filename.name
+                        # the source file is copied, not encoded again
+                        self.assertEqual(source_filename.read_bytes(), stored_filename.read_bytes())
+                        self.assertEqual(
+                            link_files,
+                            source_filename.stat().st_ino == stored_filename.stat().st_ino,
+                        )
+
+                    # the images from the tar file are encoded
+                    for RL in ("RL", "LR"):
+                        stored_filename = target_path / "image_noop" / "avg152T1_tar" / f"avg152T1_{RL}_nifti.nii.gz"
+                        self.assertTrue(stored_filename.exists())
+
+                    # the modification times match the .bad.json files
+                    self.assertEqual(4, len(list(graph.iter_target_files())))
+
+                    self.assertEqual(4, graph.report["stored_objects"])
+                    self.assertEqual(
+                        sum(f.stat().st_size for f in (target_path / "image_noop").rglob("*.nii.gz")),
+                        graph.report["stored_bytes"],
+                    )
+
+                    # storing again does not write into the source files
+                    source_bytes = (self.DATA_PATH / "avg152T1_LR_nifti.nii.gz").read_bytes()
+                    self.assertEqual(4, len(list(graph.process())))
+                    self.assertEqual(source_bytes, (self.DATA_PATH / "avg152T1_LR_nifti.nii.gz").read_bytes())
+
+    def test_900_wait_until_active(self):
+        events = []
+
+        module = ModuleFactory.new_module("test_multi_image", {"module_store_result": True})
+        process_objects = module.process_objects
+
+        def _process_objects(images, stub=False):
+            for image in images:
+                events.append("stub" if stub else "process")
+                yield from process_objects([image], stub=stub)
+
+        module.process_objects = _process_objects
+
+        with config.ConfigOverload({
+            "DATA_PATH": "/",
+        }):
+            with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+                graph = ModuleGraph(
+                    [
+                        self.create_source_module(
+                            "image",
+                            source_directory=self.DATA_PATH.relative_to(config.DATA_PATH),
+                        ),
+                        module,
+                    ],
+                    target_path=config.relative_to_data_path(Path(tmp_dir)),
+                    skip_policy=ModuleGraph.SkipPolicy.UNCHANGED,
+                )
+                self.assertEqual(8, len(list(graph.process(wait_until_active=lambda: events.append("admit")))))
+                # each source object is admitted right before it is processed,
+                #   not all of them before the (not fused) module starts
+                self.assertEqual(["admit", "process"] * 4, events)
+
+                # the stub pass for the existing targets is not paused
+                events.clear()
+                self.assertEqual([], list(graph.process(wait_until_active=lambda: events.append("admit"))))
+                self.assertEqual(4, graph.report["skipped_objects"])
+                self.assertEqual(["stub"] * 4 + ["admit"] * 4, events)
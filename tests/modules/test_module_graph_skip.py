@@ -272,3 +272,48 @@ class TestModuleGraphSkip(BadTestCase):
                 self.assertEqual(5, graph.report["skipped_objects"])
                 self.assertEqual(0, len(true_objects))
                 self.assertEqual(10, len(existing_targets))
+
+    def test_300_cancel_and_resume(self):
+        with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            os.makedirs(tmp_dir / "source")
+            for i in range(4):
+                shutil.copy(self.DATA_PATH / "avg152T1_LR_nifti.nii.gz", tmp_dir / "source" / f"image{i}.nii.gz")
+
+            with config.ConfigOverload({
+                "DATA_PATH": tmp_dir,
+            }):
+                graph = ModuleGraph(
+                    [
+                        ModuleFactory.new_module("image_source_directory", {
+                            "source_directory": "source",
+                            "glob_pattern": "*",
+                        }),
+                        # fused modules pass one source object at a time
+                        ModuleFactory.new_module("image_smooth"),
+                        ModuleFactory.new_module("image_resample", {"module_result_path": "final"}),
+                    ],
+                    target_path="target",
+                    skip_policy=ModuleGraph.SkipPolicy.UNCHANGED,
+                )
+
+                # cancel after two objects
+                objects = []
+                for obj in graph.process(is_cancelled=lambda: len(objects) >= 2):
+                    objects.append(obj)
+
+                self.assertEqual(2, len(objects))
+                self.assertEqual(2, graph.report["stored_objects"])
+                # only complete targets, no temporary files
+                stored_names = [Path(o.src.get_filename()).name for o in objects]
+                self.assertEqual(
+                    sorted(stored_names + [f"{name}.bad.json" for name in stored_names]),
+                    sorted(os.listdir(tmp_dir / "target" / "final")),
+                )
+
+                # the next run continues with the remaining sources
+                objects = list(graph.process())
+                self.assertEqual(4, graph.report["source_objects"])
+                self.assertEqual(2, graph.report["skipped_objects"])
+                self.assertEqual(2, graph.report["stored_objects"])
+                self.assertEqual(2, len(objects))
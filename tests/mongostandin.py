@@ -0,0 +1,144 @@
+"""
+An in-process stand-in for a mongodb collection.
+
+`MemoryCollection` supports the subset of `pymongo.collection.Collection`
+that the `WorkQueue` uses. Filters support equality, `$or`, `$lt`, `$gt`
+and `$in`, updates support `$set` and `$inc`.
+
+To share a collection between processes, start a `CollectionManager`
+and create the collection through it, e.g.:
+
+    with CollectionManager() as manager:
+        collection = manager.MemoryCollection()
+"""
+import threading
+from copy import deepcopy
+from multiprocessing.managers import BaseManager
+from typing import Any, List, Mapping, Optional, Sequence, Tuple
+
+import pymongo
+
+
+class UpdateResult:
+
+    def __init__(self, matched_count: int):
+        self.matched_count = matched_count
+        self.modified_count = matched_count
+
+
+class MemoryCollection:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._documents: List[dict] = []
+        self._next_id = 1
+
+    def create_indexes(self, indexes):
+        return []
+
+    def insert_many(self, documents, ordered: bool = True):
+        with self._lock:
+            for doc in documents:
+                doc = deepcopy(doc)
+                doc.setdefault("_id", self._next_id)
+                self._next_id += 1
+                self._documents.append(doc)
+
+    def find(self, filter: Optional[Mapping[str, Any]] = None, projection=None) -> List[dict]:
+        with self._lock:
+            return [
+                _project(doc, projection)
+                for doc in self._documents
+                if _matches(doc, filter or {})
+            ]
+
+    def find_one_and_update(
+            self,
+            filter: Mapping[str, Any],
+            update: Mapping[str, Any],
+            sort: Optional[Sequence[Tuple[str, int]]] = None,
+            return_document: bool = pymongo.ReturnDocument.BEFORE,
+    ) -> Optional[dict]:
+        with self._lock:
+            documents = [doc for doc in self._documents if _matches(doc, filter)]
+            for key, direction in reversed(sort or []):
+                documents.sort(key=lambda doc: doc.get(key), reverse=direction == pymongo.DESCENDING)
+            if not documents:
+                return None
+
+            before = deepcopy(documents[0])
+            _update(documents[0], update)
+            return deepcopy(documents[0]) if return_document == pymongo.ReturnDocument.AFTER else before
+
+    def update_one(self, filter: Mapping[str, Any], update: Mapping[str, Any]) -> UpdateResult:
+        with self._lock:
+            for doc in self._documents:
+                if _matches(doc, filter):
+                    _update(doc, update)
+                    return UpdateResult(1)
+            return UpdateResult(0)
+
+    def update_many(self, filter: Mapping[str, Any], update: Mapping[str, Any]) -> UpdateResult:
+        with self._lock:
+            count = 0
+            for doc in self._documents:
+                if _matches(doc, filter):
+                    _update(doc, update)
+                    count += 1
+            return UpdateResult(count)
+
+
+class CollectionManager(BaseManager):
+    pass
+
+
+CollectionManager.register("MemoryCollection", MemoryCollection)
+
+
+def _matches(doc: Mapping[str, Any], filter: Mapping[str, Any]) -> bool:
+    for key, expected in filter.items():
+        if key == "$or":
+            if not any(_matches(doc, f) for f in expected):
+                return False
+            continue
+
+        value = doc.get(key)
+        if isinstance(expected, Mapping):
+            for op, arg in expected.items():
+                if op == "$lt":
+                    if value is None or not value < arg:
+                        return False
+                elif op == "$gt":
+                    if value is None or not value > arg:
+                        return False
+                elif op == "$in":
+                    if value not in arg:
+                        return False
+                else:
+                    raise NotImplementedError(f"filter operator '{op}'")
+        elif value != expected:
+            return False
+
+    return True
+
+
+def _update(doc: dict, update: Mapping[str, Any]):
+    for op, values in update.items():
+        for key, value in values.items():
+            if op == "$set":
+                doc[key] = deepcopy(value)
+            elif op == "$inc":
+                doc[key] = doc.get(key, 0) + value
+            else:
+                raise NotImplementedError(f"update operator '{op}'")
+
+
+def _project(doc: Mapping[str, Any], projection) -> dict:
+    if projection is None:
+        return deepcopy(doc)
+    if isinstance(projection, Mapping):
+        excluded = {key for key, include in projection.items() if not include}
+        if excluded == set(projection):
+            return {key: deepcopy(value) for key, value in doc.items() if key not in excluded}
+        projection = [key for key, include in projection.items() if include]
+    return {key: deepcopy(doc[key]) for key in ["_id", *projection] if key in doc}
@@ -0,0 +1,149 @@
+import multiprocessing
+import time
+import unittest
+from types import SimpleNamespace
+from typing import Dict, List
+
+from bad.process.bulkwriter import BulkWriter
+
+
+class FakeCollection:
+
+    def __init__(self):
+        self.calls: List[tuple] = []
+        self.upserted: List[dict] = []
+
+    def insert_many(self, documents, ordered=True):
+        self.calls.append(("insert_many", list(documents)))
+
+    def bulk_write(self, requests, ordered=True):
+        self.calls.append(("bulk_write", [(r._filter, r._doc) for r in requests]))
+        upserted_ids = {}
+        for index, request in enumerate(requests):
+            if request._upsert and request._filter not in self.upserted:
+                self.upserted.append(request._filter)
+                upserted_ids[index] = len(self.upserted)
+        return SimpleNamespace(upserted_ids=upserted_ids)
+
+
+class FakeDatabase:
+
+    def __init__(self):
+        self.collections: Dict[str, FakeCollection] = {}
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        return self.collections.setdefault(name, FakeCollection())
+
+
+class QueueDatabase:
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def __getitem__(self, name: str):
+        db = self
+
+        class Collection:
+            def insert_many(self, documents, ordered=True):
+                for doc in documents:
+                    db.queue.put((name, doc))
+
+        return Collection()
+
+
+def _write_without_flush(queue):
+    writer = BulkWriter(lambda: QueueDatabase(queue))
+    writer.max_delay = 100
+    writer.insert("objects", {"i": 1})
+
+
+class TestBulkWriter(unittest.TestCase):
+
+    def test_100_size(self):
+        db = FakeDatabase()
+        writer = BulkWriter(lambda: db)
+        writer.max_documents = 3
+        writer.max_delay = 100
+
+        writer.insert("objects", {"i": 1})
+        writer.insert("events", {"i": 2})
+        self.assertEqual({}, db.collections)
+
+        writer.insert("objects", {"i": 3})
+        self.assertEqual([("insert_many", [{"i": 1}, {"i": 3}])], db["objects"].calls)
+        self.assertEqual([("insert_many", [{"i": 2}])], db["events"].calls)
+
+        writer.flush()
+        self.assertEqual(1, len(db["objects"].calls))
+
+    def test_200_merge_updates(self):
+        db = FakeDatabase()
+        writer = BulkWriter(lambda: db)
+        writer.max_delay = 100
+
+        writer.update("process", {"uuid": "p-1"}, {"progress": 1})
+        writer.update("process", {"uuid": "p-1"}, {"progress": 2, "status": "started"})
+        writer.update("process", {"uuid": "p-2"}, {"progress": 3})
+        writer.increment("process", {"uuid": "p-2"}, {"count.a": 1})
+        writer.increment("process", {"uuid": "p-2"}, {"count.a": 2, "count.b": 1})
+        writer.increment("process", {"uuid": "p-3"}, {"count.a": 1})
+        writer.flush()
+
+        self.assertEqual(
+            [("bulk_write", [
+                ({"uuid": "p-1"}, {"$set": {"progress": 2, "status": "started"}}),
+                ({"uuid": "p-2"}, {"$set": {"progress": 3}, "$inc": {"count.a": 3, "count.b": 1}}),
+                ({"uuid": "p-3"}, {"$inc": {"count.a": 1}}),
+            ])],
+            db["process"].calls,
+        )
+
+    def test_250_increment_once(self):
+        db = FakeDatabase()
+        writer = BulkWriter(lambda: db)
+        writer.max_delay = 100
+
+        writer.increment_once("markers", {"file": "a"}, "process", {"uuid": "p-1"}, {"count.a": 1})
+        writer.increment_once("markers", {"file": "a"}, "process", {"uuid": "p-1"}, {"count.a": 1})
+        writer.increment_once("markers", {"file": "b"}, "process", {"uuid": "p-1"}, {"count.a": 1})
+        writer.flush()
+        self.assertEqual(2, len(db["markers"].calls[0][1]))
+        self.assertEqual(
+            [("bulk_write", [({"uuid": "p-1"}, {"$inc": {"count.a": 2}})])],
+            db["process"].calls,
+        )
+
+        # the marker of "a" exists already
+        writer.increment_once("markers", {"file": "a"}, "process", {"uuid": "p-1"}, {"count.a": 1})
+        writer.increment_once("markers", {"file": "c"}, "process", {"uuid": "p-1"}, {"count.b": 1})
+        writer.flush()
+        self.assertEqual(
+            ("bulk_write", [({"uuid": "p-1"}, {"$inc": {"count.b": 1}})]),
+            db["process"].calls[-1],
+        )
+
+    def test_300_delay(self):
+        db = FakeDatabase()
+        writer = BulkWriter(lambda: db)
+        writer.max_delay = .05
+
+        writer.insert("objects", {"i": 1})
+        for i in range(100):
+            if db.collections:
+                break
+            time.sleep(.02)
+        self.assertEqual([("insert_many", [{"i": 1}])], db["objects"].calls)
+
+        writer.insert("objects", {"i": 2})
+        writer.close()
+        self.assertFalse(writer._thread.is_alive())
+        self.assertEqual(("insert_many", [{"i": 2}]), db["objects"].calls[-1])
+
+    @unittest.skipIf("fork" not in multiprocessing.get_all_start_methods(), "fork not available")
+    def test_400_flush_on_exit(self):
+        ctx = multiprocessing.get_context("fork")
+        queue = ctx.Queue()
+        process = ctx.Process(target=_write_without_flush, args=(queue, ))
+        process.start()
+        self.assertEqual(("objects", {"i": 1}), queue.get(timeout=30))
+        process.join()
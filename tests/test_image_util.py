@@ -1,4 +1,6 @@
+import tempfile
 import unittest
+from pathlib import Path
 
 import numpy as np
 
@@ -63,3 +65,144 @@ class TestImageUtil(BadTestCase):
             ],
             to_target_shape(ones, (1, 3, 4)).tolist(),
         )
+
+    def test_resample_plan_matches_nilearn(self):
+        import nibabel
+        from nilearn.image import resample_img
+        from bad.util.resample import resample_image, get_resample_plan
+
+        image = self.load_image_object("avg152T1_LR_nifti.nii.gz").src
+        rng = np.random.default_rng(23)
+        float_image = nibabel.Nifti1Image(
+            rng.normal(size=(20, 21, 22, 2)).astype("float32"), affine=np.diag([2., 2., 2., 1.]),
+        )
+        rotation = np.eye(4)
+        rotation[:2, :2] = [[np.cos(.3), -np.sin(.3)], [np.sin(.3), np.cos(.3)]]
+
+        for interpolation in ("nearest", "linear", "continuous"):
+            for img, target_shape, target_affine in (
+                    (image, (32, 32, 32), image.affine * np.array([91 / 32, 109 / 32, 91 / 32, 1])),
+                    (image, (40, 50, 40), rotation @ image.affine * np.array([2, 2, 2, 1])),
+                    (float_image, (13, 14, 15), np.diag([3.1, 3., 2.9, 1.])),
+            ):
+                expected = resample_img(
+                    img, target_shape=target_shape, target_affine=target_affine, interpolation=interpolation,
+                )
+                resampled = resample_image(img, target_shape, target_affine, interpolation)
+
+                expected_data = np.asanyarray(expected.dataobj)
+                resampled_data = np.asanyarray(resampled.dataobj)
+                self.assertEqual(expected.shape, resampled.shape)
+                self.assertEqual(expected_data.dtype, resampled_data.dtype)
+                np.testing.assert_allclose(expected.affine, resampled.affine)
+                # allow rounding differences of exact .5 values in integer data
+                self.assertLessEqual(
+                    np.count_nonzero(np.abs(expected_data.astype(float) - resampled_data) > 1e-5),
+                    expected_data.size // 10_000,
+                    f"{interpolation} {target_shape}",
+                )
+
+        self.assertIs(
+            get_resample_plan(image.shape, image.affine, (10, 10, 10), np.eye(4), "linear"),
+            get_resample_plan(image.shape, image.affine.copy(), (10, 10, 10), np.eye(4), "linear"),
+        )
+
+    def test_resample_plan_no_warnings(self):
+        import warnings
+        from bad.util.resample import resample_image
+
+        image = self.load_image_object("avg152T1_LR_nifti.nii.gz").src
+        with warnings.catch_warnings():
+            warnings.simplefilter("error")
+            resample_image(
+                image, (32, 32, 32), image.affine * np.array([91 / 32, 109 / 32, 91 / 32, 1]), "continuous",
+            )
+
+    def test_resample_images_batch(self):
+        import nibabel
+        from bad.util.resample import resample_image
+
+        image = self.load_image_object("avg152T1_LR_nifti.nii.gz").src
+        data = np.asanyarray(image.dataobj)
+        images = [
+            image,
+            nibabel.Nifti1Image(data[::-1].copy(), affine=image.affine),
+            nibabel.Nifti1Image(data.astype("float32") - 100, affine=image.affine),
+            nibabel.Nifti1Image(np.where(data > 100, np.nan, data).astype("float32"), affine=image.affine),
+        ]
+        for interpolation in ("nearest", "linear", "continuous"):
+            target_affine = image.affine * np.array([91 / 30, 109 / 30, 91 / 30, 1])
+            resampled = resample_images_to_shape(images, (30, 30, 30), interpolation=interpolation)
+
+            self.assertEqual(len(images), len(resampled))
+            for img, batch_img in zip(images, resampled):
+                expected = resample_image(img, (30, 30, 30), target_affine, interpolation)
+                np.testing.assert_allclose(expected.affine, batch_img.affine)
+                self.assertEqual(expected.get_data_dtype(), batch_img.get_data_dtype())
+                np.testing.assert_array_equal(
+                    np.asanyarray(expected.dataobj), np.asanyarray(batch_img.dataobj),
+                )
+
+    def test_restrict_to_region(self):
+        import nibabel
+        from bad.util.region import restrict_to_region, RegionArrayProxy
+
+        filename = str(self.DATA_PATH / "avg152T1_LR_nifti.nii.gz")
+        data = nibabel.load(filename).get_fdata()
+        region = np.s_[10:20, :, 30:31]
+        expected = np.zeros_like(data)
+        expected[region] = data[region]
+
+        image = restrict_to_region(nibabel.load(filename), region)
+        self.assertIsInstance(image.dataobj, RegionArrayProxy)
+        self.assertEqual(data.shape, image.shape)
+        np.testing.assert_array_equal(expected, image.get_fdata())
+
+        image = restrict_to_region(nibabel.load(filename), region)
+        # slicing inside the region reads from the file
+        np.testing.assert_array_equal(data[12:14, 5:, 30:31], image.dataobj[12:14, 5:, 30:31])
+        # slicing outside the region gives zeros
+        np.testing.assert_array_equal(expected[5:15], image.slicer[5:15].get_fdata())
+
+    def test_nibabel_to_numpy_float(self):
+        import nibabel
+
+        filename = str(self.DATA_PATH / "avg152T1_LR_nifti.nii.gz")
+        image = nibabel.load(filename)
+        data = nibabel_to_numpy_float(image)
+        self.assertEqual(np.float32, data.dtype)
+        # decoded without caching the data in the image
+        self.assertFalse(image.in_memory)
+        np.testing.assert_allclose(nibabel.load(filename).get_fdata(), data, rtol=1e-6)
+
+        int_data = np.arange(4 * 5 * 6, dtype="int16").reshape(4, 5, 6)
+        data = nibabel_to_numpy_float(nibabel.Nifti1Image(int_data, affine=np.eye(4)))
+        self.assertEqual(np.float32, data.dtype)
+        np.testing.assert_array_equal(int_data / 32, data)
+
+        # in-memory float32 data is copied
+        float_image = nibabel.Nifti1Image(np.ones((4, 5, 6), dtype="float32"), affine=np.eye(4))
+        data = nibabel_to_numpy_float(float_image)
+        data += 1
+        self.assertEqual(1., float_image.get_fdata().max())
+
+        # the cached float32 data of a scaled int16 image is not modified
+        with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+            filename = str(Path(tmp_dir) / "int16.nii")
+            int16_image = nibabel.Nifti1Image(np.full((4, 5, 6), 32, dtype="int16"), affine=np.eye(4))
+            int16_image.header.set_slope_inter(2., 0.)
+            nibabel.save(int16_image, filename)
+            int16_image = nibabel.load(filename)
+            self.assertEqual(64., int16_image.get_fdata(dtype=np.float32).max())
+            for i in range(2):
+                np.testing.assert_array_equal(np.full((4, 5, 6), 2.), nibabel_to_numpy_float(int16_image))
+            self.assertEqual(64., int16_image.get_fdata(dtype=np.float32).max())
+
+    def test_find_label_regions_indices(self):
+        labels = np.random.default_rng(23).integers(0, 5, (7, 9, 11))
+        values, counts, slices, indices = find_label_regions(labels, return_indices=True)
+        self.assertEqual([0, 1, 2, 3, 4], values.tolist())
+        for value, count, region_slices, region_indices in zip(values, counts, slices, indices):
+            self.assertEqual(count, len(region_indices))
+            np.testing.assert_array_equal(np.flatnonzero(labels == value), region_indices)
+            self.assertEqual(count, np.count_nonzero(labels[region_slices] == value))
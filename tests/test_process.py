@@ -102,3 +102,61 @@ class TestProcess(unittest.TestCase):
             self.assertEqual(EventType.INFO, events[1 + i]["type"])
             self.assertIn("pid", events[1 + i]["data"])
         self.assertEqual(EventType.FINISHED, events[1 + i + 1]["type"], f"Got: {events[1 + i + 1]}")
+
+    def test_objects_count(self):
+        db = ProcessDb()
+        proc = self.create_process(db, name="test-process-1")
+
+        def _object(source: str, target: str, target_module: str = "m-2") -> dict:
+            return {
+                "data_type": "image",
+                "actions": [
+                    {"data": {"filename": source}, "module": {"uuid": "m-1"}},
+                    {"data": {"filename": target}, "module": {"uuid": target_module}},
+                ],
+            }
+
+        proc.store_object(_object("a.nii", "a1.nii"))
+        proc.store_object(_object("a.nii", "a2.nii"))
+        proc.store_object(_object("a.nii", "a.nii", target_module="m-3"))
+        proc.store_object(_object("b.nii", "b1.nii"), skipped=True)
+
+        self.assertEqual(
+            {"source": {"m-1": 2}, "target": {"m-2": 3, "m-3": 1}},
+            db.get_objects_count(proc.uuid),
+        )
+
+        # a process document without counters is aggregated
+        db.collection().update_one({"uuid": proc.uuid}, {"$unset": {"object_count": ""}})
+        self.assertEqual(
+            {"source": {"m-1": 2}, "target": {"m-2": 3, "m-3": 1}},
+            db.get_objects_count(proc.uuid),
+        )
+
+    def test_objects_count_idempotent(self):
+        db = ProcessDb()
+        proc = self.create_process(db, name="test-process-1")
+
+        def _object(source: str, target: str) -> dict:
+            return {
+                "data_type": "image",
+                "actions": [
+                    {"data": {"filename": source}, "module": {"uuid": "m-1"}},
+                    {"data": {"filename": target}, "module": {"uuid": "m-2"}},
+                ],
+            }
+
+        proc.store_object(_object("a.nii", "a1.nii"))
+        # a retried work item in another instance
+        ProcessDb().get_process(proc.uuid).store_object(_object("a.nii", "a1.nii"))
+        # or after forgetting the counted files
+        proc.clear_counted_files()
+        proc.store_object(_object("a.nii", "a1.nii"))
+        proc.store_object(_object("b.nii", "b1.nii"))
+        self.assertEqual(
+            {"source": {"m-1": 2}, "target": {"m-2": 2}},
+            db.get_objects_count(proc.uuid),
+        )
+
+        proc.store_status(ProcessStatus.FINISHED)
+        self.assertNotIn(proc.uuid, proc.db._counted_files)
@@ -0,0 +1,100 @@
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+
+from bad.process import ProcessLog, read_log
+
+
+class TestProcessLog(unittest.TestCase):
+
+    def test_100_capture(self):
+        with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+            filename = Path(tmp_dir) / "logs" / "p-1.log"
+
+            with ProcessLog(filename, tail_lines=3) as log:
+                process = subprocess.Popen(
+                    [
+                        sys.executable, "-c",
+                        "import sys\n"
+                        "for i in range(10): print(f'line {i}')\n"
+                        "print('error', file=sys.stderr)\n"
+                    ],
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                )
+                log.capture(process.stdout, "stdout")
+                log.capture(process.stderr, "stderr")
+                process.wait()
+                log.join()
+
+                self.assertEqual("line 7\nline 8\nline 9", log.tail("stdout"))
+                self.assertEqual("error", log.tail("stderr"))
+
+            lines, offset = read_log(filename)
+            self.assertEqual(11, len(lines))
+            self.assertIn("line 0", lines)
+            self.assertEqual(filename.stat().st_size, offset)
+
+    def test_200_rotate(self):
+        with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+            filename = Path(tmp_dir) / "p-1.log"
+
+            with ProcessLog(filename, max_bytes=100, backup_count=2) as log:
+                for i in range(100):
+                    log.write_line(f"line {i:03d}")
+
+            self.assertLessEqual(filename.stat().st_size, 100)
+            self.assertTrue(filename.with_suffix(".log.2").exists())
+            self.assertFalse(filename.with_suffix(".log.3").exists())
+
+            lines, offset = read_log(filename)
+            self.assertEqual("line 099", lines[-1])
+
+            # a rotated file is read from the start
+            self.assertEqual((lines, offset), read_log(filename, offset + 1000))
+
+    def test_210_rotate_from_threads(self):
+        with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+            filename = Path(tmp_dir) / "p-1.log"
+
+            with ProcessLog(filename, max_bytes=1000, backup_count=1000) as log:
+                threads = [
+                    threading.Thread(
+                        target=lambda stream: [log.write_line(f"{stream} {i:04d}", stream) for i in range(1000)],
+                        args=(stream, ),
+                    )
+                    for stream in ("stdout", "stderr")
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+            lines = []
+            for log_filename in Path(tmp_dir).glob("p-1.log*"):
+                lines += log_filename.read_text().splitlines()
+            self.assertEqual(2000, len(lines))
+            self.assertEqual(2000, len(set(lines)))
+
+    def test_300_read_log(self):
+        with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+            filename = Path(tmp_dir) / "p-1.log"
+
+            self.assertEqual(([], 0), read_log(filename))
+
+            filename.write_text("first\nsecond\nincomple")
+            lines, offset = read_log(filename)
+            self.assertEqual(["first", "second"], lines)
+            self.assertEqual(13, offset)
+
+            with open(filename, "a") as fp:
+                fp.write("te\nlast\n")
+            lines, offset = read_log(filename, offset)
+            self.assertEqual(["incomplete", "last"], lines)
+
+            # tail
+            self.assertEqual(["last"], read_log(filename, -7)[0])
+            self.assertEqual(["incomplete", "last"], read_log(filename, -17)[0])
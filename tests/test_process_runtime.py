@@ -0,0 +1,65 @@
+import tempfile
+import time
+import unittest
+from pathlib import Path
+
+from bad import config
+from bad.process import ProcessLog
+from bad.process.runtime import ForkserverProcess, forkserver_available
+
+
+SCRIPT = """
+import sys
+import time
+from bad import config
+
+print("name", __name__)
+print("args", sys.argv[1:])
+print("data path", config.DATA_PATH)
+print("error", file=sys.stderr)
+if sys.argv[1] == "sleep":
+    time.sleep(30)
+exit(int(sys.argv[1]))
+"""
+
+
+@unittest.skipIf(not forkserver_available(), "forkserver not available")
+class TestForkserverProcess(unittest.TestCase):
+
+    def run_script(self, path: Path, *args: str) -> ForkserverProcess:
+        filename = path / "script.py"
+        filename.write_text(SCRIPT)
+        return ForkserverProcess([filename.name, *args], cwd=path)
+
+    def test_100_run(self):
+        with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            with config.ConfigOverload({"DATA_PATH": "/some/data"}):
+                process = self.run_script(tmp_dir, "0")
+
+            with ProcessLog(tmp_dir / "script.log") as log:
+                log.capture(process.stdout, "stdout")
+                log.capture(process.stderr, "stderr")
+                self.assertEqual(0, process.wait(30))
+                log.join()
+
+                self.assertEqual(
+                    "name __main__\nargs ['0']\ndata path /some/data",
+                    log.tail("stdout"),
+                )
+                self.assertEqual("error", log.tail("stderr"))
+
+    def test_200_return_code(self):
+        with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+            tmp_dir = Path(tmp_dir)
+            self.assertEqual(3, self.run_script(tmp_dir, "3").wait(30))
+            # exit(-9) as used by the processes' SIGTERM handlers
+            self.assertEqual(247, self.run_script(tmp_dir, "-9").wait(30))
+
+    def test_300_terminate(self):
+        with tempfile.TemporaryDirectory(prefix="bad-tests-") as tmp_dir:
+            process = self.run_script(Path(tmp_dir), "sleep")
+            self.assertIsNone(process.poll())
+            time.sleep(.1)
+            process.terminate()
+            self.assertEqual(-15, process.wait(30))
@@ -0,0 +1,92 @@
+import unittest
+
+from bad.process import ThroughputCounter, summarize_throughput
+
+
+class FakeProcessItem:
+
+    def __init__(self):
+        self.published = []
+
+    def store_worker_progress(self, worker: str, counts: dict):
+        self.published.append((worker, counts))
+
+
+class TestProgress(unittest.TestCase):
+
+    def test_100_counter(self):
+        item = FakeProcessItem()
+        counter = ThroughputCounter(item, worker="1")
+        counter.publish_interval = 100
+
+        counter.update(sources=1, targets=2)
+        counter.update(sources=2, targets=4, bytes=100)
+        self.assertEqual(1, len(item.published))
+        self.assertEqual("1", item.published[0][0])
+        self.assertEqual(1, item.published[0][1]["sources"])
+
+        counter.publish()
+        self.assertEqual(2, len(item.published))
+        self.assertEqual(
+            {"sources": 2, "skipped": 0, "targets": 4, "bytes": 100},
+            {key: item.published[1][1][key] for key in ("sources", "skipped", "targets", "bytes")},
+        )
+
+    def test_200_summarize(self):
+        summary = summarize_throughput({"source_object_count": {"m-1": 100}})
+        self.assertEqual(100, summary["sources_total"])
+        self.assertEqual(0, summary["sources_done"])
+        self.assertIsNone(summary["eta"])
+
+        summary = summarize_throughput({
+            "source_object_count": {"m-1": 60, "m-2": 40},
+            "worker_progress": {
+                "0": {"sources": 10, "skipped": 2, "targets": 20, "bytes": 2000, "started": 100., "updated": 110.},
+                "1": {"sources": 10, "skipped": 0, "targets": 20, "bytes": 1000, "started": 105., "updated": 115.},
+            },
+        })
+        self.assertEqual(100, summary["sources_total"])
+        self.assertEqual(20, summary["sources_done"])
+        self.assertEqual(2, summary["skipped"])
+        self.assertEqual(40, summary["targets"])
+        self.assertEqual(3000, summary["bytes"])
+        self.assertAlmostEqual(2., summary["sources_per_second"])
+        self.assertAlmostEqual(4., summary["objects_per_second"])
+        self.assertAlmostEqual(300., summary["bytes_per_second"])
+        self.assertAlmostEqual(15., summary["elapsed"])
+        self.assertAlmostEqual(40., summary["eta"])
+
+    def test_300_summarize_active_workers(self):
+        summary = summarize_throughput({
+            "source_object_count": {"m-1": 100},
+            "worker_progress": {
+                # skipped 40 sources quickly and processed 10
+                "0": {
+                    "sources": 50, "skipped_sources": 40, "skipped": 80, "targets": 20, "bytes": 0,
+                    "started": 100., "updated": 110., "finished": False,
+                },
+                # no more sources for this worker
+                "1": {
+                    "sources": 30, "skipped_sources": 0, "skipped": 0, "targets": 60, "bytes": 0,
+                    "started": 100., "updated": 101., "finished": True,
+                },
+            },
+        })
+        self.assertEqual(80, summary["sources_done"])
+        self.assertEqual(40, summary["skipped_sources"])
+        self.assertAlmostEqual(1., summary["sources_per_second"])
+        self.assertAlmostEqual(2., summary["objects_per_second"])
+        self.assertAlmostEqual(20., summary["eta"])
+
+        # the rates of finished workers are reported when all are finished
+        summary = summarize_throughput({
+            "source_object_count": {"m-1": 30},
+            "worker_progress": {
+                "1": {
+                    "sources": 30, "skipped_sources": 0, "skipped": 0, "targets": 60, "bytes": 0,
+                    "started": 100., "updated": 101., "finished": True,
+                },
+            },
+        })
+        self.assertAlmostEqual(30., summary["sources_per_second"])
+        self.assertEqual(0., summary["eta"])
@@ -0,0 +1,163 @@
+import threading
+import time
+import unittest
+
+from bad import config
+from bad.plugins.preprocess.preprocess_process import PreprocessingProcess
+from bad.process import ProcessPriority, ProcessResources
+from bad.process.notify import SchedulerWakeup, notify_scheduler
+from bad.process.scheduler import ResourceSlots, sort_requested, select_requested
+
+# register test processes
+from tests import process1
+
+
+class TestScheduler(unittest.TestCase):
+
+    def create_data(self, uuid: str, date: str, priority: int = ProcessPriority.NORMAL, cpus: int = 1) -> dict:
+        return {
+            "name": "test-process-1",
+            "uuid": uuid,
+            "date_created": date,
+            "priority": priority,
+            "resources": ProcessResources(cpus=cpus).to_dict(),
+        }
+
+    def test_100_resources(self):
+        self.assertEqual(
+            ProcessResources(cpus=1),
+            process1.Process1.get_resources({}),
+        )
+        self.assertEqual(
+            ProcessResources(cpus=3),
+            process1.Process1.get_resources({"plugin": {"num_processes": 3}}),
+        )
+
+    def test_200_slots(self):
+        slots = ResourceSlots(cpus=4, memory=10)
+        # too large processes can run alone
+        self.assertTrue(slots.fits(ProcessResources(cpus=8)))
+
+        slots.acquire(ProcessResources(cpus=2, memory=4))
+        self.assertTrue(slots.fits(ProcessResources(cpus=2, memory=6)))
+        self.assertFalse(slots.fits(ProcessResources(cpus=3)))
+        self.assertFalse(slots.fits(ProcessResources(cpus=1, memory=7)))
+
+        slots.release(ProcessResources(cpus=2, memory=4))
+        self.assertTrue(slots.is_empty)
+
+        # no memory limit
+        slots = ResourceSlots(cpus=4)
+        slots.acquire(ProcessResources(cpus=1, memory=100))
+        self.assertTrue(slots.fits(ProcessResources(cpus=1, memory=100)))
+
+    def test_300_select(self):
+        requested = [
+            self.create_data("batch", "2023-01-01", ProcessPriority.BATCH, cpus=2),
+            self.create_data("normal", "2023-01-03"),
+            self.create_data("interactive-2", "2023-01-05", ProcessPriority.INTERACTIVE),
+            self.create_data("interactive-1", "2023-01-04", ProcessPriority.INTERACTIVE),
+        ]
+        self.assertEqual(
+            ["interactive-1", "interactive-2", "normal", "batch"],
+            [p["uuid"] for p in sort_requested(requested)],
+        )
+
+        self.assertEqual(
+            ["interactive-1", "interactive-2", "normal", "batch"],
+            [p["uuid"] for p in select_requested(requested, ResourceSlots(cpus=8))],
+        )
+        self.assertEqual(
+            ["interactive-1", "interactive-2", "normal"],
+            [p["uuid"] for p in select_requested(requested, ResourceSlots(cpus=4))],
+        )
+
+        # already running
+        slots = ResourceSlots(cpus=4)
+        slots.acquire(ProcessResources(cpus=2))
+        self.assertEqual(
+            ["interactive-2", "normal"],
+            [p["uuid"] for p in select_requested(requested, slots, exclude_uuids={"interactive-1"})],
+        )
+
+        # the large process blocks the following ones until it fits
+        requested = [
+            self.create_data("large", "2023-01-01", cpus=4),
+            self.create_data("small", "2023-01-02"),
+        ]
+        self.assertEqual([], select_requested(requested, slots))
+        self.assertEqual(["large"], [p["uuid"] for p in select_requested(requested, ResourceSlots(cpus=4))])
+
+    def test_310_select_by_memory(self):
+        def preprocessing_data(uuid: str, date: str, module_names: list) -> dict:
+            kwargs = {"plugin": {"num_processes": 2, "modules": [{"name": name} for name in module_names]}}
+            return {
+                **self.create_data(uuid, date, ProcessPriority.BATCH),
+                "name": PreprocessingProcess.name,
+                "resources": PreprocessingProcess.get_resources(kwargs).to_dict(),
+            }
+
+        with config.ConfigOverload({
+            "PREPROCESS_MEMORY_PER_PROCESS": 2.,
+            "CAT12_MEMORY_PER_PROCESS": 6.,
+        }):
+            requested = [
+                preprocessing_data("cat12", "2023-01-01", ["image_resample", "cat12_preprocess"]),
+                preprocessing_data("resample", "2023-01-02", ["image_resample"]),
+            ]
+        self.assertEqual(
+            [ProcessResources(cpus=2, memory=12.), ProcessResources(cpus=2, memory=4.)],
+            [ProcessResources.from_dict(data["resources"]) for data in requested],
+        )
+
+        # enough CPUs but not enough memory for both
+        slots = ResourceSlots(cpus=16, memory=14)
+        self.assertEqual(["cat12"], [p["uuid"] for p in select_requested(requested, slots)])
+        slots = ResourceSlots(cpus=16, memory=16)
+        self.assertEqual(["cat12", "resample"], [p["uuid"] for p in select_requested(requested, slots)])
+
+        slots.acquire(ProcessResources(cpus=2, memory=12.))
+        self.assertEqual(["resample"], [p["uuid"] for p in select_requested(requested, slots, exclude_uuids={"cat12"})])
+
+    def test_400_wakeup(self):
+        wakeup = SchedulerWakeup(port=0)
+        try:
+            self.assertTrue(wakeup.port)
+            self.assertTrue(wakeup.is_listening)
+            self.assertFalse(wakeup.wait(.01))
+
+            # several notifications wake up once
+            notify_scheduler(wakeup.port)
+            notify_scheduler(wakeup.port)
+            self.assertTrue(wakeup.wait(1.))
+            self.assertFalse(wakeup.wait(.01))
+
+            # from another thread while waiting
+            timer = threading.Timer(.05, wakeup.notify)
+            timer.start()
+            start_time = time.time()
+            self.assertTrue(wakeup.wait(10.))
+            self.assertLess(time.time() - start_time, 5.)
+            timer.join()
+
+        finally:
+            wakeup.close()
+
+    def test_410_wakeup_without_port(self):
+        with config.ConfigOverload({"SCHEDULER_NOTIFY_PORT": 0}):
+            wakeup = SchedulerWakeup()
+        try:
+            self.assertFalse(wakeup.is_listening)
+            self.assertFalse(wakeup.wait(.01))
+
+            # finished runners still wake up the scheduler of the same process
+            timer = threading.Timer(.05, wakeup.notify)
+            timer.start()
+            start_time = time.time()
+            self.assertTrue(wakeup.wait(10.))
+            self.assertLess(time.time() - start_time, 5.)
+            timer.join()
+            self.assertFalse(wakeup.wait(.01))
+
+        finally:
+            wakeup.close()
@@ -0,0 +1,126 @@
+import multiprocessing
+import os
+import unittest
+from pathlib import Path
+
+from bad.process import ConcurrencyLimit, MemoryWatchdog, available_memory, process_tree_rss
+
+
+GB = 2 ** 30
+
+
+@unittest.skipIf(not Path("/proc/meminfo").exists(), "needs /proc")
+class TestMemoryInfo(unittest.TestCase):
+
+    def test_100_memory(self):
+        self.assertGreater(available_memory(), 0)
+        self.assertGreater(process_tree_rss(os.getpid()), 0)
+
+        # includes the child processes
+        proc = multiprocessing.Process(target=_sleep)
+        proc.start()
+        try:
+            self.assertGreater(process_tree_rss(os.getpid()), process_tree_rss(proc.pid))
+        finally:
+            proc.terminate()
+            proc.join()
+
+        self.assertIsNone(process_tree_rss(proc.pid))
+
+
+def _sleep():
+    import time
+    time.sleep(30)
+
+
+class TestMemoryWatchdog(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = multiprocessing.Manager()
+
+    def tearDown(self):
+        self.manager.shutdown()
+
+    def test_100_concurrency_limit(self):
+        concurrency = ConcurrencyLimit(self.manager, 3)
+        for i in range(3):
+            concurrency.register(i)
+        self.assertEqual([True, True, True], [concurrency.is_active(i) for i in range(3)])
+
+        concurrency.limit = 2
+        self.assertEqual([True, True, False], [concurrency.is_active(i) for i in range(3)])
+
+        # a finished worker makes room for a paused one
+        concurrency.unregister(0)
+        self.assertEqual([True, True], [concurrency.is_active(i) for i in (1, 2)])
+
+        concurrency.limit = 0
+        self.assertEqual(1, concurrency.limit)
+        concurrency.limit = 10
+        self.assertEqual(3, concurrency.limit)
+
+    def test_200_scale(self):
+        concurrency = ConcurrencyLimit(self.manager, 3)
+        for i in range(3):
+            concurrency.register(i)
+
+        memory = {"available": 10 * GB}
+        decisions = []
+        watchdog = MemoryWatchdog(
+            concurrency,
+            on_decision=lambda text, data: decisions.append(data),
+            min_available=2.,
+            read_rss=lambda pid: 1 * GB,
+            read_available=lambda: memory["available"],
+        )
+        watchdog.scale_up_delay = 0
+        watchdog.scale_down_delay = 0
+
+        # enough memory and all workers are active
+        self.assertIsNone(watchdog.check())
+
+        memory["available"] = 1 * GB
+        self.assertEqual("scale_down", watchdog.check()["action"])
+        self.assertEqual(2, concurrency.limit)
+        self.assertEqual("scale_down", watchdog.check()["action"])
+        self.assertEqual(1, concurrency.limit)
+        # the last worker is not paused
+        self.assertEqual("low_memory", watchdog.check()["action"])
+        self.assertIsNone(watchdog.check())
+        self.assertEqual(1, concurrency.limit)
+
+        # free memory must fit another worker
+        memory["available"] = int(2.5 * GB)
+        self.assertIsNone(watchdog.check())
+        memory["available"] = 4 * GB
+        self.assertEqual("scale_up", watchdog.check()["action"])
+        self.assertEqual(2, concurrency.limit)
+        self.assertEqual("scale_up", watchdog.check()["action"])
+        self.assertIsNone(watchdog.check())
+        self.assertEqual(3, concurrency.limit)
+
+        self.assertEqual(
+            ["scale_down", "scale_down", "low_memory", "scale_up", "scale_up"],
+            [d["action"] for d in decisions],
+        )
+        self.assertEqual({"0": GB, "1": GB, "2": GB}, decisions[0]["worker_rss"])
+        self.assertEqual(2, decisions[0]["workers"])
+
+    def test_300_scale_delay(self):
+        concurrency = ConcurrencyLimit(self.manager, 2)
+        concurrency.register(0)
+        concurrency.register(1)
+        watchdog = MemoryWatchdog(
+            concurrency,
+            on_decision=lambda text, data: None,
+            min_available=2.,
+            read_rss=lambda pid: GB,
+            read_available=lambda: GB,
+        )
+        watchdog.scale_down_delay = 0
+        self.assertEqual("scale_down", watchdog.check()["action"])
+
+        # not activated again right away
+        watchdog.read_available = lambda: 10 * GB
+        self.assertIsNone(watchdog.check())
+        self.assertEqual(1, concurrency.limit)
@@ -10,6 +10,12 @@ from bad.parallel import ThreadWorker, ProcessWorker
 def _process_callback(dir: str):
     (Path(dir) / str(uuid.uuid4())).write_text("1")
 
+
+def _cancellable_callback(dir: str, cancel_event):
+    while not cancel_event.wait(.1):
+        pass
+    (Path(dir) / f"cancelled-{uuid.uuid4()}").write_text("1")
+
 THREADS_JOBS_SCENARIOS = [
     (4, 10),
     (10, 4),
@@ -41,3 +47,18 @@ class TestWorker(unittest.TestCase):
 
                 pattern = str(Path(tmp_dir) / "*")
                 self.assertEqual(num_jobs, len(glob.glob(pattern)))
+
+    def test_cancel(self):
+        with tempfile.TemporaryDirectory(prefix="bad-test-worker") as tmp_dir:
+
+            with ProcessWorker(2) as pool:
+                for i in range(2):
+                    pool.put(_cancellable_callback, dir=tmp_dir, cancel_event=pool.cancel_event)
+                for i in range(10):
+                    pool.put(_process_callback, dir=tmp_dir)
+                time.sleep(.5)
+                pool.cancel()
+
+            # the running calls stopped and the waiting calls were skipped
+            self.assertEqual(2, len(glob.glob(str(Path(tmp_dir) / "cancelled-*"))))
+            self.assertLess(len(glob.glob(str(Path(tmp_dir) / "*"))), 12)
@@ -0,0 +1,197 @@
+import multiprocessing
+import os
+import threading
+import time
+import unittest
+
+from bad.process import WorkItemStatus, WorkQueue, WorkQueueWorker
+from tests.mongostandin import CollectionManager, MemoryCollection
+
+
+def _sleep_handler(item: dict):
+    time.sleep(item["payload"].get("sleep", 0.))
+
+
+def _run_worker(collection, name: str, lease_seconds: float):
+    queue = WorkQueue(collection, lease_seconds=lease_seconds)
+    worker = WorkQueueWorker(queue, name=name, handler=_sleep_handler)
+    # wait for items with expired leases as well
+    while not queue.is_finished("p-1"):
+        worker.run(until_empty=True)
+        time.sleep(.05)
+
+
+def _claim_and_die(collection, name: str, lease_seconds: float):
+    WorkQueue(collection, lease_seconds=lease_seconds).claim(name)
+    os._exit(0)
+
+
+class TestWorkQueue(unittest.TestCase):
+
+    def test_100_claim_complete(self):
+        queue = WorkQueue(MemoryCollection())
+        uuids = queue.publish("p-1", "preprocessing", [{"offset": i} for i in range(3)])
+        self.assertEqual(3, len(uuids))
+        self.assertEqual({WorkItemStatus.PENDING: 3}, queue.status_counts("p-1"))
+
+        item = queue.claim("w1")
+        self.assertEqual(uuids[0], item["uuid"])
+        self.assertEqual({"offset": 0}, item["payload"])
+        self.assertEqual(1, item["attempts"])
+        self.assertEqual("w1", item["worker"])
+
+        self.assertEqual(uuids[1], queue.claim("w2")["uuid"])
+        self.assertIsNone(queue.claim("w3", process_uuid="p-2"))
+
+        self.assertFalse(queue.complete(item, "w2"))
+        self.assertTrue(queue.complete(item, "w1"))
+        self.assertEqual(
+            {WorkItemStatus.DONE: 1, WorkItemStatus.CLAIMED: 1, WorkItemStatus.PENDING: 1},
+            queue.status_counts("p-1"),
+        )
+        self.assertFalse(queue.is_finished("p-1"))
+
+    def test_200_lease_expires(self):
+        queue = WorkQueue(MemoryCollection(), lease_seconds=.2)
+        queue.publish("p-1", "preprocessing", [{}])
+
+        item = queue.claim("w1")
+        self.assertIsNone(queue.claim("w2"))
+        self.assertTrue(queue.heartbeat(item, "w1"))
+
+        time.sleep(.3)
+        item2 = queue.claim("w2")
+        self.assertEqual(item["uuid"], item2["uuid"])
+        self.assertEqual(2, item2["attempts"])
+
+        # the first worker lost the item
+        self.assertFalse(queue.heartbeat(item, "w1"))
+        self.assertFalse(queue.complete(item, "w1"))
+        self.assertTrue(queue.complete(item2, "w2"))
+        self.assertTrue(queue.is_finished("p-1"))
+
+    def test_300_fail_and_retry(self):
+        queue = WorkQueue(MemoryCollection())
+        queue.max_attempts = 2
+        queue.publish("p-1", "preprocessing", [{}])
+
+        item = queue.claim("w1")
+        self.assertTrue(queue.fail(item, "w1", "first error"))
+        self.assertEqual({WorkItemStatus.PENDING: 1}, queue.status_counts("p-1"))
+
+        item = queue.claim("w2")
+        self.assertEqual(2, item["attempts"])
+        self.assertTrue(queue.fail(item, "w2", "second error"))
+        self.assertEqual({WorkItemStatus.FAILED: 1}, queue.status_counts("p-1"))
+        self.assertTrue(queue.is_finished("p-1"))
+        self.assertIsNone(queue.claim("w3"))
+
+        failed = queue.failed_items("p-1")
+        self.assertEqual(["second error"], [i["error"] for i in failed])
+        self.assertNotIn("_id", failed[0])
+
+    def test_400_cancel(self):
+        queue = WorkQueue(MemoryCollection())
+        queue.publish("p-1", "preprocessing", [{}, {}, {}])
+        queue.publish("p-2", "preprocessing", [{}])
+        item = queue.claim("w1")
+        queue.complete(queue.claim("w1"), "w1")
+
+        queue.cancel("p-1")
+        self.assertEqual(
+            {WorkItemStatus.DONE: 1, WorkItemStatus.CANCELLED: 2},
+            queue.status_counts("p-1"),
+        )
+        self.assertFalse(queue.heartbeat(item, "w1"))
+        self.assertEqual("p-2", queue.claim("w1")["process_uuid"])
+
+    def test_500_worker(self):
+        queue = WorkQueue(MemoryCollection(), lease_seconds=.3)
+        queue.publish("p-1", "preprocessing", [{"fail": True}, {"sleep": .5}])
+        calls = []
+
+        def _handler(item: dict):
+            calls.append(item["payload"])
+            if item["payload"].get("fail"):
+                raise ValueError("no!")
+            # while sleeping, the lease is renewed
+            time.sleep(item["payload"]["sleep"])
+            self.assertIsNone(queue.claim("other", process_uuid="p-1"))
+
+        queue.max_attempts = 1
+        worker = WorkQueueWorker(queue, name="w1", handler=_handler)
+        self.assertEqual(2, worker.run(until_empty=True))
+
+        self.assertEqual([{"fail": True}, {"sleep": .5}], calls)
+        self.assertEqual(
+            {WorkItemStatus.DONE: 1, WorkItemStatus.FAILED: 1},
+            queue.status_counts("p-1"),
+        )
+        self.assertIn("ValueError: no!", queue.failed_items("p-1")[0]["error"])
+
+    def test_550_worker_item_cancelled(self):
+        queue = WorkQueue(MemoryCollection(), lease_seconds=.15)
+        queue.publish("p-1", "preprocessing", [{}])
+        worker = WorkQueueWorker(queue, name="w1")
+        steps = []
+
+        def _handler(item: dict):
+            for i in range(100):
+                if worker.is_item_cancelled():
+                    break
+                steps.append(i)
+                if i == 2:
+                    queue.cancel("p-1")
+                time.sleep(.02)
+
+        worker.handler = _handler
+        self.assertEqual(1, worker.run(until_empty=True))
+        # the heartbeat notices the cancellation and the handler stops early
+        self.assertLess(len(steps), 100)
+        self.assertTrue(worker.is_item_cancelled())
+        self.assertEqual({WorkItemStatus.CANCELLED: 1}, queue.status_counts("p-1"))
+
+    def test_600_worker_threads(self):
+        queue = WorkQueue(MemoryCollection())
+        queue.publish("p-1", "preprocessing", [{"sleep": .01} for _ in range(50)])
+
+        workers = [WorkQueueWorker(queue, name=f"w{i}", handler=_sleep_handler) for i in range(4)]
+        counts = []
+        threads = [
+            threading.Thread(target=lambda w=w: counts.append(w.run(until_empty=True)))
+            for w in workers
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(50, sum(counts))
+        self.assertEqual({WorkItemStatus.DONE: 50}, queue.status_counts("p-1"))
+
+    def test_700_worker_processes(self):
+        lease_seconds = .5
+        with CollectionManager() as manager:
+            collection = manager.MemoryCollection()
+            queue = WorkQueue(collection, lease_seconds=lease_seconds)
+            queue.publish("p-1", "preprocessing", [{"sleep": .05} for _ in range(20)])
+
+            # a worker that dies after claiming the first item
+            proc = multiprocessing.Process(target=_claim_and_die, args=(collection, "dead", lease_seconds))
+            proc.start()
+            proc.join()
+
+            processes = [
+                multiprocessing.Process(target=_run_worker, args=(collection, f"w{i}", lease_seconds))
+                for i in range(3)
+            ]
+            for proc in processes:
+                proc.start()
+            for proc in processes:
+                proc.join()
+
+            # the item of the dead worker has been reclaimed after the lease expired
+            self.assertEqual({WorkItemStatus.DONE: 20}, queue.status_counts("p-1"))
+            items = collection.find({"process_uuid": "p-1"})
+            self.assertEqual(2, items[0]["attempts"])
+            self.assertNotIn("dead", {item["worker"] for item in items})